@@ -7,14 +7,17 @@ import tkinter.messagebox
 import customtkinter
 
 #gdsiistl
-import sys # read command-line arguments
-import gdspy # open gds file
-import numpy as np # fast math on lots of points
-from stl import mesh # write stl file (python package name is "numpy-stl")
-import triangle # triangulate polygons
+# the conversion (gdsiistl, gdsii_cache) pulls in gdspy, numpy-stl, triangle and
+# NumPy, so it is only imported when a conversion starts (see make_stls) to
+# keep the window opening quickly
+from gdsii_profile import report_path, load_report, summary # report of the last conversion
+from gdsii_blender import BLENDER_PORT, new_session_token, send_command, find_blender # Blender installation and session
 
 #call blender
 import threading
+import queue
+import traceback
+import multiprocessing
 import subprocess
 
 #find newest blender.exe installation
@@ -22,15 +25,14 @@ import glob
 def blender_path_search_function(pattern):
     return glob.glob(pattern)[-1]
 
-DEFAULT_BLENDER_PATH_PATTERN = r'C:\Program Files\Blender Foundation\Blender*\blender.exe'
-BLENDER_PATH = blender_path_search_function(DEFAULT_BLENDER_PATH_PATTERN)
-
 #find my path
 import os
 MY_PATH = os.path.dirname(__file__)
 
-with open(MY_PATH + '/saved/example.txt','w') as f:
-    f.write(f'''{MY_PATH}\\example\\example.gds
+def write_example_session():
+    # the example session points to the example layout in this folder, which
+    # is only known once installed; written when sessions are listed
+    example = f'''{MY_PATH}\\example\\example.gds
 1,83,SU8,100,500
 1,82,Gold,0,100
 1,15,Silicon,-100,0
@@ -40,269 +42,14 @@ with open(MY_PATH + '/saved/example.txt','w') as f:
 0,,Gold,,
 0,,Gold,,
 0,,Gold,,
-0,,Gold,,''')
-
-customtkinter.set_appearance_mode("System")  # Modes: "System" (standard), "Dark", "Light"
-customtkinter.set_default_color_theme("blue")  # Themes: "blue" (standard), "green", "dark-blue"
-
-def gdsiistl(gdsii_file_path, layerstack):
-    ########## CONFIGURATION (EDIT THIS PART) #####################################
-
-    # choose which GDSII layers to use
-    ########## INPUT ##############################################################
-
-    # First, the input file is read using the gdspy library, which interprets the
-    # GDSII file and formats the data Python-style.
-    # See https://gdspy.readthedocs.io/en/stable/index.html for documentation.
-    # Second, the boundaries of each shape (polygon or path) are extracted for
-    # further processing.
-
-    print('Reading GDSII file {}...'.format(gdsii_file_path))
-    gdsii = gdspy.GdsLibrary()
-    gdsii.read_gds(gdsii_file_path, units='import')
-
-    print('Extracting polygons...')
-    layers = {} # array to hold all geometry, sorted into layers
-
-    cells = gdsii.top_level() # get all cells that aren't referenced by another
-    for cell in cells: # loop through cells to read paths and polygons
-
-        # $$$CONTEXT_INFO$$$ is a separate, non-standard compliant cell added
-        # optionally by KLayout to store extra information not needed here.
-        # see https://www.klayout.de/forum/discussion/1026/very-
-        # important-gds-exported-from-k-layout-not-working-on-cadence-at-foundry
-        if cell.name == '$$$CONTEXT_INFO$$$':
-            continue # skip this cell
-
-        # combine will all referenced cells (instances, SREFs, AREFs, etc.)
-        cell = cell.flatten()
-
-        # loop through paths in cell
-        for path in cell.paths:
-            lnum = path.layers[0] # GDSII layer number
-            # create empty array to hold layer polygons if it doesn't yet exist
-            layers[lnum] = [] if not lnum in layers else layers[lnum]
-            # add paths (converted to polygons) that layer
-            for poly in path.get_polygons():
-                layers[lnum].append((poly, None, False))
-
-        # loop through polygons (and boxes) in cell
-        for polygon in cell.polygons:
-            lnum = polygon.layers[0] # same as before...
-            layers[lnum] = [] if not lnum in layers else layers[lnum]
-            for poly in polygon.polygons:
-                layers[lnum].append((poly, None, False))
-
-    """
-    At this point, "layers" is a Python dictionary structured as follows:
-
-    layers = {
-    0 : [ ([[x1, y1], [x2, y2], ...], None, False), ... ]
-    1 : [ ... ]
-    2 : [ ... ]
-    ...
-    }
-
-    Each dictionary key is a GDSII layer number (0-255), and the value of the
-    dictionary at that key (if it exists; keys were only created for layers with
-    geometry) is a list of polygons in that GDSII layer. Each polygon is a 3-tuple
-    whose first element is a list of points (2-element lists with x and y
-    coordinates), second element is None (for the moment; this will be used later),
-    and third element is False (whether the polygon is clockwise; will be updated).
-    """
-
-    ########## TRIANGULATION ######################################################
-
-    # An STL file is a list of triangles, so the polygons need to be filled with
-    # triangles. This is a surprisingly hard algorithmic problem, especially since
-    # there are few limits on what shapes GDSII file polygons can be. So we use the
-    # Python triangle library (documentation is at https://rufat.be/triangle/),
-    # which is a Python interface to a fast and well-written C library also called
-    # triangle (with documentation at https://www.cs.cmu.edu/~quake/triangle.html).
-
-    print('Triangulating polygons...')
-
-    num_triangles = {} # will store the number of triangles for each layer
-
-    # loop through all layers
-    for layer_number, polygons in layers.items():
-
-        # but skip layer if it won't be exported
-        if not layer_number in layerstack.keys():
-            continue
-
-        num_triangles[layer_number] = 0
-
-        # loop through polygons in layer
-        for index, (polygon, _, _) in enumerate(polygons):
-
-            num_polygon_points = len(polygon)
-
-            # determine whether polygon points are CW or CCW
-            area = 0
-            for i, v1 in enumerate(polygon): # loop through vertices
-                v2 = polygon[(i+1) % num_polygon_points]
-                area += (v2[0]-v1[0])*(v2[1]+v1[1]) # integrate area
-            clockwise = area > 0
-
-            # GDSII implements holes in polygons by making the polygon edge
-            # wrap into the hole and back out along the same line. However,
-            # this confuses the triangulation library, which fills the holes
-            # with extra triangles. Avoid this by moving each edge back a
-            # very small amount so that no two edges of the same polygon overlap.
-            delta = 0.01 # inset each vertex by this much (smaller has broken one file)
-            points_i = polygon # get list of points
-            points_j = np.roll(points_i, -1, axis=0) # shift by 1
-            points_k = np.roll(points_i, 1, axis=0) # shift by -1
-            # calculate normals for each edge of each vertex (in parallel, for speed)
-            normal_ij = np.stack((points_j[:, 1]-points_i[:, 1],
-                                points_i[:, 0]-points_j[:, 0]), axis=1)
-            normal_ik = np.stack((points_i[:, 1]-points_k[:, 1],
-                                points_k[:, 0]-points_i[:, 0]), axis=1)
-            length_ij = np.linalg.norm(normal_ij, axis=1)+0.00000001
-            length_ik = np.linalg.norm(normal_ik, axis=1)+0.00000001
-            normal_ij /= np.stack((length_ij, length_ij), axis=1)
-            normal_ik /= np.stack((length_ik, length_ik), axis=1)
-            if clockwise:
-                normal_ij = -1*normal_ij
-                normal_ik = -1*normal_ik
-            # move each vertex inward along its two edge normals
-            polygon = points_i - delta*normal_ij - delta*normal_ik
-
-            # In an extreme case of the above, the polygon edge doubles back on
-            # itself on the same line, resulting in a zero-width segment. I've
-            # seen this happen, e.g., with a capital "N"-shaped hole, where
-            # the hole split line cuts out the "N" shape but splits apart to
-            # form the triangle cutout in one side of the shape. In any case,
-            # simply moving the polygon edges isn't enough to deal with this;
-            # we'll additionally mark points just outside of each edge, between
-            # the original edge and the delta-shifted edge, as outside the polygon.
-            # These parts will be removed from the triangulation, and this solves
-            # just this case with no adverse affects elsewhere.
-            hole_delta = 0.001 # small fraction of delta
-            holes = 0.5*(points_j+points_i) - hole_delta*delta*normal_ij
-            # HOWEVER: sometimes this causes a segmentation fault in the triangle
-            # library. I've observed this as a result of certain various polygons.
-            # Frustratingly, the fault can be bypassed by *rotating the polygons*
-            # by like 30 degrees (exact angle seems to depend on delta values) or
-            # moving one specific edge outward a bit. I have absolutely no idea
-            # what is wrong. In the interest of stability over full functionality,
-            # this is disabled. TODO: figure out why this happens and fix it.
-            use_holes = False
-
-            # triangulate: compute triangles to fill polygon
-            point_array = np.arange(num_polygon_points)
-            edges = np.transpose(np.stack((point_array, np.roll(point_array, 1))))
-            if use_holes:
-                triangles = triangle.triangulate(dict(vertices=polygon,
-                                                    segments=edges,
-                                                    holes=holes), opts='p')
-            else:
-                triangles = triangle.triangulate(dict(vertices=polygon,
-                                                    segments=edges), opts='p')
-
-            if not 'triangles' in triangles.keys():
-                triangles['triangles'] = []
-
-            # each line segment will make two triangles (for a rectangle), and the polygon
-            # triangulation will be copied on the top and bottom of the layer.
-            num_triangles[layer_number] += num_polygon_points*2 + \
-                                        len(triangles['triangles'])*2
-            polygons[index] = (polygon, triangles, clockwise)
-
-    """
-    At this point, "layers" is as follows:
-
-    layers = {
-    0 : [ ([[x1, y1], [x2, y2], ...],
-            {'vertices': [[x1, y1], ...], 'triangles': [[0, 1, 2], ...], ...},
-            clockwise), ... ]
-    1 : [ ... ]
-    2 : [ ... ]
-    ...
-    }
-
-    Each dictionary key is a GDSII layer number (0-255), and the value of the
-    dictionary at that key (if it exists; keys were only created for layers with
-    geometry) is a list of polygons in that GDSII layer. Each polygon has 3 parts:
-    First, a list of vertices, as before. Second, a dictionary with triangulation
-    information: the 'vertices' element contains vertex information stored the
-    same way as the main polygon vertices, and the 'triangles' element is a list
-    of which vertices correspond to which triangle (in counterclockwise order).
-    Third and finally, a boolean value that indicates whether the polygon was
-    defined clockwise (so that the STL triangles are oriented correctly).
-    """
-
-    ########## EXTRUSION ##########################################################
-
-    # Finally, now that we have polygon boundaries and triangulations, we can
-    # write it to an STL file. To make this fast (given there could be tens of
-    # thousands of triangles), we use the numpy-stl library, which uses numpy
-    # for somewhat accelerated vector math. See the documentation at
-    # (https://numpy-stl.readthedocs.io/en/latest/)
-
-    print('Extruding polygons and writing to files...')
-
-    # loop through all layers
-    for layer in layers:
-
-        # but skip layer if it won't be exported
-        if not layer in layerstack.keys():
-            continue
-
-        # Make a list of triangles.
-        # This data contains vertex xyz position data as follows:
-        # layer_mesh_data['vectors'] = [ [[x1,y1,z1], [x2,y2,z1], [x3,y3,z3]], ...]
-        layer_mesh_data = np.zeros(num_triangles[layer], dtype=mesh.Mesh.dtype)
-
-        layer_pointer = 0
-        for index, (polygon, triangles, clockwise) in enumerate(layers[layer]):
-
-            # The numpy-stl library expects counterclockwise triangles. That is,
-            # one side of each triangle is the outside surface of the STL file
-            # object (assuming a watertight volume), and the other side is the
-            # inside surface. If looking at a triangle from the outside, the
-            # vertices should be in counterclockwise order. Failure to do so may
-            # cause certain STL file display programs to not display the
-            # triangles correctly (e.g., the backward triangles will be invisible).
-
-            zmin, zmax, layername = layerstack[layer]
-
-            # make a list of triangles around the polygon boundary
-            points_i = polygon # list of 2D vertices
-            if clockwise: # order polygon 2D vertices counter-clockwise
-                points_i = np.flip(polygon, axis=0)
-            points_i_min = np.insert(points_i, 2, zmin, axis=1) # bottom left
-            points_i_max = np.insert(points_i, 2, zmax, axis=1) # top left
-            points_j_min = np.roll(points_i_min, -1, axis=0) # bottom right
-            points_j_max = np.roll(points_i_max, -1, axis=0) # top right
-            rights = np.stack((points_i_min, points_j_min, points_j_max), axis=1)
-            lefts = np.stack((points_j_max, points_i_max, points_i_min), axis=1)
-
-            # make a list of polygon interior (face) triangles
-            vs = triangles['vertices']
-            ts = triangles['triangles']
-            if len(ts) > 0:
-                face_tris = np.take(vs, ts, axis=0)
-                top = np.insert(face_tris, 2, zmax, axis=2) # list of top triangles
-                bottom = np.insert(face_tris, 2, zmin, axis=2) # list of bottom ~
-                bottom = np.flip(bottom, axis=1) # reverse vertex order to make CCW
-                faces = np.concatenate((lefts, rights, top, bottom), axis=0)
-            else: # didn't generate any triangles! (degenerate edge case)
-                faces = np.concatenate((lefts, rights), axis=0)
-
-            # add side and face triangles to layer mesh
-            layer_mesh_data['vectors'][layer_pointer:(layer_pointer+len(faces))] = faces
-            layer_pointer += len(faces)
-
-        # save layer to STL file
-        empty_file_path = '\\'.join(gdsii_file_path.replace('/','\\').split('\\')[:-1]) + '\\'
-        filename = empty_file_path.replace('.','_') + f'{layername}.stl'
-        print('    ({}, {}) to {}'.format(layer, layername, filename))
-        layer_mesh_object = mesh.Mesh(layer_mesh_data, remove_empty_areas=False)
-        layer_mesh_object.save(filename)
-
-    print('Done.')
+0,,Gold,,'''
+    path = MY_PATH + '/saved/example.txt'
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            if f.read() == example:
+                return
+    with open(path, 'w') as f:
+        f.write(example)
 
 class App(customtkinter.CTk):
 
@@ -310,7 +57,29 @@ class App(customtkinter.CTk):
     HEIGHT = 780
     lb = list(range(10))
     gdsii_file_path = ''
-    selected_blender_path = BLENDER_PATH
+    selected_blender_path = None # found by find_blender() when Blender is first opened
+    conversion = None # background conversion thread, while one runs
+    blender_process = None # Blender session started by open_blender()
+    blender_token = None # token of that session, which it needs in every command
+    conversion_settings = dict(
+        workers=None, # triangulation worker processes, None = all cores
+        hierarchy=False, # triangulate each referenced cell once instead of flattening
+        cache=False, # reuse triangulations stored on disk by earlier conversions
+        geometry_cache=False, # reuse the layers read from the same GDSII file by earlier conversions
+        incremental=False, # only convert layers that changed since the last conversion
+        streaming=False, # read only the selected layers from the GDSII file
+        merge=False, # merge overlapping polygons of each layer before extruding
+        engine='triangle', # triangulation engine: 'triangle', 'earcut', or 'auto' (earcut for small polygons)
+        simplify=None, # tolerance (layout units) for removing vertices from curves, None = off
+        output_format='stl', # 'stl', or 'npz' for compact indexed meshes
+        instances=False, # write each cell once with its placements, for instancing in Blender
+        mapped_output=False, # extrude STL triangles straight into the memory-mapped file
+        lod=False, # also write coarse preview meshes that Blender opens first
+        profile=False, # save a cProfile dump of the slowest stage with the report
+        blender_session=False, # keep one Blender open and update it instead of starting a new one
+        link_materials=False, # link the materials of materials.blend into Blender instead of appending them
+    )
+    blender_settings = ('blender_session', 'link_materials') # used by open_blender(), not by gdsiistl()
 
     material_options = [
         'Gold',
@@ -398,6 +167,27 @@ class App(customtkinter.CTk):
                                                 command=self.change_blender_path)
         self.button_5.grid(row=6, column=0, pady=10, padx=20)
         
+        #Conversion settings button
+        self.button_6 = customtkinter.CTkButton(master=self.frame_left,
+                                                text="Conversion\n\nsettings",
+                                                fg_color=("gray75", "gray30"),  # <- custom tuple-color
+                                                command=self.change_conversion_settings)
+        self.button_6.grid(row=7, column=0, pady=10, padx=20)
+
+        #Conversion progress
+        self.label_progress = customtkinter.CTkLabel(master=self.frame_left,
+                                              text="",
+                                              text_font=("Roboto Medium", -11),
+                                              justify=tkinter.LEFT)
+        self.label_progress.grid(row=8, column=0, pady=10, padx=10)
+
+        #Conversion report button
+        self.button_7 = customtkinter.CTkButton(master=self.frame_left,
+                                                text="Conversion\n\nreport",
+                                                fg_color=("gray75", "gray30"),  # <- custom tuple-color
+                                                command=self.show_report)
+        self.button_7.grid(row=9, column=0, pady=10, padx=20)
+        
         #Test button
         # self.button_5 = customtkinter.CTkButton(master=self.frame_left,
         #                                         text="Testing\n\nView GDSII file",
@@ -474,6 +264,7 @@ class App(customtkinter.CTk):
 
     def load(self):
         # find saved configurations
+        write_example_session()
         saves = glob.glob(MY_PATH+r'/saved/*.txt')
         print(f'Found save files:\n{saves}')
         if len(saves) > 0:
@@ -634,29 +425,116 @@ class App(customtkinter.CTk):
         self.data_string = data_string
 
     def make_stls(self):
+        if self.conversion is not None:
+            return # already converting
+        from gdsiistl import gdsiistl, session_layerstack, ConversionCancelled # GDSII to STL conversion
+
         #Check which layers are needed and write according dictionary
-        layerstack = {}
-        
-        for b in self.lb:
-            check,entry,material,lbound,ubound = b
-            
-            active = check.get()
-            
-            #input checks
-            if active:
-                layer = int(entry.get())
-                layerstack[layer] = (0,100,f'gdsii_{layer}')
+        self.setget_data()
+        layerstack = session_layerstack(self.data)
 
         gdsii_file_path = self.gdsii_file_path_button.text.replace('\n','')
 
         print(f'Building stl files...')
         print(layerstack)
-        gdsiistl(gdsii_file_path,layerstack)
-        
+
+        # convert in a background thread so that the window keeps responding;
+        # progress comes back through a queue that the main loop polls, since
+        # tkinter may only be used from this thread
+        self.conversion_events = queue.Queue()
+        self.conversion_cancel = threading.Event()
+        self.conversion_gdsii_file_path = gdsii_file_path
+        settings = {name: value for name, value in self.conversion_settings.items()
+                    if name not in self.blender_settings}
+        def convert():
+            try:
+                gdsiistl(gdsii_file_path, layerstack, progress=self.conversion_events.put,
+                         cancel=self.conversion_cancel, **settings)
+                self.conversion_events.put(dict(stage='finished'))
+            except ConversionCancelled:
+                self.conversion_events.put(dict(stage='cancelled'))
+            except Exception as error:
+                traceback.print_exc()
+                self.conversion_events.put(dict(stage='failed', error=str(error)))
+
+        self.conversion = threading.Thread(target=convert, daemon=True)
+        self.conversion.start()
+        self.button_1.configure(text="Cancel\n\nconversion", command=self.cancel_conversion)
+        self.label_progress.configure(text='Reading GDSII file...')
+        self.after(100, self.poll_conversion)
+
+    def poll_conversion(self):
+        # show the latest progress event of the background conversion
+        event = None
+        while not self.conversion_events.empty():
+            event = self.conversion_events.get_nowait()
+            if event['stage'] in ('finished', 'cancelled', 'failed'):
+                break
+
+        if event is None:
+            pass
+        elif event['stage'] in ('finished', 'cancelled', 'failed'):
+            text = dict(finished='Conversion done.', cancelled='Conversion cancelled.',
+                        failed='Conversion failed:\n{}'.format(event.get('error')))[event['stage']]
+            if event['stage'] == 'finished':
+                # total time and slowest stage from the report (see gdsii_profile)
+                try:
+                    report = load_report(report_path(self.conversion_gdsii_file_path))
+                except (OSError, ValueError):
+                    report = None
+                if report is not None:
+                    text = 'Conversion done in {:.1f} s.'.format(report['seconds'])
+                    if report['slowest_stage'] is not None:
+                        text += '\nslowest: {} ({:.1f} s)'.format(
+                            report['slowest_stage'], report['stages'][report['slowest_stage']]['wall'])
+            self.label_progress.configure(text=text)
+            self.conversion.join()
+            self.conversion = None
+            self.button_1.configure(text="Convert\n\nGDSII to STL files", command=self.make_stls)
+            return
+        else:
+            units = 'triangles' if event['stage'] == 'write' else 'polygons'
+            text = dict(read='Read', triangulate='Triangulating', write='Writing')[event['stage']]
+            if 'layer' in event:
+                text += ' layer {}'.format(event['layer'])
+            text += '\n{}/{} {}'.format(event['done'], event['total'], units)
+            if event['eta'] is not None:
+                text += '\nabout {:.0f} s left'.format(event['eta'])
+            if not self.conversion_cancel.is_set():
+                self.label_progress.configure(text=text)
+        self.after(100, self.poll_conversion)
+
+    def show_report(self):
+        # the report of the last conversion of the selected GDSII file
+        gdsii_file_path = self.gdsii_file_path_button.text.replace('\n','')
+        try:
+            report = load_report(report_path(gdsii_file_path))
+        except (OSError, ValueError):
+            self.label_progress.configure(text='No conversion report yet.')
+            return
+        self.report_win = customtkinter.CTkToplevel()
+        self.report_win.wm_title("Conversion report")
+        text = tkinter.Text(self.report_win, width=100, height=30, font=("Courier", 10))
+        text.insert('end', '{}\n{}\n\n{}\n\nFull report: {}'.format(
+            report['gds'], report['date'], summary(report), report_path(gdsii_file_path)))
+        text.configure(state='disabled')
+        text.grid(row=0, column=0, pady=10, padx=10, sticky="nswe")
+
+    def cancel_conversion(self):
+        # the conversion stops at its next progress event (between chunks)
+        self.conversion_cancel.set()
+        self.label_progress.configure(text='Cancelling...')
+
     def open_blender(self):
         gdsii_file_path = self.gdsii_file_path_button.text.replace('\n','')
-        stl_folder = '\\'.join(gdsii_file_path.replace('/','\\').split('\\')[:-1])
+        stl_folder = os.path.dirname(os.path.abspath(gdsii_file_path)) # see gdsiistl.output_path
         print(stl_folder)
+        if self.selected_blender_path is None:
+            self.selected_blender_path = find_blender()
+            if self.selected_blender_path is None:
+                print('Blender was not found, please set its path')
+                self.change_blender_path()
+                return
 
         cmd = [
             self.selected_blender_path,
@@ -671,14 +549,42 @@ class App(customtkinter.CTk):
             ','.join([material.get() for _,_,material,_,_ in self.lb][::-1]),
             ','.join([f'({lbound.get()};{ubound.get()})' for _,_,_,lbound,ubound in self.lb][::-1]),
         ]
+        if self.conversion_settings['link_materials']:
+            cmd.append('--link-materials')
         print(cmd)
         blender_call = lambda cmd=cmd : subprocess.call(cmd, shell=False)
 
+        if self.conversion_settings['blender_session']:
+            # Send the layer stack to the Blender that is open already (see
+            # gdsii_blender); it only imports the layers whose files changed and
+            # sets the materials and heights of the others. The first time,
+            # Blender is started with the port to listen on and a new token
+            # that it requires in every command.
+            layers = [[entry.get(), material.get(), lbound.get(), ubound.get()]
+                      for check,entry,material,lbound,ubound in self.lb[::-1] if check.get() and entry.get() != '']
+            def blender_call(cmd=cmd):
+                try:
+                    if self.blender_token is None:
+                        raise ConnectionRefusedError('no Blender session started')
+                    reply = send_command('sync', self.blender_token, folder=stl_folder, layers=layers)
+                    print(f"Blender updated in {reply['seconds']:.2f} s, imported layers: {reply['imported']}")
+                except RuntimeError as error:
+                    print(f'Blender could not update the layers: {error}')
+                except OSError: # no Blender session listening
+                    if self.blender_process is not None and self.blender_process.poll() is None:
+                        print('Blender is still starting...')
+                    else:
+                        self.blender_token = new_session_token()
+                        self.blender_process = subprocess.Popen(
+                            cmd + ['--port', str(BLENDER_PORT), '--token', self.blender_token], shell=False)
+
         t = threading.Thread(target=blender_call)
         t.daemon = True # close pipe if GUI process exits
         t.start()
 
     def on_closing(self, event=0):
+        if self.conversion is not None:
+            self.conversion_cancel.set()
         self.destroy()
 
     def change_blender_path(self, event=None):
@@ -712,8 +618,8 @@ class App(customtkinter.CTk):
     def check_blender_path(self):
         try:
             checking_blender_path_pattern = self.blender_path_entry.get()
-            if not checking_blender_path_pattern.endswith('blender.exe'):
-                self.label_blender_path.configure(text='Please include the "blender.exe" at the end of the path.')
+            if not checking_blender_path_pattern.lower().endswith(('blender.exe', 'blender')):
+                self.label_blender_path.configure(text='Please include the "blender.exe" (or "blender") at the end of the path.')
             else:
                 checking_blender_path = blender_path_search_function(checking_blender_path_pattern)
                 
@@ -724,8 +630,8 @@ class App(customtkinter.CTk):
     def save_blender_path(self):
         try:
             selected_blender_path_pattern = self.blender_path_entry.get()
-            if not selected_blender_path_pattern.endswith('blender.exe'):
-                self.label_blender_path.configure(text='Please include the "blender.exe" at the end of the path.')
+            if not selected_blender_path_pattern.lower().endswith(('blender.exe', 'blender')):
+                self.label_blender_path.configure(text='Please include the "blender.exe" (or "blender") at the end of the path.')
             else:
                 self.selected_blender_path = blender_path_search_function(selected_blender_path_pattern)
 
@@ -734,6 +640,153 @@ class App(customtkinter.CTk):
         except:
             self.label_blender_path.configure(text='This path is not valid...')
 
+    def change_conversion_settings(self, event=None):
+        self.conversion_settings_win = customtkinter.CTkToplevel()
+        self.conversion_settings_win.wm_title("Conversion settings")
+
+        self.label_conversion_settings = customtkinter.CTkLabel(master=self.conversion_settings_win,
+                                              text="Worker processes for triangulation\n(empty = all cores, 0 = no separate processes)",
+                                              text_font=("Roboto Medium", -12))  # font name and size in px
+        self.label_conversion_settings.grid(row=0, column=0, pady=10, padx=10)
+
+        self.workers_entry = customtkinter.CTkEntry(master=self.conversion_settings_win,
+            placeholder_text="all cores")
+        self.workers_entry.grid(row=1, column=0, pady=0, padx=0, sticky="n")
+        if self.conversion_settings['workers'] is not None:
+            self.setentry(self.workers_entry, self.conversion_settings['workers'])
+
+        self.hierarchy_switch = customtkinter.CTkSwitch(master=self.conversion_settings_win,
+                                                text="Keep cell hierarchy (triangulate each cell once)")
+        self.hierarchy_switch.grid(row=2, column=0, pady=10, padx=20, sticky="w")
+        if self.conversion_settings['hierarchy']:
+            self.hierarchy_switch.select()
+
+        self.cache_switch = customtkinter.CTkSwitch(master=self.conversion_settings_win,
+                                                text="Cache triangulations on disk")
+        self.cache_switch.grid(row=3, column=0, pady=10, padx=20, sticky="w")
+        if self.conversion_settings['cache']:
+            self.cache_switch.select()
+
+        self.geometry_cache_switch = customtkinter.CTkSwitch(master=self.conversion_settings_win,
+                                                text="Cache the layers read from the GDSII file")
+        self.geometry_cache_switch.grid(row=4, column=0, pady=10, padx=20, sticky="w")
+        if self.conversion_settings['geometry_cache']:
+            self.geometry_cache_switch.select()
+
+        self.incremental_switch = customtkinter.CTkSwitch(master=self.conversion_settings_win,
+                                                text="Only convert layers that changed")
+        self.incremental_switch.grid(row=5, column=0, pady=10, padx=20, sticky="w")
+        if self.conversion_settings['incremental']:
+            self.incremental_switch.select()
+
+        self.streaming_switch = customtkinter.CTkSwitch(master=self.conversion_settings_win,
+                                                text="Fast reader (reads only the selected layers)")
+        self.streaming_switch.grid(row=6, column=0, pady=10, padx=20, sticky="w")
+        if self.conversion_settings['streaming']:
+            self.streaming_switch.select()
+
+        self.merge_switch = customtkinter.CTkSwitch(master=self.conversion_settings_win,
+                                                text="Merge overlapping polygons of each layer")
+        self.merge_switch.grid(row=7, column=0, pady=10, padx=20, sticky="w")
+        if self.conversion_settings['merge']:
+            self.merge_switch.select()
+
+        self.earcut_switch = customtkinter.CTkSwitch(master=self.conversion_settings_win,
+                                                text="Ear clipping for small polygons (faster triangulation)")
+        self.earcut_switch.grid(row=8, column=0, pady=10, padx=20, sticky="w")
+        if self.conversion_settings['engine'] == 'auto':
+            self.earcut_switch.select()
+
+        self.indexed_switch = customtkinter.CTkSwitch(master=self.conversion_settings_win,
+                                                text="Write compact indexed meshes (.npz) instead of STL")
+        self.indexed_switch.grid(row=9, column=0, pady=10, padx=20, sticky="w")
+        if self.conversion_settings['output_format'] == 'npz':
+            self.indexed_switch.select()
+
+        self.instances_switch = customtkinter.CTkSwitch(master=self.conversion_settings_win,
+                                                text="Repeated cells as Blender instances (turns on hierarchy)")
+        self.instances_switch.grid(row=10, column=0, pady=10, padx=20, sticky="w")
+        if self.conversion_settings['instances']:
+            self.instances_switch.select()
+
+        self.mapped_switch = customtkinter.CTkSwitch(master=self.conversion_settings_win,
+                                                text="Write STL files through a memory map (less memory)")
+        self.mapped_switch.grid(row=11, column=0, pady=10, padx=20, sticky="w")
+        if self.conversion_settings['mapped_output']:
+            self.mapped_switch.select()
+
+        self.lod_switch = customtkinter.CTkSwitch(master=self.conversion_settings_win,
+                                                text="Also write coarse previews for huge layouts")
+        self.lod_switch.grid(row=12, column=0, pady=10, padx=20, sticky="w")
+        if self.conversion_settings['lod']:
+            self.lod_switch.select()
+
+        self.profile_switch = customtkinter.CTkSwitch(master=self.conversion_settings_win,
+                                                text="Profile the slowest stage (cProfile)")
+        self.profile_switch.grid(row=13, column=0, pady=10, padx=20, sticky="w")
+        if self.conversion_settings['profile']:
+            self.profile_switch.select()
+
+        self.blender_session_switch = customtkinter.CTkSwitch(master=self.conversion_settings_win,
+                                                text="Keep Blender open and update it live")
+        self.blender_session_switch.grid(row=14, column=0, pady=10, padx=20, sticky="w")
+        if self.conversion_settings['blender_session']:
+            self.blender_session_switch.select()
+
+        self.link_materials_switch = customtkinter.CTkSwitch(master=self.conversion_settings_win,
+                                                text="Link materials instead of copying them into Blender")
+        self.link_materials_switch.grid(row=15, column=0, pady=10, padx=20, sticky="w")
+        if self.conversion_settings['link_materials']:
+            self.link_materials_switch.select()
+
+        l = customtkinter.CTkLabel(master=self.conversion_settings_win,
+                                   text="Simplify curves: tolerance in layout units (empty = off)",
+                                   text_font=("Roboto Medium", -12))  # font name and size in px
+        l.grid(row=16, column=0, pady=10, padx=10)
+        self.simplify_entry = customtkinter.CTkEntry(master=self.conversion_settings_win,
+            placeholder_text="off")
+        self.simplify_entry.grid(row=17, column=0, pady=0, padx=0, sticky="n")
+        if self.conversion_settings['simplify'] is not None:
+            self.setentry(self.simplify_entry, self.conversion_settings['simplify'])
+
+        b = customtkinter.CTkButton(self.conversion_settings_win, text="Clear cache", command=self.clear_cache)
+        b.grid(row=18, column=0, pady=10)
+        b = customtkinter.CTkButton(self.conversion_settings_win, text="Save", command=self.save_conversion_settings)
+        b.grid(row=19, column=0, pady=10)
+
+    def save_conversion_settings(self):
+        try:
+            workers = self.workers_entry.get()
+            self.conversion_settings['workers'] = int(workers) if workers != '' else None
+            simplify = self.simplify_entry.get()
+            self.conversion_settings['simplify'] = float(simplify) if simplify != '' else None
+            self.conversion_settings['hierarchy'] = self.hierarchy_switch.get() == 1
+            self.conversion_settings['cache'] = self.cache_switch.get() == 1
+            self.conversion_settings['geometry_cache'] = self.geometry_cache_switch.get() == 1
+            self.conversion_settings['incremental'] = self.incremental_switch.get() == 1
+            self.conversion_settings['streaming'] = self.streaming_switch.get() == 1
+            self.conversion_settings['merge'] = self.merge_switch.get() == 1
+            self.conversion_settings['engine'] = 'auto' if self.earcut_switch.get() == 1 else 'triangle'
+            self.conversion_settings['output_format'] = 'npz' if self.indexed_switch.get() == 1 else 'stl'
+            self.conversion_settings['instances'] = self.instances_switch.get() == 1
+            self.conversion_settings['mapped_output'] = self.mapped_switch.get() == 1
+            self.conversion_settings['lod'] = self.lod_switch.get() == 1
+            self.conversion_settings['profile'] = self.profile_switch.get() == 1
+            self.conversion_settings['blender_session'] = self.blender_session_switch.get() == 1
+            self.conversion_settings['link_materials'] = self.link_materials_switch.get() == 1
+
+            print(f'Conversion settings changed to:\n{self.conversion_settings}')
+            self.conversion_settings_win.destroy()
+        except ValueError:
+            self.label_conversion_settings.configure(text='Please enter a whole number of worker processes\n'
+                                                          'and a number (or nothing) as tolerance.')
+
+    def clear_cache(self):
+        from gdsii_cache import TriangulationCache, GeometryCache # the triangulation and geometry caches
+        freed = TriangulationCache().clear() + GeometryCache().clear()
+        print(f'Cleared {freed/1024**2:.1f} MB of cached triangulations and geometry')
+        self.label_conversion_settings.configure(text=f'Cleared {freed/1024**2:.1f} MB of cached triangulations and geometry.')
+
     def testing(self):
         # print(f'Reading GDSII file {self.gdsii_file_path}...')
         # gdsii = gdspy.GdsLibrary()
@@ -746,5 +799,8 @@ class App(customtkinter.CTk):
         
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support() # triangulation workers in the frozen .exe
+    customtkinter.set_appearance_mode("System")  # Modes: "System" (standard), "Dark", "Light"
+    customtkinter.set_default_color_theme("blue")  # Themes: "blue" (standard), "green", "dark-blue"
     app = App()
     app.mainloop()
@@ -0,0 +1,226 @@
+'''Benchmarks of gdsiistl() (and optionally bpy_import_stls.py) on synthetic layouts.
+
+Every case converts a layout from synthetic_gds.py in a fresh process and
+records the time of each stage, the peak memory, the polygon, vertex and
+triangle counts and the bytes written. The results are saved as JSON so that
+runs before and after a change can be compared:
+
+    python benchmarks/run_benchmarks.py --scale quick --output before.json
+    ... change something ...
+    python benchmarks/run_benchmarks.py --scale quick --output after.json
+    python benchmarks/run_benchmarks.py --compare before.json after.json
+
+--scale full uses layouts with millions of polygons. With --blender the
+converted layers are also opened with bpy_import_stls.py in a background
+Blender, and the time that takes is recorded.
+
+The 'read' and 'flatten' stages are timed on the streaming reader by
+themselves (read_cells() and flatten_cells()). The 'convert' stages are
+those of the whole gdsiistl() call, taken from its report (see
+gdsii_profile): 'read' (reading and flattening), 'triangulate', 'extrude'
+and 'write', plus 'crop', 'check', 'merge' and 'lod' when they run.
+'''
+
+import os
+import sys
+import io
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY = os.path.dirname(HERE)
+sys.path.insert(0, REPOSITORY)
+sys.path.insert(0, HERE)
+
+import numpy as np # fast math on lots of points
+from synthetic_gds import write_layout
+
+LAYERSTACK = {1: (0, 100, 'gdsii_1')} # all synthetic geometry is on layer 1
+STAGES = ('read', 'crop', 'check', 'merge', 'triangulate', 'extrude', 'write', 'lod') # of a gdsiistl() conversion
+
+# name: (generator, {scale: generator parameters}, gdsiistl() settings)
+CASES = {
+    'rectangles': ('rectangles', {'quick': dict(count=20000), 'full': dict(count=2000000)}, {}),
+    'hierarchy-flat': ('hierarchy', {'quick': dict(depth=2, fanout=6), 'full': dict(depth=3, fanout=10)}, {}),
+    'hierarchy': ('hierarchy', {'quick': dict(depth=2, fanout=6), 'full': dict(depth=3, fanout=10)},
+                  dict(hierarchy=True)),
+    'paths': ('paths', {'quick': dict(count=2000, points=50), 'full': dict(count=100000, points=200)}, {}),
+    'curves': ('curves', {'quick': dict(count=2000, points=500), 'full': dict(count=20000, points=1000)}, {}),
+    'keyholes': ('keyholes', {'quick': dict(count=1000, holes=16), 'full': dict(count=50000, holes=16)}, {}),
+    'staircases': ('staircases', {'quick': dict(count=20000, points=20), 'full': dict(count=1000000, points=20)}, {}),
+}
+
+def peak_rss():
+    """Peak resident memory [bytes] of this process and of its finished child processes.
+
+    Returns (None, None) where the resource module is missing (Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    scale = 1 if sys.platform == 'darwin' else 1024 # ru_maxrss is in kB on Linux
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss*scale)
+
+def layout_path(work_folder, case, generator, parameters):
+    # generated layouts are kept in a folder per case, next to their
+    # converted files, and reused by later runs
+    name = generator + ''.join(f'_{key}{value}' for key, value in sorted(parameters.items()))
+    return os.path.join(work_folder, case, name + '.gds')
+
+def _measure(connection, gdsii_file_path, settings, verbose, layerstack=LAYERSTACK):
+    # one case, in its own process so that its peak memory is its own
+    if not verbose:
+        sys.stdout = io.StringIO()
+    from gdsiistl import gdsiistl
+    from gdsii_reader import read_cells
+    from gdsii_hierarchy import flatten_cells
+    from gdsii_profile import load_report, report_path
+
+    result = dict(stages={})
+    start = time.perf_counter()
+    cells = read_cells(gdsii_file_path, layerstack, hierarchy=True)
+    result['stages']['read'] = time.perf_counter() - start
+    start = time.perf_counter()
+    layers = flatten_cells(cells)[0][0]
+    result['stages']['flatten'] = time.perf_counter() - start
+    result['polygons'] = sum(len(offsets)-1 for _, offsets in layers.values())
+    result['vertices'] = sum(len(vertices) for vertices, _ in layers.values())
+    del cells, layers
+
+    start = time.perf_counter()
+    outputs = gdsiistl(gdsii_file_path, layerstack, cache=False, incremental=False, **settings)
+    result['seconds'] = time.perf_counter() - start
+
+    report = load_report(report_path(gdsii_file_path))
+    result['convert'] = {stage: entry['wall'] for stage, entry in report['stages'].items()}
+    result['cpu'], result['worker_cpu'] = report['cpu'], report['worker_cpu']
+    result['triangles'] = report['stages'].get('extrude', {}).get('triangles', 0)
+    result['peak_rss'], result['peak_rss_workers'] = peak_rss()
+
+    files = [filename for filename in outputs.values() if filename]
+    for filename in list(files):
+        if filename.endswith('_tiles.json'):
+            with open(filename) as f:
+                files += [os.path.join(os.path.dirname(filename), tile['file']) for tile in json.load(f)['tiles']]
+    result['outputs'] = {str(layer): filename for layer, filename in outputs.items()}
+    result['output_bytes'] = sum(os.path.getsize(filename) for filename in files)
+    connection.send(result)
+    connection.close()
+
+def measure(gdsii_file_path, settings, verbose=False, layerstack=LAYERSTACK):
+    """Convert gdsii_file_path with gdsiistl(**settings) in a fresh process and return its measurements."""
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_measure, args=(sender, gdsii_file_path, settings, verbose, layerstack))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError: # crashed
+        result = None
+    process.join()
+    return result or dict(error='benchmark process exited with code {}'.format(process.exitcode))
+
+def blender_import(blender, stl_folder):
+    """Seconds that bpy_import_stls.py takes to open layer 1 in a background Blender.
+
+    The time of an empty background Blender is subtracted.
+    """
+    arguments = ['--', stl_folder, os.path.join(REPOSITORY, 'materials.blend'), '1', '1', 'Gold', '(0;100)']
+    def run(*command):
+        start = time.perf_counter()
+        subprocess.run([blender, '--background', '--factory-startup', *command], check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return time.perf_counter() - start
+    empty = run('--python-expr', 'pass')
+    return run('-P', os.path.join(REPOSITORY, 'bpy_import_stls.py'), *arguments) - empty
+
+def run_benchmarks(scale='quick', cases=None, work_folder=None, settings=None, blender=None, verbose=False):
+    """Run the benchmark cases (all by default) and return the results as a dictionary."""
+    work_folder = work_folder or os.path.join(tempfile.gettempdir(), 'gdsiistl_benchmarks')
+    results = dict(date=time.strftime('%Y-%m-%d %H:%M:%S'), scale=scale, settings=settings or {},
+                   python=platform.python_version(), numpy=np.__version__,
+                   platform=platform.platform(), cpu_count=os.cpu_count(), cases={})
+    for name in cases or CASES:
+        generator, parameters, case_settings = CASES[name]
+        parameters = parameters[scale]
+        gdsii_file_path = layout_path(work_folder, name, generator, parameters)
+        if not os.path.exists(gdsii_file_path):
+            os.makedirs(os.path.dirname(gdsii_file_path), exist_ok=True)
+            print(f'Generating {gdsii_file_path}...', file=sys.stderr)
+            write_layout(gdsii_file_path, generator, **parameters)
+
+        print(f'Benchmarking {name}...', file=sys.stderr)
+        case_settings = dict(case_settings, **(settings or {}))
+        result = dict(generator=generator, parameters=parameters, settings=case_settings,
+                      gds_bytes=os.path.getsize(gdsii_file_path))
+        result.update(measure(gdsii_file_path, case_settings, verbose))
+        if blender is not None and 'error' not in result:
+            result['stages']['blender_import'] = blender_import(blender, os.path.dirname(gdsii_file_path))
+        if 'error' in result:
+            print(f"    {result['error']}", file=sys.stderr)
+        else:
+            print('    {:.2f} s, {} triangles, {:.1f} MB peak'.format(
+                result['seconds'], result['triangles'], (result['peak_rss'] or 0)/1e6), file=sys.stderr)
+        results['cases'][name] = result
+    return results
+
+def compare(before, after):
+    """Print the times and peak memory of two result files side by side."""
+    def load(path):
+        with open(path) as f:
+            return json.load(f)
+    before, after = load(before), load(after)
+    print('{:<16} {:<20} {:>10} {:>10} {:>7}'.format('case', 'measure', 'before', 'after', 'ratio'))
+    for name in [name for name in before['cases'] if name in after['cases']]:
+        old, new = before['cases'][name], after['cases'][name]
+        rows = [(f'stage {stage}', old.get('stages', {}).get(stage), new.get('stages', {}).get(stage))
+                for stage in ('read', 'flatten', 'blender_import')]
+        rows += [(f'convert {stage}', old.get('convert', {}).get(stage), new.get('convert', {}).get(stage))
+                 for stage in STAGES]
+        rows += [('seconds', old.get('seconds'), new.get('seconds')),
+                 ('peak MB', old.get('peak_rss') and old['peak_rss']/1e6, new.get('peak_rss') and new['peak_rss']/1e6),
+                 ('output MB', old.get('output_bytes', 0)/1e6, new.get('output_bytes', 0)/1e6)]
+        for measure_name, old_value, new_value in rows:
+            if old_value is None or new_value is None:
+                continue
+            ratio = new_value/old_value if old_value else float('nan')
+            print('{:<16} {:<20} {:>10.3f} {:>10.3f} {:>7.2f}'.format(name, measure_name, old_value, new_value, ratio))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark gdsiistl() on synthetic GDSII layouts.')
+    parser.add_argument('--scale', choices=('quick', 'full'), default='quick',
+                        help='quick layouts take seconds, full layouts have millions of polygons')
+    parser.add_argument('--case', action='append', choices=sorted(CASES), dest='cases',
+                        help='run only this case (repeatable)')
+    parser.add_argument('--output', help='JSON file for the results (default: benchmarks/results/<date>-<scale>.json)')
+    parser.add_argument('--work', help='folder for the generated layouts and the converted files')
+    parser.add_argument('--workers', type=int, help='triangulation worker processes (default: all cores)')
+    parser.add_argument('--gdspy', action='store_true', help='read with gdspy instead of the streaming reader')
+    parser.add_argument('--engine', choices=('triangle', 'earcut', 'auto'), default='triangle',
+                        help='triangulation engine (see gdsii_triangulate)')
+    parser.add_argument('--format', choices=('stl', 'npz'), default='stl', dest='output_format')
+    parser.add_argument('--blender', help='Blender executable; also time opening the layers in Blender')
+    parser.add_argument('--verbose', action='store_true', help='show the messages of the conversions')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two result files')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+
+    settings = dict(workers=args.workers, streaming=not args.gdspy, output_format=args.output_format,
+                    engine=args.engine)
+    results = run_benchmarks(args.scale, args.cases, args.work, settings, args.blender, args.verbose)
+    output = args.output or os.path.join(HERE, 'results', time.strftime('%Y%m%d-%H%M%S') + f'-{args.scale}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=1)
+    print(f'Results saved to {output}', file=sys.stderr)
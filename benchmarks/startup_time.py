@@ -0,0 +1,91 @@
+'''Startup time of the GUI (BlendGDSII.py).
+
+Every run imports BlendGDSII in a fresh Python and records how long the
+import takes and which of the conversion libraries (gdspy, numpy-stl,
+triangle, NumPy) it loaded; those should only load once a conversion starts.
+With --window the time until the window has been drawn is recorded as well
+(this needs a display). The time of starting an empty Python is given for
+reference.
+
+    python benchmarks/startup_time.py --runs 5 --window
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import statistics
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY = os.path.dirname(HERE)
+
+HEAVY_MODULES = ('gdspy', 'stl', 'triangle', 'numpy') # only needed by a conversion
+
+# runs in the fresh Python; prints its measurements as JSON
+STARTUP = '''
+import sys, json, time
+start = time.perf_counter()
+import BlendGDSII
+result = dict(import_seconds=time.perf_counter() - start,
+              heavy_modules=[name for name in {heavy!r} if name in sys.modules])
+if {window!r}:
+    app = BlendGDSII.App()
+    app.update()
+    result['window_seconds'] = time.perf_counter() - start
+    app.destroy()
+print(json.dumps(result))
+'''
+
+def startup(window=False):
+    """Measurements of starting BlendGDSII once, in a fresh Python."""
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, '-c', STARTUP.format(heavy=HEAVY_MODULES, window=window)],
+                             cwd=REPOSITORY, capture_output=True, text=True)
+    seconds = time.perf_counter() - start
+    if process.returncode != 0:
+        return dict(error=process.stderr.strip().splitlines()[-1] if process.stderr.strip() else
+                    'exited with code {}'.format(process.returncode))
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    result['process_seconds'] = seconds
+    return result
+
+def empty_python():
+    """Seconds that starting and stopping an empty Python takes."""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'], check=True)
+    return time.perf_counter() - start
+
+def startup_times(runs=5, window=False):
+    """Median startup measurements over runs fresh starts."""
+    results = [startup(window) for _ in range(runs)]
+    errors = [result['error'] for result in results if 'error' in result]
+    if errors:
+        return dict(error=errors[0])
+    summary = {name: statistics.median(result[name] for result in results)
+               for name in results[0] if name.endswith('_seconds')}
+    summary['heavy_modules'] = results[0]['heavy_modules']
+    summary['empty_python_seconds'] = statistics.median(empty_python() for _ in range(runs))
+    summary['runs'] = runs
+    return summary
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure how long BlendGDSII.py takes to start.')
+    parser.add_argument('--runs', type=int, default=5, help='fresh starts to take the median of')
+    parser.add_argument('--window', action='store_true', help='also time opening the window (needs a display)')
+    parser.add_argument('--output', help='JSON file for the results')
+    args = parser.parse_args()
+
+    result = startup_times(args.runs, args.window)
+    if 'error' in result:
+        print('BlendGDSII did not start: {}'.format(result['error']), file=sys.stderr)
+        sys.exit(1)
+    print('import {:.3f} s, process {:.3f} s (empty Python {:.3f} s){}'.format(
+        result['import_seconds'], result['process_seconds'], result['empty_python_seconds'],
+        ', window {:.3f} s'.format(result['window_seconds']) if 'window_seconds' in result else ''))
+    print('conversion libraries loaded at startup: {}'.format(', '.join(result['heavy_modules']) or 'none'))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=1)
+        print(f'Results saved to {args.output}', file=sys.stderr)
@@ -0,0 +1,150 @@
+'''Synthetic GDSII layouts for the benchmarks (see run_benchmarks.py).
+
+Every generator builds a gdspy library with a single top cell, TOP, and puts
+its geometry on layer 1. The layouts are made from a seeded random generator,
+so the same parameters always give the same file:
+
+    rectangles  count rectangles, flat in the top cell
+    hierarchy   a leaf cell arrayed fanout x fanout (AREF) plus one rotated
+                and reflected copy (SREF) at each of depth levels
+    paths       count GDSII paths (PATH records) of points points each
+    curves      count circles and arcs of points vertices each
+    keyholes    count rectangles with holes holes each, cut open into
+                keyhole polygons
+    staircases  count small rectilinear polygons (L shapes up to staircases
+                of points vertices), like routing and cell outlines
+
+    python benchmarks/synthetic_gds.py rectangles rects.gds --count 1000000
+'''
+
+import argparse
+
+import numpy as np # fast math on lots of points
+import gdspy # write gds file
+
+PITCH = 10.0 # spacing of the shapes [um]
+
+def _grid(count):
+    # lower left corners of count places on a square grid
+    side = int(np.ceil(np.sqrt(count)))
+    index = np.arange(count)
+    return PITCH*np.stack((index % side, index // side), axis=1).astype(float)
+
+def _library(top):
+    library = gdspy.GdsLibrary(unit=1e-6, precision=1e-9)
+    library.add(top, include_dependencies=True)
+    return library
+
+def rectangles(count, seed=0):
+    """count rectangles of random size, each in its own grid place."""
+    rng = np.random.default_rng(seed)
+    lower = _grid(count) + rng.uniform(0, 1, (count, 2))
+    upper = lower + rng.uniform(1, 8, (count, 2))
+    corners = np.stack((lower, np.stack((upper[:, 0], lower[:, 1]), axis=1),
+                        upper, np.stack((lower[:, 0], upper[:, 1]), axis=1)), axis=1)
+    top = gdspy.Cell('TOP', exclude_from_current=True)
+    top.add(gdspy.PolygonSet(list(corners), layer=1))
+    return _library(top)
+
+def hierarchy(depth, fanout):
+    """A deep reference tree; the flattened layout has 5*(fanout**2+1)**depth polygons."""
+    leaf = gdspy.Cell('LEAF', exclude_from_current=True)
+    leaf.add(gdspy.Rectangle((0, 0), (3, 2), layer=1))
+    leaf.add(gdspy.Rectangle((4, 0), (5, 6), layer=1))
+    leaf.add(gdspy.Polygon([(0, 3), (3, 3), (3, 4), (1, 4), (1, 6), (0, 6)], layer=1)) # L shape
+    leaf.add(gdspy.Round((7.5, 2.5), 1.5, number_of_points=32, layer=1))
+    leaf.add(gdspy.Polygon([(6, 5), (9, 5), (9, 8), (7.5, 6), (6, 8)], layer=1)) # notch
+    cell, size = leaf, PITCH
+    for level in range(depth):
+        parent = gdspy.Cell(f'LEVEL{level}', exclude_from_current=True)
+        parent.add(gdspy.CellArray(cell, fanout, fanout, (size, size)))
+        parent.add(gdspy.CellReference(cell, (fanout*size + size, 0), rotation=90, x_reflection=True))
+        cell, size = parent, (fanout+2)*size
+    top = gdspy.Cell('TOP', exclude_from_current=True)
+    top.add(gdspy.CellReference(cell))
+    return _library(top)
+
+def paths(count, points, seed=0):
+    """count zigzag paths with flush, extended and round ends, stored as PATH records."""
+    rng = np.random.default_rng(seed)
+    top = gdspy.Cell('TOP', exclude_from_current=True)
+    ends = ('flush', 'extended', 'round')
+    for i, origin in enumerate(_grid(count)*points/4):
+        steps = rng.uniform(0.5, 2, (points-1, 2)) * np.where(np.arange(points-1) % 2, 1, -1)[:, None]
+        steps[:, 0] = np.abs(steps[:, 0])
+        walk = origin + np.concatenate((np.zeros((1, 2)), np.cumsum(steps, axis=0)))
+        top.add(gdspy.FlexPath(walk, rng.uniform(0.2, 0.6), ends=ends[i % 3], gdsii_path=True, layer=1))
+    return _library(top)
+
+def curves(count, points, seed=0):
+    """count circles and arcs (every other shape) of points vertices each."""
+    rng = np.random.default_rng(seed)
+    top = gdspy.Cell('TOP', exclude_from_current=True)
+    for i, center in enumerate(_grid(count) + PITCH/2):
+        radius = rng.uniform(2, 4.5)
+        if i % 2:
+            start = rng.uniform(0, np.pi)
+            shape = gdspy.Round(center, radius, inner_radius=radius/2, initial_angle=start,
+                                final_angle=start+1.5*np.pi, number_of_points=points, max_points=0, layer=1)
+        else:
+            shape = gdspy.Round(center, radius, number_of_points=points, max_points=0, layer=1)
+        top.add(shape)
+    return _library(top)
+
+def keyholes(count, holes, seed=0):
+    """count copies of a rectangle with holes square holes, as keyhole polygons."""
+    rng = np.random.default_rng(seed)
+    side = 4*int(np.ceil(np.sqrt(holes))) + 1
+    cuts = [gdspy.Rectangle((x+1, y+1), (x+3, y+3)) for x, y in
+            4*np.stack(np.unravel_index(rng.choice((side//4)**2, holes, replace=False), (side//4, side//4)), axis=1)]
+    keyhole = gdspy.boolean(gdspy.Rectangle((0, 0), (side, side)), cuts, 'not', max_points=0)
+    shapes = [polygon for polygon in keyhole.polygons]
+    top = gdspy.Cell('TOP', exclude_from_current=True)
+    top.add(gdspy.PolygonSet([polygon + corner for corner in _grid(count)*(side/PITCH + 1)
+                              for polygon in shapes], layer=1))
+    return _library(top)
+
+def staircases(count, points, seed=0):
+    """count staircase polygons of 6 to points vertices each, in random orientations."""
+    rng = np.random.default_rng(seed)
+    polygons = []
+    for corner in _grid(count):
+        steps = rng.integers(2, max(3, points//2))
+        x = np.cumsum(rng.uniform(0.2, 8/steps, steps))
+        y = np.cumsum(rng.uniform(0.2, 8/steps, steps))
+        outline = [(0, 0)] + [point for i in range(steps) for point in ((x[i], y[i-1] if i else 0), (x[i], y[i]))]
+        outline = np.array(outline + [(0, y[-1])])
+        if rng.integers(2):
+            outline = outline[:, ::-1]
+        polygons.append(corner + outline*np.where(rng.integers(2, size=2), 1, -1) + PITCH/2)
+    top = gdspy.Cell('TOP', exclude_from_current=True)
+    top.add(gdspy.PolygonSet(polygons, layer=1))
+    return _library(top)
+
+GENERATORS = {
+    'rectangles': rectangles,
+    'hierarchy': hierarchy,
+    'paths': paths,
+    'curves': curves,
+    'keyholes': keyholes,
+    'staircases': staircases,
+}
+
+def write_layout(path, generator, **parameters):
+    """Generate a layout with GENERATORS[generator](**parameters) and write it to path."""
+    GENERATORS[generator](**parameters).write_gds(path)
+    return path
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic GDSII layout for benchmarking.')
+    parser.add_argument('generator', choices=sorted(GENERATORS))
+    parser.add_argument('path', help='GDSII file to write')
+    parser.add_argument('--count', type=int, help='number of shapes')
+    parser.add_argument('--points', type=int, help='vertices per path or curve (at most, per staircase)')
+    parser.add_argument('--holes', type=int, help='holes per keyhole polygon')
+    parser.add_argument('--depth', type=int, help='levels of the reference tree')
+    parser.add_argument('--fanout', type=int, help='array size at each level of the reference tree')
+    args = parser.parse_args()
+    parameters = {name: value for name, value in vars(args).items()
+                  if name not in ('generator', 'path') and value is not None}
+    write_layout(args.path, args.generator, **parameters)
@@ -0,0 +1,133 @@
+'''Throughput of the triangulation engines (see gdsii_triangulate) per design.
+
+Every design is converted once per engine ('triangle', 'earcut' and 'auto'),
+each in a fresh process, and the time of the triangulation stage, the
+polygons per second of every engine and the polygons it could not
+triangulate are taken from the conversion report. The volume of the written
+STL files shows whether an engine left polygons unfilled or filled them
+twice: an engine whose volume differs from the median of all engines, or
+whose conversion crashed, is not stable for that design. The fastest stable
+engine is recommended:
+
+    python benchmarks/triangulation_engines.py chip.gds --layer 1 --layer 2
+    python benchmarks/triangulation_engines.py --case keyholes --case paths
+
+Without GDSII files the synthetic cases of run_benchmarks.py are used.
+'''
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY = os.path.dirname(HERE)
+sys.path.insert(0, REPOSITORY)
+sys.path.insert(0, HERE)
+
+import numpy as np # fast math on lots of points
+from synthetic_gds import write_layout
+from run_benchmarks import CASES, LAYERSTACK, layout_path, measure
+from gdsii_profile import load_report, report_path
+from gdsii_triangulate import ENGINES
+
+ENGINE_CHOICES = tuple(sorted(ENGINES)) + ('auto',)
+VOLUME_TOLERANCE = 1e-6 # relative volume difference that still counts as the same geometry
+
+STL_RECORD = np.dtype([('normal', '<f4', (3,)), ('corners', '<f4', (3, 3)), ('attribute', '<u2')])
+
+def stl_volume(filename):
+    """Signed volume enclosed by the triangles of a binary STL file."""
+    with open(filename, 'rb') as f:
+        f.seek(80)
+        count = int(np.fromfile(f, dtype='<u4', count=1)[0])
+        corners = np.fromfile(f, dtype=STL_RECORD, count=count)['corners'].astype(np.float64)
+    return float(np.einsum('ij,ij->i', corners[:, 0], np.cross(corners[:, 1], corners[:, 2])).sum()/6)
+
+def engine_run(gdsii_file_path, layerstack, engine, workers=None, verbose=False):
+    """Convert a design with one engine (in a fresh process) and return its measurements."""
+    settings = dict(engine=engine, workers=workers, streaming=True, output_format='stl')
+    result = measure(gdsii_file_path, settings, verbose, layerstack)
+    if 'error' in result:
+        return dict(error=result['error'])
+    stage = load_report(report_path(gdsii_file_path))['stages'].get('triangulate', {})
+    run = dict(triangulate_seconds=stage.get('wall', 0.0), seconds=result['seconds'],
+               triangles=result['triangles'], engines={})
+    for name in ENGINES:
+        if stage.get(f'{name}_polygons'):
+            polygons, seconds = stage[f'{name}_polygons'], stage[f'{name}_seconds']
+            run['engines'][name] = dict(polygons=polygons, failed=stage[f'{name}_failed'], seconds=seconds,
+                                        polygons_per_second=polygons/seconds if seconds > 0 else None)
+    run['volume'] = sum(stl_volume(filename) for filename in result['outputs'].values() if filename)
+    return run
+
+def compare_engines(gdsii_file_path, layerstack, engines=ENGINE_CHOICES, workers=None, verbose=False):
+    """Run every engine on a design; returns the runs and the fastest stable engine."""
+    runs = {}
+    for engine in engines:
+        print(f'    {engine}...', file=sys.stderr)
+        runs[engine] = engine_run(gdsii_file_path, layerstack, engine, workers, verbose)
+    volumes = [run['volume'] for run in runs.values() if 'error' not in run]
+    reference = statistics.median(volumes) if volumes else 0.0
+    for run in runs.values():
+        run['stable'] = 'error' not in run and \
+            abs(run['volume'] - reference) <= VOLUME_TOLERANCE*max(abs(reference), 1e-30)
+    stable = [engine for engine, run in runs.items() if run['stable']]
+    fastest = min(stable, key=lambda engine: runs[engine]['triangulate_seconds'], default=None)
+    return dict(runs=runs, recommended=fastest)
+
+def print_comparison(name, comparison):
+    print(name)
+    for engine, run in comparison['runs'].items():
+        if 'error' in run:
+            print(f'    {engine:<9} {run["error"]}')
+            continue
+        rates = ', '.join('{} {:.0f} polygons/s{}'.format(
+            engine_name, stats['polygons_per_second'] or 0, f' ({stats["failed"]} failed)' if stats['failed'] else '')
+            for engine_name, stats in run['engines'].items())
+        print('    {:<9} triangulate {:7.2f} s, {} triangles{}  {}'.format(
+            engine, run['triangulate_seconds'], run['triangles'], '' if run['stable'] else ', NOT STABLE', rates))
+    print(f'    fastest stable engine: {comparison["recommended"]}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the triangulation engines on GDSII designs.')
+    parser.add_argument('gds', nargs='*', help='GDSII files (default: the synthetic benchmark cases)')
+    parser.add_argument('--layer', type=int, action='append', dest='layers',
+                        help='layer of the GDSII files to convert (repeatable, default: 1)')
+    parser.add_argument('--case', action='append', choices=sorted(CASES), dest='cases',
+                        help='synthetic case to use (repeatable)')
+    parser.add_argument('--scale', choices=('quick', 'full'), default='quick', help='size of the synthetic cases')
+    parser.add_argument('--engine', action='append', choices=ENGINE_CHOICES, dest='engines',
+                        help='engine to compare (repeatable, default: all)')
+    parser.add_argument('--work', help='folder for the generated layouts and the converted files')
+    parser.add_argument('--workers', type=int, help='triangulation worker processes (default: all cores)')
+    parser.add_argument('--verbose', action='store_true', help='show the messages of the conversions')
+    parser.add_argument('--output', help='JSON file for the results')
+    args = parser.parse_args()
+
+    designs = {}
+    if args.gds:
+        layerstack = {layer: (0, 100, f'gdsii_{layer}') for layer in args.layers or [1]}
+        designs = {path: (path, layerstack) for path in args.gds}
+    else:
+        work_folder = args.work or os.path.join(tempfile.gettempdir(), 'gdsiistl_benchmarks')
+        for name in args.cases or CASES:
+            generator, parameters, _ = CASES[name]
+            path = layout_path(work_folder, name, generator, parameters[args.scale])
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                print(f'Generating {path}...', file=sys.stderr)
+                write_layout(path, generator, **parameters[args.scale])
+            designs[name] = (path, LAYERSTACK)
+
+    results = {}
+    for name, (path, layerstack) in designs.items():
+        print(f'Comparing engines on {name}...', file=sys.stderr)
+        results[name] = compare_engines(path, layerstack, args.engines or ENGINE_CHOICES, args.workers, args.verbose)
+        print_comparison(name, results[name])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+        print(f'Results saved to {args.output}', file=sys.stderr)
@@ -9,6 +9,14 @@ import mathutils
 import sys
 from random import random
 import os
+import time
+import hmac
+import json
+import socket
+import argparse
+import traceback
+import numpy as np
+from bpy_extras import view3d_utils
 
 bpy.context.preferences.view.show_splash = False
 
@@ -33,22 +41,67 @@ layer_stack = argv[3]
 material_stack = argv[4]
 dimension_stack = argv[5]
 
-glob_search = stl_folder_path + r'\*.stl'
-print(f'Looking for stl files:\n{glob_search}')
-stl_files = glob.glob(glob_search)
-print(f'found: {stl_files}')
+# options after the layer arguments
+parser = argparse.ArgumentParser(prog='bpy_import_stls.py')
+parser.add_argument('--port', type=int, help='keep listening for the GUI on this port (see CommandServer)')
+parser.add_argument('--token', help='token that every command from the GUI must carry (with --port)')
+parser.add_argument('--link-materials', action='store_true', help='link the materials instead of appending them')
+parser.add_argument('--no-material-cache', action='store_true', help='always read the full material library')
+options = parser.parse_args(argv[6:])
+session_port = options.port
+session_token = options.token
 
 stl_checks = check_stack.split(',')
-stl_checks = [0 if check=='' else 1 for check in stl_checks]
+stl_checks = [0 if check in ('', '0') else 1 for check in stl_checks]
 stl_layers = layer_stack.split(',')
 stl_materials = material_stack.split(',')
 stl_dimensions = dimension_stack.split(',')
 stl_dimensions = [tuple(map(int,pair[1:-1].split(';'))) if pair!='(;)' else (0,STD_thickness) for pair in stl_dimensions]
 
-#import materials
-with bpy.data.libraries.load(material_blend_path, link=False) as (data_from, data_to):
-    data_to.materials = data_from.materials
-print('Materials imported')
+# Materials are loaded from the material library (materials.blend) when a
+# layer first uses them, instead of appending the whole library up front.
+# Each loaded material is also saved by itself as a small library,
+# cache/materials/<material>.blend next to materials.blend, which later
+# sessions read instead of the full library for as long as that is unchanged.
+# With --link-materials the materials are linked instead of appended, so the
+# scene refers to the library instead of holding a copy.
+material_cache_folder = None if options.no_material_cache else \
+    os.path.join(os.path.dirname(os.path.abspath(material_blend_path)), 'cache', 'materials')
+
+def material_cache_path(name):
+    safe_name = ''.join(c if c.isalnum() or c in ' -_' else '_' for c in name)
+    return os.path.join(material_cache_folder, f'{safe_name}.blend')
+
+def load_library_material(library, name, link):
+    with bpy.data.libraries.load(library, link=link) as (data_from, data_to):
+        if name not in data_from.materials:
+            raise KeyError(f'material {name} is not in {library}')
+        data_to.materials = [name]
+    return data_to.materials[0]
+
+def load_material(name):
+    """The material called name, loaded from the (cached) material library if it is not loaded yet."""
+    mat = bpy.data.materials.get(name)
+    if mat is not None:
+        return mat
+    start_time = time.perf_counter()
+    library = material_blend_path
+    if material_cache_folder is not None:
+        cached = material_cache_path(name)
+        if not os.path.exists(cached) or os.path.getmtime(cached) < os.path.getmtime(material_blend_path):
+            # prepare the cached library from the full one
+            mat = load_library_material(material_blend_path, name, link=False)
+            os.makedirs(material_cache_folder, exist_ok=True)
+            bpy.data.libraries.write(cached, {mat}, fake_user=True)
+            if not options.link_materials:
+                print(f'Blender - Loaded material {name} from {library} in {time.perf_counter()-start_time:.2f} s')
+                return mat
+            bpy.data.materials.remove(mat)
+        library = cached
+    mat = load_library_material(library, name, link=options.link_materials)
+    print(f'Blender - {"Linked" if options.link_materials else "Loaded"} material {name} '
+          f'from {library} in {time.perf_counter()-start_time:.2f} s')
+    return mat
 
 def update_camera(camera, focus_point=mathutils.Vector((0.0, 0.0, 0.0)), distance=10.0):
     """
@@ -69,67 +122,532 @@ def update_camera(camera, focus_point=mathutils.Vector((0.0, 0.0, 0.0)), distanc
     # Use * instead of @ for Blender <2.8
     camera.location = rot_quat @ mathutils.Vector((0.0, 0.0, distance))
 
-bpy.data.objects['Cube'].select_set(True)
-bpy.data.objects['Light'].select_set(True)
-bpy.ops.object.delete(use_global=False)
+# record of a binary STL triangle: normal, three vertices, attribute bytes
+STL_DTYPE = np.dtype([('normal', '<f4', (3,)), ('vectors', '<f4', (3, 3)), ('attr', '<u2')])
 
-for stl_check,stl_layer,stl_material,stl_dimension in zip(stl_checks,stl_layers,stl_materials,stl_dimensions):
-    if stl_check:
-        #find file
-        filename = ''
-        for f in [f for f in stl_files if f.endswith(f'_{stl_layer}.stl')]:
-            filename = f
-        
-        if filename != '':
-            print(f'Blender - Importing {filename}')
-            obj = bpy.ops.import_mesh.stl(filepath=filename)
-            obj_name = filename.replace('/','\\').split('\\')[-1][:-4]
-            mat_name = obj_name + '_material'
+def read_stl(filepath):
+    """Read a binary STL file into (vertices, triangles), merging repeated vertices.
 
-            bpy.data.objects[obj_name].select_set(True)
-            ob = bpy.context.active_object
-            
-            #apply material
-            if RANDOM_MAT:
-                # Get material
-                mat = bpy.data.materials.new(name=mat_name)
-                mat.diffuse_color = random(), random(), random(), 1
-
-                # Assign it to object
-                if ob.data.materials:
-                    # assign to 1st material slot
-                    ob.data.materials[0] = mat
-                else:
-                    # no slots
-                    ob.data.materials.append(mat)
-            else:
-                mat = bpy.data.materials[stl_material]
-                
-                if ob.data.materials:
-                    # assign to 1st material slot
-                    ob.data.materials[0] = mat
-                else:
-                    # no slots
-                    ob.data.materials.append(mat)
-
-            #apply dimensions
-            lbound, ubound = stl_dimension #lower and upper bound
-            desired_thickness = ubound-lbound
-
-            factor_z = desired_thickness/STD_thickness
-            bpy.ops.transform.resize(value=(1, 1, factor_z))
-            bpy.ops.transform.translate(value=(0, 0, lbound))
-
-            bpy.data.objects[obj_name].select_set(False)
+    Returns None for files that are not binary STL (e.g. ASCII STL).
+    """
+    with open(filepath, 'rb') as f:
+        f.seek(80)
+        count = np.fromfile(f, dtype='<u4', count=1)
+        if len(count) == 0 or os.path.getsize(filepath) != 84 + STL_DTYPE.itemsize*int(count[0]):
+            return None
+        records = np.fromfile(f, dtype=STL_DTYPE, count=int(count[0]))
+    # each corner's 12 bytes as one opaque value: np.unique sorts those much
+    # faster than rows (axis=0). Adding 0 turns -0.0 into 0.0 so that equal
+    # coordinates have equal bytes.
+    corners = np.ascontiguousarray(records['vectors'].reshape(-1, 3) + np.float32(0))
+    keys = corners.view(np.dtype((np.void, corners.itemsize*3))).ravel()
+    _, first, triangles = np.unique(keys, return_index=True, return_inverse=True)
+    return corners[first], triangles.reshape(-1, 3)
+
+def read_npz(filepath):
+    """Read an indexed mesh written by gdsiistl(output_format='npz') into (vertices, triangles)."""
+    with np.load(filepath) as data:
+        return data['vertices'], data['triangles']
+
+def new_mesh(name, vertices, triangles):
+    """Create a mesh from (V, 3) vertices and (T, 3) triangles, copied in bulk with foreach_set."""
+    vertices = np.ascontiguousarray(vertices, dtype=np.float32)
+    triangles = np.ascontiguousarray(triangles, dtype=np.int32)
+
+    me = bpy.data.meshes.new(name)
+    me.vertices.add(len(vertices))
+    me.vertices.foreach_set('co', vertices.ravel())
+    me.loops.add(3*len(triangles))
+    me.loops.foreach_set('vertex_index', triangles.ravel())
+    me.polygons.add(len(triangles))
+    me.polygons.foreach_set('loop_start', np.arange(0, 3*len(triangles), 3, dtype=np.int32))
+    # Blender 4 derives the polygon sizes from loop_start (loop_total is read-only)
+    if not me.polygons.bl_rna.properties['loop_total'].is_readonly:
+        me.polygons.foreach_set('loop_total', np.full(len(triangles), 3, dtype=np.int32))
+    me.update(calc_edges=True)
+    return me
+
+def mesh_object(name, vertices, triangles):
+    """Create and link a mesh object from (V, 3) vertices and (T, 3) triangles."""
+    ob = bpy.data.objects.new(name, new_mesh(name, vertices, triangles))
+    bpy.context.collection.objects.link(ob)
+    return ob
+
+# Layers converted with lod=True come with a coarse preview (<layer>_lod.npz,
+# see gdsii_lod.py), which is opened instead of the full layer so that the
+# viewport stays interactive. The object remembers its full layer file in
+# FULL_DETAIL; the full mesh replaces the preview for the selected objects
+# with the "GDSII: Load full detail" operator (F3 search), and for all
+# objects right before rendering.
+FULL_DETAIL = 'gdsii_full_detail'
+
+def load_full_detail(ob):
+    """Replace the preview mesh of ob by its full layer, if it has one."""
+    filename = ob.get(FULL_DETAIL)
+    if not filename:
+        return
+    start_time = time.perf_counter()
+    mesh_data = read_npz(filename) if filename.endswith('.npz') else read_stl(filename)
+    if mesh_data is None:
+        print(f'Cannot load full detail of {ob.name} from {filename}')
+        return
+    preview = ob.data
+    me = new_mesh(preview.name, *mesh_data)
+    for mat in preview.materials:
+        me.materials.append(mat)
+    ob.data = me
+    ob.display_type = 'TEXTURED'
+    bpy.data.meshes.remove(preview)
+    del ob[FULL_DETAIL]
+    print(f'Blender - Loaded full detail of {ob.name}: {len(me.polygons)} triangles '
+          f'in {time.perf_counter()-start_time:.2f} s')
+
+class LoadFullDetail(bpy.types.Operator):
+    """Replace the coarse previews of the selected layers by their full detail"""
+    bl_idname = 'object.gdsii_load_full_detail'
+    bl_label = 'GDSII: Load full detail'
+
+    def execute(self, context):
+        for ob in context.selected_objects:
+            load_full_detail(ob)
+        return {'FINISHED'}
+
+# Layers converted with tile_size=... come as one file per tile and an index,
+# <layer>_tiles.json (see gdsiistl). Each tile is opened as a wire box around
+# its bounds that remembers its tile file in FULL_DETAIL; the
+# "GDSII: Load tiles in view" operator (F3 search in the 3D viewport) loads
+# the tiles that can be seen, so only the part of the chip that is looked at
+# takes memory.
+def tile_objects(index_file, name):
+    """Create a placeholder box object for every tile in a tile index."""
+    with open(index_file) as f:
+        index = json.load(f)
+    folder = os.path.dirname(index_file)
+    corners = np.array([[x, y, z] for x in (0, 3) for y in (1, 4) for z in (2, 5)])
+    faces = np.array([[0, 1, 3], [0, 3, 2], [4, 6, 7], [4, 7, 5], [0, 4, 5], [0, 5, 1],
+                      [2, 3, 7], [2, 7, 6], [0, 2, 6], [0, 6, 4], [1, 5, 7], [1, 7, 3]])
+    obs = []
+    for tile in index['tiles']:
+        ob = mesh_object(f"{name}_tile_{tile['column']}_{tile['row']}", np.array(tile['bounds'])[corners], faces)
+        ob.display_type = 'WIRE'
+        ob[FULL_DETAIL] = os.path.join(folder, tile['file'])
+        obs.append(ob)
+    return obs
+
+def in_view(ob, region, rv3d):
+    """Whether the bounding box of ob overlaps the viewport region."""
+    points = [view3d_utils.location_3d_to_region_2d(region, rv3d, ob.matrix_world @ mathutils.Vector(corner))
+              for corner in ob.bound_box]
+    if any(point is None for point in points):
+        return True # partly behind the view, load it to be safe
+    xs = [point.x for point in points]
+    ys = [point.y for point in points]
+    return max(xs) >= 0 and min(xs) <= region.width and max(ys) >= 0 and min(ys) <= region.height
+
+class LoadTilesInView(bpy.types.Operator):
+    """Load the full detail of the tiles that can be seen in the viewport"""
+    bl_idname = 'view3d.gdsii_load_tiles_in_view'
+    bl_label = 'GDSII: Load tiles in view'
+
+    @classmethod
+    def poll(cls, context):
+        return context.area is not None and context.area.type == 'VIEW_3D'
+
+    def execute(self, context):
+        for ob in context.visible_objects:
+            if ob.get(FULL_DETAIL) and in_view(ob, context.region, context.region_data):
+                load_full_detail(ob)
+        return {'FINISHED'}
+
+@bpy.app.handlers.persistent
+def full_detail_for_render(scene, *args):
+    for ob in scene.objects:
+        if not ob.hide_render:
+            load_full_detail(ob)
+
+bpy.utils.register_class(LoadFullDetail)
+bpy.utils.register_class(LoadTilesInView)
+bpy.app.handlers.render_pre.append(full_detail_for_render)
+
+# Layers converted with instances=True come as <layer>_instances.npz (see
+# gdsiistl): every cell's mesh once, with the 2D transforms of all places it
+# is used. Each cell mesh is created once; a cell placed up to
+# LINKED_DUPLICATES times gets one object per place, all sharing the mesh
+# (linked duplicates), and a cell placed more often gets a single object
+# with a point per place and a geometry-nodes modifier that instances a
+# hidden object with the cell mesh on those points. A pixel array of
+# 1000 x 1000 cells is then one mesh and a million points.
+LINKED_DUPLICATES = 64
+
+def placement_transforms(placements):
+    """Locations, z rotations and scales of (K, 3, 3) 2D placements (rotation, magnification, reflection)."""
+    linear = placements[:, :2, :2]
+    determinant = np.linalg.det(linear)
+    magnification = np.hypot(linear[:, 0, 0], linear[:, 1, 0])
+    locations = np.zeros((len(placements), 3))
+    locations[:, :2] = placements[:, :2, 2]
+    rotations = np.zeros((len(placements), 3))
+    rotations[:, 2] = np.arctan2(linear[:, 1, 0], linear[:, 0, 0])
+    # a reflection (about x, before rotating) is a negative y scale
+    scales = np.stack((magnification, np.sign(determinant)*magnification, np.ones(len(placements))), axis=1)
+    return locations, rotations, scales
+
+def instancing_node_group(name, source):
+    """Geometry nodes that put an instance of source on every point, turned and scaled by its attributes."""
+    group = bpy.data.node_groups.new(name, 'GeometryNodeTree')
+    if hasattr(group, 'interface'): # Blender 4
+        group.interface.new_socket(name='Geometry', in_out='INPUT', socket_type='NodeSocketGeometry')
+        group.interface.new_socket(name='Geometry', in_out='OUTPUT', socket_type='NodeSocketGeometry')
+    else:
+        group.inputs.new('NodeSocketGeometry', 'Geometry')
+        group.outputs.new('NodeSocketGeometry', 'Geometry')
+    nodes, links = group.nodes, group.links
+    group_input = nodes.new('NodeGroupInput')
+    group_output = nodes.new('NodeGroupOutput')
+    object_info = nodes.new('GeometryNodeObjectInfo')
+    object_info.inputs['Object'].default_value = source
+    object_info.transform_space = 'ORIGINAL'
+    instance = nodes.new('GeometryNodeInstanceOnPoints')
+    links.new(group_input.outputs[0], instance.inputs['Points'])
+    links.new(object_info.outputs['Geometry'], instance.inputs['Instance'])
+    for attribute, socket in (('gdsii_rotation', 'Rotation'), ('gdsii_scale', 'Scale')):
+        named = nodes.new('GeometryNodeInputNamedAttribute')
+        named.data_type = 'FLOAT_VECTOR'
+        named.inputs['Name'].default_value = attribute
+        output = [output for output in named.outputs if output.name == 'Attribute' and output.enabled][0]
+        links.new(output, instance.inputs[socket])
+    links.new(instance.outputs['Instances'], group_output.inputs[0])
+    return group
+
+def instance_objects(filename, name):
+    """Create the objects of a layer written with instances=True."""
+    with np.load(filename) as data:
+        cells = {key: data[key] for key in data.files}
+    obs = []
+    for cell in range(len(cells['vertex_offsets'])-1):
+        vertices = cells['vertices'][cells['vertex_offsets'][cell]:cells['vertex_offsets'][cell+1]]
+        triangles = cells['triangles'][cells['triangle_offsets'][cell]:cells['triangle_offsets'][cell+1]]
+        placements = cells['placements'][cells['placement_offsets'][cell]:cells['placement_offsets'][cell+1]]
+        cell_name = f'{name}_cell{cell}'
+        me = new_mesh(cell_name, vertices, triangles)
+        locations, rotations, scales = placement_transforms(placements)
+        if len(placements) <= LINKED_DUPLICATES:
+            for location, rotation, scale in zip(locations, rotations, scales):
+                ob = bpy.data.objects.new(cell_name, me)
+                ob.location, ob.rotation_euler, ob.scale = location, rotation, scale
+                bpy.context.collection.objects.link(ob)
+                obs.append(ob)
+            continue
+
+        source = bpy.data.objects.new(f'{cell_name}_source', me)
+        bpy.context.collection.objects.link(source)
+        source.hide_viewport = source.hide_render = True
+        points = bpy.data.meshes.new(f'{cell_name}_places')
+        points.vertices.add(len(placements))
+        points.vertices.foreach_set('co', locations.astype(np.float32).ravel())
+        for attribute, values in (('gdsii_rotation', rotations), ('gdsii_scale', scales)):
+            points.attributes.new(attribute, 'FLOAT_VECTOR', 'POINT').data.foreach_set(
+                'vector', values.astype(np.float32).ravel())
+        points.update()
+        ob = bpy.data.objects.new(f'{cell_name}_instances', points)
+        bpy.context.collection.objects.link(ob)
+        modifier = ob.modifiers.new('GDSII instances', 'NODES')
+        modifier.node_group = instancing_node_group(f'{cell_name}_instancing', source)
+        obs += [source, ob]
+    print(f'    {len(cells["vertex_offsets"])-1} cells placed {len(cells["placements"])} times')
+    return obs
+
+LAYER = 'gdsii_layer' # GDSII layer of each imported object
+SOURCE = 'gdsii_source' # file (and its modification time) each object was imported from
+
+def layer_file(folder, layer):
+    """The newest STL, indexed mesh, tile index or instance file of layer in folder ('' if there is none)."""
+    filename = ''
+    for pattern in (f'*_{layer}.stl', f'*_{layer}.npz', f'*_{layer}_tiles.json', f'*_{layer}_instances.npz'):
+        for f in glob.glob(os.path.join(folder, pattern)):
+            if '_tile_' in os.path.basename(f):
+                continue # single tiles are listed in the tile index
+            if filename == '' or os.path.getmtime(f) > os.path.getmtime(filename):
+                filename = f
+    return filename
+
+def source_stamp(filename):
+    return f'{filename}|{os.path.getmtime(filename)}'
+
+def import_layer(layer, filename):
+    """Import the file of a layer; returns the new objects (several for a tiled layer)."""
+    print(f'Blender - Importing {filename}')
+    start_time = time.perf_counter()
+    obj_name = os.path.splitext(os.path.basename(filename.replace('\\','/')))[0]
+
+    if filename.endswith('_tiles.json'):
+        obj_name = obj_name[:-len('_tiles')]
+        obs = tile_objects(filename, obj_name)
+        read_time = time.perf_counter() - start_time
+        print(f'    {len(obs)} tiles, load them with "GDSII: Load tiles in view"')
+    elif filename.endswith('_instances.npz'):
+        obj_name = obj_name[:-len('_instances')]
+        obs = instance_objects(filename, obj_name)
+        read_time = time.perf_counter() - start_time
+    else:
+        preview = os.path.splitext(filename)[0] + '_lod.npz'
+        if os.path.exists(preview) and os.path.getmtime(preview) >= os.path.getmtime(filename):
+            print(f'    opening the coarse preview {preview} first')
+            mesh_data = read_npz(preview)
         else:
-            print(f'Layer {stl_layer} not made yet, cant be used...')
+            preview = None
+            mesh_data = read_npz(filename) if filename.endswith('.npz') else read_stl(filename)
+        if mesh_data is not None:
+            read_time = time.perf_counter() - start_time
+            ob = mesh_object(obj_name, *mesh_data)
+            if preview is not None:
+                ob[FULL_DETAIL] = filename
+        else: # not a binary STL file, leave it to Blender's importer
+            bpy.ops.import_mesh.stl(filepath=filename)
+            read_time = time.perf_counter() - start_time
+            ob = bpy.context.active_object
+        obs = [ob]
+
+    for ob in obs:
+        ob[LAYER] = str(layer)
+        ob[SOURCE] = source_stamp(filename)
+    print(f'    {sum(len(ob.data.polygons) for ob in obs)} triangles, read in {read_time:.2f} s, '
+          f'total {time.perf_counter()-start_time:.2f} s')
+    return obs
+
+def layer_objects(layer):
+    return [ob for ob in bpy.data.objects if ob.get(LAYER) == str(layer)]
+
+def remove_layer(layer):
+    """Delete the objects (and meshes) of a layer."""
+    for ob in layer_objects(layer):
+        me = ob.data
+        groups = [modifier.node_group for modifier in ob.modifiers if modifier.type == 'NODES']
+        bpy.data.objects.remove(ob)
+        if me is not None and me.users == 0:
+            bpy.data.meshes.remove(me)
+        for group in groups:
+            if group is not None and group.users == 0:
+                bpy.data.node_groups.remove(group)
+
+def set_material(obs, material):
+    #apply material
+    if RANDOM_MAT:
+        # Get material
+        mat = bpy.data.materials.new(name=obs[0].name + '_material')
+        mat.diffuse_color = random(), random(), random(), 1
     else:
+        mat = load_material(material)
+
+    for ob in obs:
+        if ob.data.materials:
+            # assign to 1st material slot
+            ob.data.materials[0] = mat
+        else:
+            # no slots
+            ob.data.materials.append(mat)
+
+def set_z_range(obs, lbound, ubound):
+    #apply dimensions on the object transform (the mesh spans z = 0 to STD_thickness)
+    desired_thickness = ubound-lbound
+
+    factor_z = desired_thickness/STD_thickness
+    for ob in obs:
+        ob.scale.z = factor_z
+        ob.location.z = lbound
+
+def sync_layers(folder, layers):
+    """Make the scene show layers, [(layer, material, (lbound, ubound)), ...].
+
+    Layers whose file did not change since they were imported are kept;
+    others are imported (again), and layers that are not listed are removed.
+    Returns the layers that were imported.
+    """
+    wanted = {str(layer) for layer, _, _ in layers}
+    for layer in {ob.get(LAYER) for ob in bpy.data.objects if ob.get(LAYER)} - wanted:
+        remove_layer(layer)
+
+    imported = []
+    for layer, material, (lbound, ubound) in layers:
+        #find file (the newest of the STL, indexed mesh and tile index of the layer)
+        filename = layer_file(folder, layer)
+        if filename == '':
+            print(f'Layer {layer} not made yet, cant be used...')
+            remove_layer(layer)
+            continue
+        obs = layer_objects(layer)
+        if not obs or obs[0].get(SOURCE) != source_stamp(filename):
+            remove_layer(layer)
+            obs = import_layer(layer, filename)
+            imported.append(str(layer))
+        set_material(obs, material)
+        set_z_range(obs, lbound, ubound)
+    return imported
+
+def z_range(lbound, ubound):
+    # heights of a layer row; the standard thickness when they are left empty
+    if str(lbound) == '' or str(ubound) == '':
+        return (0, STD_thickness)
+    return (int(lbound), int(ubound))
+
+# With --port <port> --token <token> after the layer arguments, Blender keeps
+# listening on localhost:<port> after the import, so that the GUI can update
+# this scene instead of starting a new Blender for every change (see
+# BlendGDSII.App.open_blender and gdsii_blender.py). Commands and replies are
+# JSON objects, one per line. Every command carries the token
+# ("token": <token>, left out below); a connection that sends a command
+# without it gets an error reply and is closed.
+#
+#   {"command": "sync", "folder": ..., "layers": [[layer, material, lbound, ubound], ...]}
+#       import new and changed layers, remove unlisted ones, set materials and heights
+#   {"command": "replace_layer", "folder": ..., "layer": ...}
+#   {"command": "set_material", "layer": ..., "material": ...}
+#   {"command": "set_z_range", "layer": ..., "lbound": ..., "ubound": ...}
+#   {"command": "remove_layer", "layer": ...}
+#   {"command": "ping"}
+#
+# Replies are {"ok": true, ...} or {"ok": false, "error": ...}. The commands
+# run in Blender's main thread, from a timer that polls the socket.
+POLL_INTERVAL = 0.1 # [s]
+
+def redraw():
+    for area in (bpy.context.screen.areas if bpy.context.screen else []):
+        area.tag_redraw()
+
+def command_sync(folder, layers):
+    imported = sync_layers(folder, [(layer, material, z_range(lbound, ubound))
+                                    for layer, material, lbound, ubound in layers])
+    return dict(imported=imported)
+
+def command_replace_layer(folder, layer):
+    filename = layer_file(folder, layer)
+    if filename == '':
+        raise FileNotFoundError(f'layer {layer} not made yet')
+    old = layer_objects(layer)
+    transform = (old[0].scale.z, old[0].location.z) if old else None
+    materials = list(old[0].data.materials) if old else []
+    remove_layer(layer)
+    obs = import_layer(layer, filename)
+    for ob in obs:
+        for mat in materials:
+            ob.data.materials.append(mat)
+        if transform is not None:
+            ob.scale.z, ob.location.z = transform
+    return dict(objects=len(obs))
+
+def command_set_material(layer, material):
+    set_material(layer_objects(layer), material)
+
+def command_set_z_range(layer, lbound, ubound):
+    set_z_range(layer_objects(layer), *z_range(lbound, ubound))
+
+def command_remove_layer(layer):
+    remove_layer(layer)
+
+def command_ping():
+    return dict(layers=sorted({ob.get(LAYER) for ob in bpy.data.objects if ob.get(LAYER)}))
+
+COMMANDS = {
+    'sync': command_sync,
+    'replace_layer': command_replace_layer,
+    'set_material': command_set_material,
+    'set_z_range': command_set_z_range,
+    'remove_layer': command_remove_layer,
+    'ping': command_ping,
+}
+
+class CommandServer:
+    """Listen on localhost:port for the commands in COMMANDS that carry token."""
+
+    def __init__(self, port, token):
+        if not token:
+            raise ValueError('a session token is needed to listen for commands')
+        self.token = token
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', port))
+        self.listener.listen()
+        self.listener.setblocking(False)
+        self.clients = {} # connection: bytes received so far
+        bpy.app.timers.register(self.poll, persistent=True)
+        print(f'Blender - Listening for the GUI on port {port}')
+
+    def poll(self):
+        try:
+            while True:
+                connection, _ = self.listener.accept()
+                connection.setblocking(False)
+                self.clients[connection] = b''
+        except BlockingIOError:
+            pass
+
+        for connection in list(self.clients):
+            try:
+                data = connection.recv(65536)
+            except BlockingIOError:
+                continue
+            except OSError:
+                data = b''
+            if not data: # closed by the GUI
+                connection.close()
+                del self.clients[connection]
+                continue
+            self.clients[connection] += data
+            while connection in self.clients and b'\n' in self.clients[connection]:
+                line, self.clients[connection] = self.clients[connection].split(b'\n', 1)
+                command = self.parse(line)
+                rejected = command is None
+                reply = dict(ok=False, error='PermissionError: missing or wrong session token') if rejected \
+                    else self.run(command)
+                connection.setblocking(True)
+                try:
+                    connection.sendall((json.dumps(reply) + '\n').encode())
+                except OSError: # closed by the GUI
+                    rejected = True
+                connection.setblocking(False)
+                if rejected: # do not listen to this connection anymore
+                    connection.close()
+                    del self.clients[connection]
+        return POLL_INTERVAL
+
+    def parse(self, line):
+        # the command of a line, or None when it does not carry the session token
+        try:
+            command = json.loads(line)
+            token = command.pop('token')
+        except (ValueError, AttributeError, KeyError, TypeError):
+            return None
+        if not isinstance(token, str) or not hmac.compare_digest(token.encode(), self.token.encode()):
+            print('Blender - Rejected a command without the session token')
+            return None
+        return command
+
+    def run(self, command):
+        start_time = time.perf_counter()
+        try:
+            name = command.pop('command')
+            print(f'Blender - Command {name}')
+            result = COMMANDS[name](**command) or {}
+            redraw()
+            return dict(ok=True, seconds=time.perf_counter()-start_time, **result)
+        except Exception as error:
+            traceback.print_exc()
+            return dict(ok=False, error=f'{type(error).__name__}: {error}')
+
+bpy.data.objects['Cube'].select_set(True)
+bpy.data.objects['Light'].select_set(True)
+bpy.ops.object.delete(use_global=False)
+
+for stl_check,stl_layer in zip(stl_checks,stl_layers):
+    if not stl_check:
         print(f'Layer {stl_layer} not imported')
+sync_layers(stl_folder_path, [(stl_layer, stl_material, stl_dimension) for stl_check,stl_layer,stl_material,stl_dimension
+                              in zip(stl_checks,stl_layers,stl_materials,stl_dimensions) if stl_check])
 
 bpy.ops.object.select_all(action='SELECT')
 bpy.data.objects['Camera'].select_set(False)
 
-for area in bpy.context.screen.areas:
+screen_areas = bpy.context.screen.areas if bpy.context.screen else [] # no screen with --background
+for area in screen_areas:
     if area.type == 'VIEW_3D':
         ctx = bpy.context.copy()
         ctx['area'] = area
@@ -162,3 +680,9 @@ bpy.context.scene.render.film_transparent = True
 
 
 bpy.ops.object.select_all(action='DESELECT')
+
+if session_port is not None:
+    try:
+        command_server = CommandServer(session_port, session_token)
+    except (OSError, ValueError) as error: # e.g. another Blender session listens already
+        print(f'Blender - Cannot listen for the GUI on port {session_port}: {error}')
@@ -0,0 +1,90 @@
+'''Connection from the GUI to a Blender session that stays open.
+
+bpy_import_stls.py, started with --port <port> --token <token> after its
+layer arguments, keeps Blender listening on localhost:<port> for commands
+(see CommandServer there), so that a changed layer, material or height only
+updates the open scene instead of starting a new Blender. Blender only runs
+commands that carry the token it was started with; new_session_token() makes
+one for every Blender that is started. send_command() sends one command and
+returns Blender's reply:
+
+    token = new_session_token()
+    # start Blender with [..., '--port', str(BLENDER_PORT), '--token', token]
+    send_command('sync', token=token, folder=stl_folder, layers=[['1', 'Gold', '0', '100']])
+    send_command('set_material', token=token, layer='1', material='Silicon')
+
+find_blender() looks for the Blender installation the first time it is
+needed, instead of when the GUI starts.
+'''
+
+import os
+import re
+import sys
+import json
+import glob
+import socket
+import shutil
+import secrets
+import functools
+
+BLENDER_PORT = 50321 # localhost port of the Blender session
+
+# where Blender is usually installed, per platform (glob patterns)
+BLENDER_PATH_PATTERNS = {
+    'win32': [r'C:\Program Files\Blender Foundation\Blender*\blender.exe'],
+    'darwin': ['/Applications/Blender*.app/Contents/MacOS/Blender'],
+    'linux': ['/usr/bin/blender', '/usr/local/bin/blender', '/snap/bin/blender',
+              '/opt/blender*/blender', os.path.expanduser('~/blender*/blender')],
+}
+
+def _version_order(path):
+    # Blender 3.10 after Blender 3.9
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', path)]
+
+@functools.lru_cache(maxsize=None)
+def find_blender():
+    """Path of the newest Blender installation, or None when there is none.
+
+    Blender on the PATH comes first; otherwise the usual install folders of
+    this platform are searched. The result is cached.
+    """
+    on_path = shutil.which('blender')
+    if on_path is not None:
+        return on_path
+    for pattern in BLENDER_PATH_PATTERNS.get(sys.platform, BLENDER_PATH_PATTERNS['linux']):
+        found = sorted(glob.glob(pattern), key=_version_order)
+        if found:
+            return found[-1]
+    return None
+
+def new_session_token():
+    """A random token for a Blender session that is about to be started."""
+    return secrets.token_hex(16)
+
+def send_command(command, token, port=BLENDER_PORT, timeout=600.0, **arguments):
+    """Send a command with its arguments to the Blender session; returns the reply (a dictionary).
+
+    token is the one Blender was started with. Raises OSError
+    (ConnectionRefusedError) when no Blender session listens on port, and
+    RuntimeError when Blender reports an error, also when it rejects the token.
+    """
+    with socket.create_connection(('127.0.0.1', port), timeout=timeout) as connection:
+        connection.sendall((json.dumps(dict(command=command, token=token, **arguments)) + '\n').encode())
+        reply = b''
+        while not reply.endswith(b'\n'):
+            data = connection.recv(65536)
+            if not data:
+                raise ConnectionError('Blender closed the connection')
+            reply += data
+    reply = json.loads(reply)
+    if not reply['ok']:
+        raise RuntimeError(reply['error'])
+    return reply
+
+def session_running(token, port=BLENDER_PORT):
+    """Whether the Blender session started with token answers on port."""
+    try:
+        send_command('ping', token, port, timeout=2.0)
+        return True
+    except (OSError, RuntimeError, ValueError):
+        return False
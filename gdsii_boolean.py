@@ -0,0 +1,134 @@
+'''Boolean operations on packed layer polygons, using gdspy's clipper engine.
+
+crop_cells() restricts a conversion to a region of interest: polygons are
+sorted out by their bounding boxes, and only those crossing the border of
+the region are clipped.
+
+merge_polygons() replaces the polygons of a layer by the outline of their
+union, so overlapping shapes (fill patterns, stacked paths, redundant boxes)
+are extruded as one solid instead of as many intersecting ones with hidden
+internal walls. By default the whole layer is merged in one boolean
+operation. With polygons_per_tile, large layers are merged tile by tile
+instead: each polygon goes to every tile its bounding box touches and each
+tile's union is clipped to the tile, which keeps every boolean operation
+small. The tile borders then remain as cuts through the merged outlines
+(walls inside the solids), and the result depends on the tile size, so
+tiling is only worth it for layers too large to merge at once.
+'''
+
+import numpy as np # fast math on lots of points
+import gdspy # boolean operations
+
+from gdsii_geometry import pack_polygons, unpack_polygons, polygon_bounds, select_polygons, concatenate_polygons
+from gdsii_hierarchy import IDENTITY, placed_bounds
+
+POLYGONS_PER_TILE = 5000 # a good polygons_per_tile for layers too large to merge at once
+
+def _pack_result(polygon_sets):
+    polygons = []
+    for result in polygon_sets:
+        if result is not None:
+            polygons.extend(result.polygons)
+    return pack_polygons(polygons)
+
+def merge_polygons(vertices, offsets, polygons_per_tile=None, precision=1e-3):
+    """Union of packed polygons, returned packed again.
+
+    Holes in the result come back the GDSII way: the outline runs into the
+    hole and back out along a cut line. polygons_per_tile=None merges all
+    polygons at once; a number merges tiles of about that many polygons,
+    with cuts along the tile borders.
+    """
+    num_polygons = len(offsets)-1
+    if num_polygons < 2:
+        return vertices, offsets
+    polygons = unpack_polygons(vertices, offsets)
+    bounds = polygon_bounds(vertices, offsets)
+
+    tiles = 1 if polygons_per_tile is None else int(np.ceil(np.sqrt(num_polygons / polygons_per_tile)))
+    if tiles <= 1:
+        return _pack_result([gdspy.boolean(polygons, None, 'or', precision=precision, max_points=0)])
+
+    # tile grid over the layer, and the range of tiles each polygon touches
+    xmin, ymin = np.nanmin(bounds[:, :2], axis=0)
+    xmax, ymax = np.nanmax(bounds[:, 2:], axis=0)
+    x_edges = np.linspace(xmin, xmax, tiles+1)
+    y_edges = np.linspace(ymin, ymax, tiles+1)
+    first_x = np.clip(np.searchsorted(x_edges, bounds[:, 0], side='right')-1, 0, tiles-1)
+    last_x = np.clip(np.searchsorted(x_edges, bounds[:, 2], side='left')-1, 0, tiles-1)
+    first_y = np.clip(np.searchsorted(y_edges, bounds[:, 1], side='right')-1, 0, tiles-1)
+    last_y = np.clip(np.searchsorted(y_edges, bounds[:, 3], side='left')-1, 0, tiles-1)
+
+    # one (tile, polygon) pair for every tile a polygon's bounding box touches
+    span_x = last_x - first_x + 1
+    span_y = last_y - first_y + 1
+    owner = np.repeat(np.arange(num_polygons), span_x*span_y)
+    step = np.arange(len(owner)) - np.repeat(np.cumsum(span_x*span_y) - span_x*span_y, span_x*span_y)
+    tile_x = first_x[owner] + step % span_x[owner]
+    tile_y = first_y[owner] + step // span_x[owner]
+    tile = tile_x*tiles + tile_y
+    order = np.argsort(tile, kind='stable')
+    tile, owner = tile[order], owner[order]
+    starts = np.flatnonzero(np.r_[True, tile[1:] != tile[:-1]])
+    stops = np.r_[starts[1:], len(tile)]
+
+    results = []
+    for start, stop in zip(starts, stops):
+        i, j = divmod(tile[start], tiles)
+        window = gdspy.Rectangle((x_edges[i], y_edges[j]), (x_edges[i+1], y_edges[j+1]))
+        results.append(gdspy.boolean([polygons[p] for p in owner[start:stop]], window, 'and',
+                                     precision=precision, max_points=0))
+    return _pack_result(results)
+
+def _window_overlap(bounds, region):
+    # which boxes lie inside the region, and which overlap it at all
+    xmin, ymin, xmax, ymax = region
+    with np.errstate(invalid='ignore'): # empty polygons have nan bounds
+        inside = (bounds[..., 0] >= xmin) & (bounds[..., 1] >= ymin) & (bounds[..., 2] <= xmax) & (bounds[..., 3] <= ymax)
+        overlap = (bounds[..., 0] < xmax) & (bounds[..., 1] < ymax) & (bounds[..., 2] > xmin) & (bounds[..., 3] > ymin)
+    return inside, overlap
+
+def clip_polygons(vertices, offsets, region, precision=1e-3):
+    """Cut packed polygons to the rectangle region = (xmin, ymin, xmax, ymax).
+
+    Polygons outside the region are dropped and those inside it kept as they
+    are; only the ones crossing its border go through the boolean engine,
+    one at a time so that overlapping polygons stay separate.
+    """
+    inside, overlap = _window_overlap(polygon_bounds(vertices, offsets), region)
+    parts = [select_polygons(vertices, offsets, inside)]
+    crossing = overlap & ~inside
+    if crossing.any():
+        window = gdspy.Rectangle(region[:2], region[2:])
+        parts.append(_pack_result([gdspy.boolean([polygon], window, 'and', precision=precision, max_points=0)
+            for polygon in unpack_polygons(*select_polygons(vertices, offsets, crossing))]))
+    return concatenate_polygons(parts)
+
+def crop_cells(cells, region):
+    """Restrict the (layers, placements) cells of gdsiistl() to a region of the layout.
+
+    region is (xmin, ymin, xmax, ymax) in layout units. Placements of a cell
+    that lie inside the region are kept and those outside it dropped. The
+    polygons of placements crossing the border are moved to layout
+    coordinates and clipped; they make up one extra cell, placed once.
+    """
+    cropped = []
+    border = {} # layer -> clipped polygons in layout coordinates
+    for layers, placements in cells:
+        filled = [vertices for vertices, offsets in layers.values() if len(vertices) > 0]
+        if not filled:
+            continue
+        points = np.concatenate(filled)
+        cell_bounds = np.concatenate((points.min(axis=0), points.max(axis=0)))
+        inside, overlap = _window_overlap(placed_bounds(cell_bounds[None], placements)[:, 0], region)
+        if inside.any():
+            cropped.append((layers, placements[inside]))
+        for placement in placements[overlap & ~inside]:
+            for layer, (vertices, offsets) in layers.items():
+                placed = vertices @ placement[:2, :2].T + placement[:2, 2]
+                border.setdefault(layer, []).append(clip_polygons(placed, offsets, region))
+    border = {layer: concatenate_polygons(parts) for layer, parts in border.items()}
+    border = {layer: packed for layer, packed in border.items() if len(packed[1]) > 1}
+    if border:
+        cropped.append((border, IDENTITY[None]))
+    return cropped
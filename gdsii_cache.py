@@ -0,0 +1,326 @@
+'''On-disk caches for gdsiistl().
+
+TriangulationCache stores triangulations in chunks of a fixed number of
+consecutive polygons (of one layer, or of one cell/layer pair in hierarchy
+mode), each under a hash of its polygon vertices and the inset parameters.
+Re-converting a file after changing only heights or materials then skips the
+triangulation of every chunk, and after editing some polygons only the
+chunks that hold them are triangulated again. The cache has a size limit;
+the least recently used entries are removed first.
+
+GeometryCache stores the polygons that were read from a GDSII file (flattened,
+or with their hierarchy), per layer, under the content hash of the file. They
+are saved as flat .npy columns that later conversions memory-map, reading only
+the layers they convert, so picking other layers of the same file does not
+read the file again; layers that are not in the cache yet are read and added.
+
+Clear both caches from the command line with:
+
+    python gdsii_cache.py --clear
+'''
+
+import os
+import json
+import shutil
+import hashlib
+import argparse
+
+import numpy as np # fast math on lots of points
+
+from gdsii_manifest import file_hash
+from gdsii_hierarchy import IDENTITY
+
+MY_PATH = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CACHE_PATH = os.path.join(MY_PATH, 'cache')
+DEFAULT_CACHE_SIZE = 2*1024**3 # bytes
+DEFAULT_CHUNK_POLYGONS = 4096 # polygons per triangulation cache entry
+
+DEFAULT_GEOMETRY_CACHE_PATH = os.path.join(MY_PATH, 'cache', 'geometry')
+DEFAULT_GEOMETRY_CACHE_SIZE = 4*1024**3 # bytes
+
+# bump this whenever a change to the triangulation stage changes its output
+TRIANGULATION_VERSION = 4
+# bump this whenever a change to the readers changes the polygons they return
+GEOMETRY_VERSION = 3
+
+class TriangulationCache:
+    """Content-addressed store of triangulations, one .npz file per entry."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_CACHE_SIZE, chunk_polygons=DEFAULT_CHUNK_POLYGONS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.chunk_polygons = chunk_polygons
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, vertices, offsets, **parameters):
+        """Hash polygon data and the parameters that change its triangulation."""
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(repr((TRIANGULATION_VERSION, sorted(parameters.items()))).encode())
+        digest.update(np.ascontiguousarray(offsets, dtype=np.int64).tobytes())
+        digest.update(np.ascontiguousarray(vertices, dtype=np.float64).tobytes())
+        return digest.hexdigest()
+
+    def chunks(self, vertices, offsets, **parameters):
+        """Split packed polygons into cache entries: a list of (start, stop, key).
+
+        Polygons start to stop-1 are stored under key; there is always at
+        least one chunk, which is empty when there are no polygons.
+        """
+        num_polygons = len(offsets)-1
+        chunks = []
+        for start in range(0, max(num_polygons, 1), self.chunk_polygons):
+            stop = min(start + self.chunk_polygons, num_polygons)
+            first, last = offsets[start], offsets[stop]
+            chunks.append((start, stop, self.key(vertices[first:last], offsets[start:stop+1] - first, **parameters)))
+        return chunks
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], key + '.npz')
+
+    def get(self, key):
+        """Return the stored dictionary of arrays for key, or None."""
+        filename = self._file(key)
+        try:
+            with np.load(filename) as data:
+                entry = {name: data[name] for name in data.files}
+        except (OSError, ValueError): # missing or unreadable (e.g. half written)
+            self.misses += 1
+            return None
+        os.utime(filename) # mark as recently used
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        """Store a dictionary of arrays under key."""
+        filename = self._file(key)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        temporary = f'{filename}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as f:
+            np.savez(f, **entry)
+        os.replace(temporary, filename) # never leave a half written entry
+
+    def _entries(self):
+        entries = []
+        if not os.path.isdir(self.path):
+            return entries
+        for folder in os.scandir(self.path):
+            if not folder.is_dir():
+                continue
+            for f in os.scandir(folder.path):
+                if f.name.endswith('.npz'):
+                    stat = f.stat()
+                    entries.append((stat.st_mtime, stat.st_size, f.path))
+        return entries
+
+    def size(self):
+        """Total size of the cache in bytes."""
+        return sum(size for _, size, _ in self._entries())
+
+    def trim(self):
+        """Remove least recently used entries until the cache fits max_bytes."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, filename in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                continue
+            total -= size
+        return total
+
+    def clear(self):
+        """Remove all entries; returns the number of bytes freed."""
+        freed = 0
+        for _, size, filename in self._entries():
+            try:
+                os.remove(filename)
+            except OSError:
+                continue
+            freed += size
+        return freed
+
+class GeometryCache:
+    """Read layer geometry of GDSII files, one folder per file and way of reading.
+
+    A folder holds, for every stored layer, five .npy columns over all cells
+    with polygons on that layer: the vertices and polygon offsets (as packed
+    by gdsii_geometry.pack_polygons, one after the other), where the polygons
+    of each cell start, the placements of all cells and where the placements
+    of each cell start. layers.json lists the stored layers, including layers
+    without geometry.
+    """
+
+    COLUMNS = ('vertices', 'offsets', 'cells', 'placements', 'cell_placements')
+
+    def __init__(self, path=DEFAULT_GEOMETRY_CACHE_PATH, max_bytes=DEFAULT_GEOMETRY_CACHE_SIZE):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def _sources_file(self):
+        return os.path.join(self.path, 'sources.json')
+
+    def fingerprint(self, gdsii_file_path):
+        """Content hash of a GDSII file; only recomputed when its size or modification time changed."""
+        stat = os.stat(gdsii_file_path)
+        path = os.path.abspath(gdsii_file_path)
+        try:
+            with open(self._sources_file(), 'r') as f:
+                sources = json.load(f)
+        except (OSError, ValueError):
+            sources = {}
+        known = sources.get(path, {})
+        if known.get('size') == stat.st_size and known.get('mtime') == stat.st_mtime_ns:
+            return known['hash']
+        sources[path] = dict(size=stat.st_size, mtime=stat.st_mtime_ns, hash=file_hash(gdsii_file_path))
+        os.makedirs(self.path, exist_ok=True)
+        temporary = f'{self._sources_file()}.{os.getpid()}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(sources, f, indent=1)
+        os.replace(temporary, self._sources_file())
+        return sources[path]['hash']
+
+    def key(self, gdsii_file_path, **reading):
+        """Key of a GDSII file read in a certain way (e.g. streaming=True, hierarchy=False)."""
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(repr((GEOMETRY_VERSION, self.fingerprint(gdsii_file_path), sorted(reading.items()))).encode())
+        return digest.hexdigest()
+
+    def _folder(self, key):
+        return os.path.join(self.path, key)
+
+    def _stored_layers(self, key):
+        try:
+            with open(os.path.join(self._folder(key), 'layers.json'), 'r') as f:
+                return {int(layer) for layer in json.load(f)}
+        except (OSError, ValueError):
+            return set()
+
+    def get(self, key, layers, flat=False):
+        """The stored cells of the given layers, and the layers that are not stored.
+
+        Returns (cells, missing) with cells the (layers, placements) pairs of
+        gdsiistl(), their arrays memory-mapped from the cache. Every cell has
+        one layer; with flat=True all layers are combined into a single cell,
+        placed once (for geometry stored flattened).
+        """
+        stored = self._stored_layers(key)
+        missing = [layer for layer in layers if layer not in stored]
+        cells = []
+        for layer in layers:
+            if layer in missing or not os.path.exists(self._column(key, layer, 'vertices')):
+                continue # not stored, or without geometry
+            columns = {name: np.load(self._column(key, layer, name), mmap_mode='r') for name in self.COLUMNS}
+            vertices, offsets, polygons = columns['vertices'], columns['offsets'], columns['cells']
+            for cell in range(len(polygons)-1):
+                first, last = polygons[cell], polygons[cell+1]
+                cell_offsets = offsets[first:last+1]
+                if cell_offsets[0] != 0:
+                    cell_offsets = cell_offsets - cell_offsets[0] # offsets are per cell
+                placements = columns['placements'][columns['cell_placements'][cell]:columns['cell_placements'][cell+1]]
+                cells.append(({layer: (vertices[offsets[first]:offsets[last]], cell_offsets)}, placements))
+        if stored:
+            os.utime(os.path.join(self._folder(key), 'layers.json')) # mark as recently used
+        if flat:
+            cells = [({layer: polygons for layers, _ in cells for layer, polygons in layers.items()}, IDENTITY[None])]
+        return cells, missing
+
+    def _column(self, key, layer, name):
+        return os.path.join(self._folder(key), f'{layer}_{name}.npy')
+
+    def put(self, key, cells, layers):
+        """Store the given layers of cells ((layers, placements) pairs as read) under key."""
+        folder = self._folder(key)
+        os.makedirs(folder, exist_ok=True)
+        for layer in layers:
+            parts = [(cell_layers[layer], placements) for cell_layers, placements in cells if layer in cell_layers]
+            if not parts:
+                continue # without geometry: only listed in layers.json
+            vertex_counts = [len(vertices) for (vertices, _), _ in parts]
+            polygon_counts = [len(offsets)-1 for (_, offsets), _ in parts]
+            vertex_starts = np.cumsum([0] + vertex_counts[:-1])
+            columns = dict(
+                vertices=np.concatenate([vertices for (vertices, _), _ in parts]).astype(np.float64, copy=False),
+                offsets=np.append(np.concatenate([offsets[:-1] + start for ((_, offsets), _), start in zip(parts, vertex_starts)]),
+                                  sum(vertex_counts)).astype(np.int64),
+                cells=np.cumsum([0] + polygon_counts).astype(np.int64),
+                placements=np.concatenate([placements for _, placements in parts]).astype(np.float64, copy=False),
+                cell_placements=np.cumsum([0] + [len(placements) for _, placements in parts]).astype(np.int64))
+            for name, column in columns.items():
+                filename = self._column(key, layer, name)
+                temporary = f'{filename}.{os.getpid()}.tmp'
+                with open(temporary, 'wb') as f:
+                    np.save(f, column)
+                os.replace(temporary, filename) # never leave a half written column
+        # the layers are only listed once all their columns are written
+        stored = sorted(self._stored_layers(key) | set(layers))
+        filename = os.path.join(folder, 'layers.json')
+        temporary = f'{filename}.{os.getpid()}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(stored, f)
+        os.replace(temporary, filename)
+
+    def _entries(self):
+        entries = []
+        if not os.path.isdir(self.path):
+            return entries
+        for folder in os.scandir(self.path):
+            if not folder.is_dir():
+                continue
+            size = sum(f.stat().st_size for f in os.scandir(folder.path))
+            try:
+                used = os.stat(os.path.join(folder.path, 'layers.json')).st_mtime
+            except OSError:
+                used = 0.0
+            entries.append((used, size, folder.path))
+        return entries
+
+    def size(self):
+        """Total size of the cache in bytes."""
+        return sum(size for _, size, _ in self._entries())
+
+    def _remove(self, folder):
+        # unlist the layers first, so that a folder that is partly removed
+        # (files still mapped by another conversion) is read again
+        try:
+            os.remove(os.path.join(folder, 'layers.json'))
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return False
+        shutil.rmtree(folder, ignore_errors=True)
+        return not os.path.exists(folder)
+
+    def trim(self):
+        """Remove the least recently used files until the cache fits max_bytes."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, folder in entries:
+            if total <= self.max_bytes:
+                break
+            if self._remove(folder):
+                total -= size
+        return total
+
+    def clear(self):
+        """Remove all entries; returns the number of bytes freed."""
+        freed = 0
+        for _, size, folder in self._entries():
+            if self._remove(folder):
+                freed += size
+        return freed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Manage the BlendGDSII triangulation and geometry caches.')
+    parser.add_argument('--path', default=DEFAULT_CACHE_PATH, help='triangulation cache folder')
+    parser.add_argument('--geometry-path', default=DEFAULT_GEOMETRY_CACHE_PATH, help='geometry cache folder')
+    parser.add_argument('--clear', action='store_true', help='remove all cached triangulations and geometry')
+    args = parser.parse_args()
+
+    for cache in (TriangulationCache(args.path), GeometryCache(args.geometry_path)):
+        if args.clear:
+            print(f'Cleared {cache.clear()/1024**2:.1f} MB from {cache.path}')
+        else:
+            print(f'{cache.path}: {cache.size()/1024**2:.1f} MB of {cache.max_bytes/1024**2:.0f} MB')
@@ -0,0 +1,173 @@
+'''Ear-clipping triangulation of packed polygons, all polygons at once.
+
+A polygon is triangulated by cutting off "ears": corners whose triangle with
+their two neighbours lies inside the polygon, i.e. the corner turns the way
+the polygon winds and no other corner of the polygon lies in the triangle.
+earcut_polygons() does this for every polygon of a packed set (see
+gdsii_geometry) in rounds of numpy operations instead of one polygon at a
+time in Python: each round finds the ears of all remaining outlines and cuts
+off as many of them as it can without cutting two neighbours, so most
+polygons are done after a few dozen rounds.
+
+GDSII holes need no special treatment: the cut line into a hole becomes a
+thin slit once the outline is inset (see gdsii_geometry.inset_polygons), and
+an outline with a slit is clipped like any other. Straight corners are
+clipped as zero-area triangles so that the caps keep every outline vertex.
+Polygons that cannot be clipped (self-intersecting outlines, or no ear left
+because of rounding) and polygons whose triangles do not add up to their
+area are reported as failed and get no triangles; gdsii_triangulate gives
+those to the triangle library.
+'''
+
+import numpy as np # fast math on lots of points
+
+from gdsii_geometry import polygon_ids, next_indices, previous_indices, signed_areas, polygon_bounds
+
+MAX_PAIRS = 1 << 22 # (corner, blocking vertex) pairs tested at once in the ear test
+AREA_TOLERANCE = 1e-6 # relative difference allowed between the triangles and the polygon area
+
+def _order_keys(count):
+    # a fixed pseudo-random order of the vertices (the multiplier is odd, so
+    # the keys are unique), to pick which of two neighbouring ears goes first
+    return (np.arange(count, dtype=np.uint64)*np.uint64(2654435761)) & np.uint64(0xffffffff)
+
+def _ragged_arange(starts, counts):
+    # concatenated aranges starts[i] ... starts[i]+counts[i]-1
+    before = np.cumsum(counts) - counts
+    return np.arange(counts.sum()) + np.repeat(starts - before, counts)
+
+def _sort_keys(vertices, offsets):
+    # a key per point that sorts by polygon, then by the coordinate along
+    # the longer side of the polygon's bounding box: polygon + 0.25..0.75.
+    # The key only grows with the coordinate, so the points in a box have
+    # keys between those of its corners.
+    bounds = polygon_bounds(vertices, offsets)
+    size = bounds[:, 2:] - bounds[:, :2]
+    polygon = np.arange(len(bounds))
+    axis = (size[:, 1] > size[:, 0]).astype(np.int64)
+    low = bounds[polygon, axis]
+    span = np.where(size[polygon, axis] > 0, size[polygon, axis], 1.0)
+    def key(points, polygons):
+        coordinate = points[np.arange(len(points)), axis[polygons]]
+        return polygons + 0.25 + 0.5*(coordinate - low[polygons])/span[polygons]
+    return key
+
+def _blocked(vertices, corners, previous, following, sign, polygons, blockers, blocker_polygons, sort_key):
+    # whether any blocking vertex of the same polygon lies in the triangle of
+    # each convex corner (on its edges counts as well, its own corners not).
+    # Only the blockers whose sort key lies between those of the corners of
+    # the triangle's bounding box are tested.
+    blocked = np.zeros(len(corners), dtype=bool)
+    blocker_keys = sort_key(vertices[blockers], blocker_polygons)
+    order = np.argsort(blocker_keys, kind='stable')
+    blockers, blocker_keys = blockers[order], blocker_keys[order]
+    x, y = vertices[blockers, 0], vertices[blockers, 1]
+    triangle = np.stack((previous, corners, following))
+    points = vertices[triangle] # (3, corners, 2)
+    first = np.searchsorted(blocker_keys, sort_key(points.min(axis=0), polygons), side='left')
+    counts = np.searchsorted(blocker_keys, sort_key(points.max(axis=0), polygons), side='right') - first
+    # the edges of every triangle, turned so that inside is on their left
+    edges = (np.roll(points, -1, axis=0) - points)*sign[:, None]
+    total = np.cumsum(counts)
+    start = 0
+    while start < len(corners):
+        # as many corners as fit in MAX_PAIRS pairs, at least one
+        stop = max(start+1, int(np.searchsorted(total, total[start] - counts[start] + MAX_PAIRS, side='right')))
+        pair_counts = counts[start:stop]
+        corner = np.repeat(np.arange(start, stop), pair_counts)
+        blocker = _ragged_arange(first[start:stop], pair_counts)
+        inside = np.ones(len(corner), dtype=bool)
+        for edge, point in zip(edges, points):
+            inside &= (edge[corner, 0]*(y[blocker] - point[corner, 1]) >=
+                       edge[corner, 1]*(x[blocker] - point[corner, 0]))
+        # a vertex on one of the triangle's corners (e.g. the other end of a
+        # slit) does not block it
+        corner, blocker = corner[inside], blocker[inside]
+        on_corner = np.zeros(len(corner), dtype=bool)
+        for point in points:
+            on_corner |= (x[blocker] == point[corner, 0]) & (y[blocker] == point[corner, 1])
+        blocked[corner[~on_corner]] = True
+        start = stop
+    return blocked
+
+def earcut_polygons(vertices, offsets, clockwise=None):
+    """Triangulate packed polygons by ear clipping.
+
+    Returns (triangulation, failed): a triangulation dictionary (see
+    gdsii_triangulate) whose vertices are the polygon vertices themselves,
+    with counterclockwise triangles, and a boolean array of the polygons
+    that could not be triangulated (they have no triangles).
+    """
+    num_polygons = len(offsets)-1
+    vertices = np.asarray(vertices, dtype=np.float64)
+    if clockwise is None:
+        clockwise = signed_areas(vertices, offsets) > 0
+    owner = polygon_ids(offsets)
+    # +1 where corners of a polygon have to turn left to be convex
+    orientation = np.where(clockwise, -1.0, 1.0)[owner] if len(owner) else np.zeros(0)
+    keys = _order_keys(len(vertices))
+    sort_key = _sort_keys(vertices, offsets)
+    previous = previous_indices(offsets)
+    following = next_indices(offsets)
+    remaining = np.diff(offsets)
+    failed = np.zeros(num_polygons, dtype=bool)
+    ear = np.zeros(len(vertices), dtype=bool)
+    parts = [] # (p, v, n) vertex indices of the clipped triangles, per round
+
+    active = np.flatnonzero(remaining[owner] >= 3) # corners of the polygons still being clipped
+    while len(active):
+        polygon = owner[active]
+        p, n = previous[active], following[active]
+        incoming = vertices[active] - vertices[p]
+        outgoing = vertices[n] - vertices[active]
+        turn = orientation[active]*(incoming[:, 0]*outgoing[:, 1] - incoming[:, 1]*outgoing[:, 0])
+        convex = turn > 0
+        straight = turn == 0
+
+        # every vertex that does not turn the polygon's way can block an ear
+        blocking = active[~convex]
+        candidates = np.flatnonzero(convex)
+        is_ear = straight.copy()
+        is_ear[candidates] = ~_blocked(vertices, active[candidates], p[candidates], n[candidates],
+                                      orientation[active[candidates]], polygon[candidates],
+                                      blocking, owner[blocking], sort_key)
+
+        # cut the ears whose neighbours are no ears or come later in the order
+        ear[active] = is_ear
+        cut = is_ear & ~(ear[p] & (keys[p] < keys[active])) & ~(ear[n] & (keys[n] < keys[active]))
+        ear[active] = False
+
+        # a polygon without an ear to cut cannot be clipped
+        clipped = np.bincount(polygon[cut], minlength=num_polygons) > 0
+        stuck = np.unique(polygon[~clipped[polygon]])
+        failed[stuck] = True
+
+        v = active[cut]
+        parts.append(np.stack((p[cut], v, n[cut]), axis=1))
+        following[p[cut]] = n[cut]
+        previous[n[cut]] = p[cut]
+        remaining -= np.bincount(polygon[cut], minlength=num_polygons)
+        keep = ~cut & (remaining[polygon] >= 3) & ~failed[polygon]
+        active = active[keep]
+
+    corners = np.concatenate(parts, axis=0) if parts else np.zeros((0, 3), dtype=np.int64)
+    triangle_owner = owner[corners[:, 0]]
+
+    # a polygon whose triangles do not cover its area (it crosses itself)
+    # counts as failed as well
+    a, b, c = vertices[corners[:, 0]], vertices[corners[:, 1]], vertices[corners[:, 2]]
+    doubled = (b[:, 0]-a[:, 0])*(c[:, 1]-a[:, 1]) - (b[:, 1]-a[:, 1])*(c[:, 0]-a[:, 0])
+    covered = np.bincount(triangle_owner, weights=np.abs(doubled), minlength=num_polygons)
+    area = np.abs(signed_areas(vertices, offsets))
+    failed |= np.abs(covered - area) > AREA_TOLERANCE*np.maximum(area, covered)
+
+    # triangles counterclockwise, grouped by polygon, with polygon-local indices
+    corners = np.where(clockwise[triangle_owner][:, None], corners[:, ::-1], corners)
+    kept = ~failed[triangle_owner]
+    order = np.argsort(triangle_owner[kept], kind='stable')
+    corners, triangle_owner = corners[kept][order], triangle_owner[kept][order]
+    triangle_offsets = np.zeros(num_polygons+1, dtype=np.int64)
+    np.cumsum(np.bincount(triangle_owner, minlength=num_polygons), out=triangle_offsets[1:])
+    triangles = (corners - offsets[triangle_owner][:, None]).astype(np.int32)
+    return dict(vertices=vertices, vertex_offsets=np.asarray(offsets, dtype=np.int64),
+                triangles=triangles, triangle_offsets=triangle_offsets), failed
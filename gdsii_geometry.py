@@ -0,0 +1,435 @@
+'''Batch polygon kernels used by gdsiistl().
+
+All polygons of one GDSII layer are packed into a single flat vertex array
+with an offsets array next to it:
+
+    vertices = [[x0, y0], [x1, y1], ...]      # shape (N, 2), float64
+    offsets  = [0, n_0, n_0+n_1, ...]         # shape (P+1,), int64
+
+so polygon p owns vertices[offsets[p]:offsets[p+1]]. The per-polygon math of
+the triangulation stage (orientation, area, delta inset) then runs once per
+layer in numpy instead of once per polygon in Python.
+'''
+
+import numpy as np # fast math on lots of points
+
+def pack_polygons(polygons):
+    """Pack a list of (n_i, 2) point arrays into (vertices, offsets)."""
+    counts = np.fromiter((len(p) for p in polygons), dtype=np.int64, count=len(polygons))
+    offsets = np.zeros(len(polygons)+1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    if len(polygons) == 0:
+        return np.zeros((0, 2)), offsets
+    vertices = np.concatenate(polygons, axis=0).astype(np.float64, copy=False)
+    return vertices, offsets
+
+def concatenate_polygons(parts):
+    """Join a list of packed (vertices, offsets) pairs into one."""
+    if len(parts) == 0:
+        return pack_polygons([])
+    vertices = np.concatenate([v for v, _ in parts], axis=0)
+    shifts = np.cumsum([0] + [len(v) for v, _ in parts])
+    offsets = np.concatenate([o[:-1] + shift for (_, o), shift in zip(parts, shifts)] + [shifts[-1:]])
+    return vertices, offsets.astype(np.int64)
+
+def unpack_polygons(vertices, offsets):
+    """Split a packed vertex array back into a list of per-polygon views."""
+    return [vertices[offsets[p]:offsets[p+1]] for p in range(len(offsets)-1)]
+
+def polygon_ids(offsets):
+    """Return the index of the owning polygon for every packed vertex."""
+    return np.repeat(np.arange(len(offsets)-1), np.diff(offsets))
+
+def next_indices(offsets):
+    """Index of the next vertex of the same polygon (np.roll(.., -1) per polygon)."""
+    counts = np.diff(offsets)
+    index = np.arange(offsets[-1]) + 1
+    filled = counts > 0
+    index[offsets[1:][filled]-1] = offsets[:-1][filled]
+    return index
+
+def previous_indices(offsets):
+    """Index of the previous vertex of the same polygon (np.roll(.., 1) per polygon)."""
+    counts = np.diff(offsets)
+    index = np.arange(offsets[-1]) - 1
+    filled = counts > 0
+    index[offsets[:-1][filled]] = offsets[1:][filled]-1
+    return index
+
+def polygon_bounds(vertices, offsets):
+    """Bounding box [xmin, ymin, xmax, ymax] of every polygon, shape (P, 4)."""
+    counts = np.diff(offsets)
+    bounds = np.full((len(counts), 4), np.nan)
+    filled = counts > 0
+    if filled.any():
+        starts = offsets[:-1][filled]
+        bounds[filled, :2] = np.minimum.reduceat(vertices, starts, axis=0)
+        bounds[filled, 2:] = np.maximum.reduceat(vertices, starts, axis=0)
+    return bounds
+
+def signed_areas(vertices, offsets):
+    """Integrate sum((x2-x1)*(y2+y1)) over the edges of every polygon.
+
+    This is the same quantity the original per-vertex loop computed: twice
+    the area with a negative sign for counterclockwise polygons, so
+    ``signed_areas(...) > 0`` marks the clockwise ones. Only the summation
+    order differs, which can only matter for zero-area polygons.
+    """
+    num_polygons = len(offsets)-1
+    if len(vertices) == 0:
+        return np.zeros(num_polygons)
+    v1 = vertices
+    v2 = vertices[next_indices(offsets)]
+    terms = (v2[:, 0]-v1[:, 0])*(v2[:, 1]+v1[:, 1])
+    counts = np.diff(offsets)
+    areas = np.zeros(num_polygons)
+    filled = counts > 0
+    areas[filled] = np.add.reduceat(terms, offsets[:-1][filled])
+    return areas
+
+def inset_polygons(vertices, offsets, clockwise, delta, hole_delta=0.001):
+    """Move every vertex inward by delta along its two edge normals.
+
+    GDSII implements holes by letting the outline run into the hole and back
+    out along the same line; insetting keeps those edges from overlapping.
+    Returns the inset vertices and, for each edge, a point just outside the
+    edge (between the original and inset edge) that can be passed to the
+    triangulator as a hole marker. Element-wise this is exactly the math the
+    per-polygon code did, so the inset vertices are bit-for-bit identical.
+    """
+    points_i = vertices
+    points_j = vertices[next_indices(offsets)] # shift by 1
+    points_k = vertices[previous_indices(offsets)] # shift by -1
+    # calculate normals for each edge of each vertex
+    normal_ij = np.stack((points_j[:, 1]-points_i[:, 1],
+                          points_i[:, 0]-points_j[:, 0]), axis=1)
+    normal_ik = np.stack((points_i[:, 1]-points_k[:, 1],
+                          points_k[:, 0]-points_i[:, 0]), axis=1)
+    length_ij = np.linalg.norm(normal_ij, axis=1)+0.00000001
+    length_ik = np.linalg.norm(normal_ik, axis=1)+0.00000001
+    normal_ij /= np.stack((length_ij, length_ij), axis=1)
+    normal_ik /= np.stack((length_ik, length_ik), axis=1)
+    # flip the normals of clockwise polygons so they point inward as well
+    sign = np.repeat(np.where(clockwise, -1.0, 1.0), np.diff(offsets))[:, None]
+    normal_ij = sign*normal_ij
+    normal_ik = sign*normal_ik
+    inset = points_i - delta*normal_ij - delta*normal_ik
+    holes = 0.5*(points_j+points_i) - hole_delta*delta*normal_ij
+    return inset, holes
+
+def select_polygons(vertices, offsets, selected):
+    """Pack the polygons with selected[p] == True into a new (vertices, offsets).
+
+    vertices can also be any other per-vertex array (e.g. hole markers).
+    """
+    counts = np.diff(offsets)[selected]
+    new_offsets = np.zeros(len(counts)+1, dtype=np.int64)
+    np.cumsum(counts, out=new_offsets[1:])
+    return vertices[np.repeat(selected, np.diff(offsets))], new_offsets
+
+def select_triangulation(triangulation, selected):
+    """The triangulation dictionary of the polygons with selected[p] == True."""
+    vertices, vertex_offsets = select_polygons(triangulation['vertices'], triangulation['vertex_offsets'], selected)
+    triangles, triangle_offsets = select_polygons(triangulation['triangles'], triangulation['triangle_offsets'],
+                                                  selected)
+    return dict(vertices=vertices, vertex_offsets=vertex_offsets,
+                triangles=triangles, triangle_offsets=triangle_offsets)
+
+def polygon_range(vertices, offsets, start, stop):
+    """Polygons start to stop-1 as a new (vertices, offsets); vertices is a view."""
+    return vertices[offsets[start]:offsets[stop]], offsets[start:stop+1] - offsets[start]
+
+def triangulation_range(triangulation, start, stop):
+    """The triangulation dictionary of polygons start to stop-1."""
+    vertices, vertex_offsets = polygon_range(triangulation['vertices'], triangulation['vertex_offsets'], start, stop)
+    triangles, triangle_offsets = polygon_range(triangulation['triangles'], triangulation['triangle_offsets'],
+                                                start, stop)
+    return dict(vertices=vertices, vertex_offsets=vertex_offsets,
+                triangles=triangles, triangle_offsets=triangle_offsets)
+
+def classify_polygons(vertices, offsets, clockwise):
+    """Find the polygons that can be filled without the triangle library.
+
+    Returns two boolean arrays: convex polygons (every corner turns the same
+    way as the polygon winds, and the outline goes around only once) and,
+    among those, 4-vertex axis-aligned rectangles. Collinear or repeated
+    vertices and self-touching outlines (e.g. GDSII holes) are not convex.
+    """
+    counts = np.diff(offsets)
+    num_polygons = len(counts)
+    convex = np.zeros(num_polygons, dtype=bool)
+    rectangles = np.zeros(num_polygons, dtype=bool)
+    if len(vertices) == 0:
+        return convex, rectangles
+
+    edges = vertices[next_indices(offsets)] - vertices # edge leaving each vertex
+    incoming = edges[previous_indices(offsets)] # edge arriving at each vertex
+    cross = incoming[:, 0]*edges[:, 1] - incoming[:, 1]*edges[:, 0]
+    dot = incoming[:, 0]*edges[:, 0] + incoming[:, 1]*edges[:, 1]
+
+    # every corner has to turn left (CCW) or right (CW) strictly
+    turn = np.repeat(np.where(clockwise, -1.0, 1.0), counts)*cross
+    filled = counts >= 3
+    starts = offsets[:-1][filled]
+    bad_corners = np.add.reduceat((turn <= 0).astype(np.int64), starts)
+    # and the turning angles have to add up to one full turn, not more
+    turning = np.abs(np.add.reduceat(np.arctan2(cross, dot), starts))
+    convex[filled] = (bad_corners == 0) & (turning < 3*np.pi)
+
+    # rectangles: 4 corners with alternating horizontal and vertical edges
+    four = np.flatnonzero(convex & (counts == 4))
+    corner = offsets[four][:, None] + np.arange(4)
+    dx = edges[corner, 0] == 0
+    dy = edges[corner, 1] == 0
+    rectangles[four] = np.all(dx[:, ::2] & dy[:, 1::2], axis=1) | np.all(dy[:, ::2] & dx[:, 1::2], axis=1)
+    return convex, rectangles
+
+def fan_triangulation(vertices, offsets, clockwise):
+    """Triangulate convex polygons as fans from their first vertex.
+
+    Closed-form and vectorized over all polygons: a polygon with n vertices
+    gets the n-2 triangles (0, i, i+1), reversed for clockwise polygons so
+    that all triangles come out counterclockwise like those of the triangle
+    library. Returns a triangulation dictionary (see gdsii_triangulate) whose
+    vertices are the polygon vertices themselves.
+    """
+    counts = np.diff(offsets)
+    fan_counts = np.maximum(counts-2, 0)
+    triangle_offsets = np.zeros(len(counts)+1, dtype=np.int64)
+    np.cumsum(fan_counts, out=triangle_offsets[1:])
+
+    # position of each triangle within its fan, and whether to reverse it
+    owner = np.repeat(np.arange(len(counts)), fan_counts)
+    i = np.arange(triangle_offsets[-1]) - triangle_offsets[owner] + 1
+    reverse = clockwise[owner]
+    triangles = np.empty((len(i), 3), dtype=np.int32)
+    triangles[:, 0] = 0
+    triangles[:, 1] = np.where(reverse, i+1, i)
+    triangles[:, 2] = np.where(reverse, i, i+1)
+    return dict(vertices=vertices, vertex_offsets=offsets,
+                triangles=triangles, triangle_offsets=triangle_offsets)
+
+def _ragged_positions(starts, offsets):
+    # destination index of every element of a ragged array whose rows move
+    # to the given start positions
+    counts = np.diff(offsets)
+    return np.repeat(starts - offsets[:-1], counts) + np.arange(offsets[-1])
+
+def merge_triangulations(selected, first, second):
+    """Merge triangulations of two polygon subsets back into polygon order.
+
+    Polygon p comes from first where selected[p] is True and from second
+    otherwise (both in their original relative order).
+    """
+    num_polygons = len(selected)
+    merged = {}
+    for name, offsets_name in (('vertices', 'vertex_offsets'), ('triangles', 'triangle_offsets')):
+        counts = np.zeros(num_polygons, dtype=np.int64)
+        counts[selected] = np.diff(first[offsets_name])
+        counts[~selected] = np.diff(second[offsets_name])
+        offsets = np.zeros(num_polygons+1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        data = np.empty((offsets[-1],) + first[name].shape[1:], dtype=first[name].dtype)
+        data[_ragged_positions(offsets[:-1][selected], first[offsets_name])] = first[name]
+        data[_ragged_positions(offsets[:-1][~selected], second[offsets_name])] = second[name]
+        merged[name] = data
+        merged[offsets_name] = offsets
+    return merged
+
+def extrusion_size(offsets, triangulation):
+    """Number of STL triangles extrude_polygons() makes for these polygons."""
+    # each line segment will make two triangles (for a rectangle), and the polygon
+    # triangulation will be copied on the top and bottom of the layer.
+    return offsets[-1]*2 + len(triangulation['triangles'])*2
+
+def extrusion_chunks(offsets, triangulation, max_triangles):
+    """Split the polygons into ranges (start, stop) of at most max_triangles extruded triangles.
+
+    A polygon that makes more triangles by itself gets a range of its own.
+    Extruding the ranges one after the other gives the triangles of
+    extrude_polygons() for all polygons, in the same order.
+    """
+    ends = np.cumsum(2*np.diff(offsets) + 2*np.diff(triangulation['triangle_offsets']))
+    chunks = []
+    start = 0
+    while start < len(ends):
+        done = ends[start-1] if start > 0 else 0
+        stop = max(start+1, int(np.searchsorted(ends, done + max_triangles, side='right')))
+        chunks.append((start, stop))
+        start = stop
+    return chunks
+
+def extrude_polygons(vertices, offsets, clockwise, triangulation, zmin, zmax, out=None):
+    """Extrude packed polygons from zmin to zmax into (M, 3, 3) triangles.
+
+    triangulation is the ragged triangulation of the same polygons (see
+    gdsii_triangulate). All triangles are counterclockwise seen from outside.
+    The triangles are written into out when it is given (any (M, 3, 3) view,
+    e.g. a slice of mesh_data['vectors']), for all polygons at once; each
+    polygon gets its side walls, then its top and bottom triangles.
+    """
+    if out is None:
+        out = np.zeros((extrusion_size(offsets, triangulation), 3, 3))
+    counts = np.diff(offsets)
+    vertex_offsets = triangulation['vertex_offsets']
+    triangle_offsets = triangulation['triangle_offsets']
+    triangle_counts = np.diff(triangle_offsets)
+
+    # where the triangles of each polygon start in out
+    starts = np.zeros(len(counts), dtype=np.int64)
+    np.cumsum(2*counts[:-1] + 2*triangle_counts[:-1], out=starts[1:])
+
+    # The numpy-stl library expects counterclockwise triangles. That is,
+    # one side of each triangle is the outside surface of the STL file
+    # object (assuming a watertight volume), and the other side is the
+    # inside surface. If looking at a triangle from the outside, the
+    # vertices should be in counterclockwise order. Failure to do so may
+    # cause certain STL file display programs to not display the
+    # triangles correctly (e.g., the backward triangles will be invisible).
+
+    # make the triangles around the polygon boundaries: walk each polygon
+    # counterclockwise (clockwise ones backwards), two triangles per edge
+    owner = polygon_ids(offsets)
+    index = np.arange(offsets[-1])
+    backwards = clockwise[owner]
+    index[backwards] = (offsets[:-1] + offsets[1:] - 1)[owner[backwards]] - index[backwards]
+    points_i = vertices[index] # this vertex
+    points_j = vertices[index[next_indices(offsets)]] # the next one
+    lefts = (starts - offsets[:-1])[owner] + np.arange(offsets[-1])
+    rights = lefts + counts[owner]
+    for corner, (points, z) in enumerate(((points_j, zmax), (points_i, zmax), (points_i, zmin))):
+        out[lefts, corner, :2] = points
+        out[lefts, corner, 2] = z
+    for corner, (points, z) in enumerate(((points_i, zmin), (points_j, zmin), (points_j, zmax))):
+        out[rights, corner, :2] = points
+        out[rights, corner, 2] = z
+
+    # copy the polygon interior (face) triangles to the top and, in reverse
+    # vertex order, to the bottom
+    owner = polygon_ids(triangle_offsets)
+    corners = triangulation['triangles'] + vertex_offsets[:-1][owner][:, None]
+    tops = (starts + 2*counts - triangle_offsets[:-1])[owner] + np.arange(triangle_offsets[-1])
+    bottoms = tops + triangle_counts[owner]
+    for corner in range(3):
+        points = triangulation['vertices'][corners[:, corner]]
+        out[tops, corner, :2] = points
+        out[tops, corner, 2] = zmax
+        out[bottoms, 2-corner, :2] = points
+        out[bottoms, 2-corner, 2] = zmin
+    return out
+
+def place_triangles(faces, placements, out, block_triangles=1<<20):
+    """Write one transformed copy of faces per placement into out.
+
+    faces is an (M, 3, 3) triangle buffer, placements a (K, 3, 3) stack of
+    2D affine transforms (see gdsii_hierarchy) and out a (K*M, 3, 3) view,
+    e.g. a slice of mesh_data['vectors']. z is left as is; copies placed
+    with a mirroring transform get their vertex order reversed so that the
+    triangles stay counterclockwise seen from outside.
+    """
+    num_faces = len(faces)
+    if num_faces == 0:
+        return
+    if len(placements) == 1 and np.array_equal(placements[0], np.eye(3)):
+        out[:] = faces
+        return
+
+    # transform in blocks of placements to bound the temporary memory
+    block = max(1, block_triangles // num_faces)
+    for start in range(0, len(placements), block):
+        transforms = placements[start:start+block]
+        linear = transforms[:, :2, :2]
+        translation = transforms[:, :2, 2]
+        placed = np.empty((len(transforms), num_faces, 3, 3))
+        placed[..., :2] = np.einsum('kij,mvj->kmvi', linear, faces[..., :2]) + translation[:, None, None, :]
+        placed[..., 2] = faces[..., 2]
+        mirrored = np.linalg.det(linear) < 0
+        if mirrored.any():
+            placed[mirrored] = placed[mirrored][:, :, ::-1]
+        out[start*num_faces:(start+len(transforms))*num_faces] = placed.reshape(-1, 3, 3)
+
+def extrude_indexed(vertices, offsets, clockwise, triangulation, zmin, zmax):
+    """Extrude packed polygons into an indexed mesh (points, triangles).
+
+    Same surface as extrude_polygons(), but every vertex is stored once:
+    points is (V, 3) and triangles is (T, 3) indices into it. The bottom and
+    top rings of each polygon are shared by its side walls and its caps; only
+    polygons whose triangulation has vertices of its own (e.g. points added
+    by the triangle library) get separate cap vertices.
+    """
+    num_vertices = offsets[-1]
+    counts = np.diff(offsets)
+    vertex_offsets = triangulation['vertex_offsets']
+    triangle_offsets = triangulation['triangle_offsets']
+    cap_vertices = triangulation['vertices']
+
+    # side walls: two triangles per edge, from each vertex to the next one
+    # counterclockwise (the previous one for clockwise polygons)
+    i = np.arange(num_vertices)
+    j = np.where(np.repeat(clockwise, counts), previous_indices(offsets), next_indices(offsets))
+    rights = np.stack((i, j, num_vertices+j), axis=1)
+    lefts = np.stack((num_vertices+j, num_vertices+i, i), axis=1)
+
+    # caps share the rings where the triangulation vertices are the polygon's own
+    shared = np.diff(vertex_offsets) == counts
+    in_shared = np.repeat(shared, counts)
+    same = np.all(cap_vertices[np.repeat(shared, np.diff(vertex_offsets))] == vertices[in_shared], axis=1)
+    mismatches = np.bincount(polygon_ids(offsets)[in_shared][~same], minlength=len(counts))
+    shared &= mismatches == 0
+
+    extra_vertices, extra_offsets = select_polygons(cap_vertices, vertex_offsets, ~shared)
+    num_extra = len(extra_vertices)
+    cap_start = np.zeros(len(counts), dtype=np.int64) # index of the cap's first bottom vertex
+    cap_start[shared] = offsets[:-1][shared]
+    cap_start[~shared] = 2*num_vertices + extra_offsets[:-1]
+    top_shift = np.where(shared, num_vertices, num_extra) # from a bottom vertex to its top copy
+
+    owner = polygon_ids(triangle_offsets)
+    bottom = triangulation['triangles'].astype(np.int64) + cap_start[owner][:, None]
+    top = bottom + top_shift[owner][:, None]
+
+    points = np.empty((2*num_vertices + 2*num_extra, 3))
+    points[:num_vertices, :2] = vertices
+    points[:num_vertices, 2] = zmin
+    points[num_vertices:2*num_vertices, :2] = vertices
+    points[num_vertices:2*num_vertices, 2] = zmax
+    points[2*num_vertices:2*num_vertices+num_extra, :2] = extra_vertices
+    points[2*num_vertices:2*num_vertices+num_extra, 2] = zmin
+    points[2*num_vertices+num_extra:, :2] = extra_vertices
+    points[2*num_vertices+num_extra:, 2] = zmax
+    triangles = np.concatenate((lefts, rights, top, bottom[:, ::-1]), axis=0)
+    return points, triangles
+
+def place_vertices(points, triangles, placements):
+    """Indexed counterpart of place_triangles().
+
+    Returns the points and triangles of one transformed copy of the mesh
+    per placement, with the vertex order of mirrored copies reversed.
+    """
+    if len(placements) == 1 and np.array_equal(placements[0], np.eye(3)):
+        return points, triangles
+    linear = placements[:, :2, :2]
+    translation = placements[:, :2, 2]
+    placed = np.empty((len(placements), len(points), 3))
+    placed[..., :2] = np.einsum('kij,vj->kvi', linear, points[:, :2]) + translation[:, None, :]
+    placed[..., 2] = points[:, 2]
+    copies = triangles[None] + len(points)*np.arange(len(placements))[:, None, None]
+    mirrored = np.linalg.det(linear) < 0
+    if mirrored.any():
+        copies[mirrored] = copies[mirrored][:, :, ::-1]
+    return placed.reshape(-1, 3), copies.reshape(-1, 3)
+
+def triangle_tiles(corners, tile_size):
+    """Group triangles by the square tile of a grid from the origin that holds their centroid.
+
+    corners is an (M, 3, 3) triangle buffer. Returns a list of (column, row,
+    triangle indices), one per tile with triangles.
+    """
+    if len(corners) == 0:
+        return []
+    cells = np.floor(corners[:, :, :2].mean(axis=1) / tile_size).astype(np.int64)
+    order = np.lexsort((cells[:, 1], cells[:, 0]))
+    cells = cells[order]
+    starts = np.flatnonzero(np.r_[True, np.any(cells[1:] != cells[:-1], axis=1)])
+    stops = np.r_[starts[1:], len(order)]
+    return [(int(cells[start, 0]), int(cells[start, 1]), order[start:stop]) for start, stop in zip(starts, stops)]
@@ -0,0 +1,209 @@
+'''Cell hierarchy of a GDSII library, for conversion without flattening.
+
+Instead of Cell.flatten(), which copies the geometry of a cell once for every
+SREF/AREF instance, the reference tree is walked once and every unique cell
+gets the list of affine transforms that place it in the layout:
+
+    placements = [[[a, b, tx],
+                   [c, d, ty],
+                   [0, 0, 1 ]], ...]    # shape (K, 3, 3), one per instance
+
+The geometry of each cell is then triangulated and extruded once, and the
+finished triangles are copied to all K places (see
+gdsii_geometry.place_triangles).
+'''
+
+import numpy as np # fast math on lots of points
+import gdspy # open gds file
+
+IDENTITY = np.eye(3)
+
+# $$$CONTEXT_INFO$$$ is a separate, non-standard compliant cell added
+# optionally by KLayout to store extra information not needed here.
+# see https://www.klayout.de/forum/discussion/1026/very-
+# important-gds-exported-from-k-layout-not-working-on-cadence-at-foundry
+SKIPPED_CELLS = ('$$$CONTEXT_INFO$$$',)
+
+# magnifications closer than this (relative) count as the same, since they
+# only differ by rounding of the placement matrices
+SCALE_TOLERANCE = 1e-9
+
+def extract_polygons(cell, layers, layerstack=None):
+    """Add the paths and polygons of cell (not its references) to layers.
+
+    layers maps GDSII layer numbers to lists of (n, 2) point arrays; only
+    layers in layerstack are extracted when it is given.
+    """
+    # loop through paths in cell
+    for path in cell.paths:
+        lnum = path.layers[0] # GDSII layer number
+        if layerstack is not None and not lnum in layerstack:
+            continue
+        # create empty array to hold layer polygons if it doesn't yet exist
+        layers[lnum] = [] if not lnum in layers else layers[lnum]
+        # add paths (converted to polygons) that layer
+        for poly in path.get_polygons():
+            layers[lnum].append(poly)
+
+    # loop through polygons (and boxes) in cell
+    for polygon in cell.polygons:
+        lnum = polygon.layers[0] # same as before...
+        if layerstack is not None and not lnum in layerstack:
+            continue
+        layers[lnum] = [] if not lnum in layers else layers[lnum]
+        for poly in polygon.polygons:
+            layers[lnum].append(poly)
+    return layers
+
+def linear_transform(rotation=None, magnification=None, x_reflection=False):
+    """2x2 matrix of an x-reflection, then magnification, then rotation (degrees)."""
+    magnification = 1.0 if magnification is None else magnification
+    angle = 0.0 if rotation is None else rotation*np.pi/180.0
+    c, s = np.cos(angle), np.sin(angle)
+    linear = np.array([[c, -s], [s, c]])
+    if x_reflection:
+        linear = linear @ np.diag([1.0, -1.0])
+    return magnification*linear
+
+def placement_matrices(origin, linear, columns=1, rows=1, column_step=(0, 0), row_step=(0, 0)):
+    """Return the (columns*rows, 3, 3) transforms of a reference.
+
+    column_step and row_step are the array pitch vectors in the coordinates
+    of the referencing cell; element (i, j) is placed at
+    origin + i*column_step + j*row_step.
+    """
+    origin = np.zeros(2) if origin is None else np.asarray(origin, dtype=float)
+    i, j = np.meshgrid(np.arange(columns), np.arange(rows), indexing='ij')
+    translation = origin + np.outer(i.ravel(), column_step) + np.outer(j.ravel(), row_step)
+
+    matrices = np.zeros((len(translation), 3, 3))
+    matrices[:, :2, :2] = linear
+    matrices[:, :2, 2] = translation
+    matrices[:, 2, 2] = 1.0
+    return matrices
+
+def reference_matrices(ref):
+    """Return the (E, 3, 3) transforms of an SREF (E=1) or AREF (E=columns*rows).
+
+    Follows gdspy's transformation order: x-reflection, magnification and
+    rotation about the reference origin, then translation to the origin.
+    Array elements are offset by the spacing before reflection and rotation.
+    """
+    linear = linear_transform(ref.rotation, None, ref.x_reflection)
+    magnification = 1.0 if ref.magnification is None else ref.magnification
+    if isinstance(ref, gdspy.CellArray):
+        # gdspy stores the array spacing in the coordinates of the referenced cell
+        return placement_matrices(ref.origin, magnification*linear, ref.columns, ref.rows,
+                                  linear @ (ref.spacing[0], 0.0), linear @ (0.0, ref.spacing[1]))
+    return placement_matrices(ref.origin, magnification*linear)
+
+def placed_bounds(bounds, placements):
+    """Bounding boxes in the layout of boxes [xmin, ymin, xmax, ymax] of a cell.
+
+    bounds is (B, 4); returns (K, B, 4), one set for each of the K placements.
+    """
+    centers = (bounds[:, :2] + bounds[:, 2:])/2
+    halves = (bounds[:, 2:] - bounds[:, :2])/2
+    linear = placements[:, :2, :2]
+    world_centers = np.einsum('kij,bj->kbi', linear, centers) + placements[:, None, :2, 2]
+    world_halves = np.einsum('kij,bj->kbi', np.abs(linear), halves)
+    return np.concatenate((world_centers - world_halves, world_centers + world_halves), axis=2)
+
+def placement_scales(placements):
+    """Magnification of each (3, 3) placement (the square root of |det|)."""
+    return np.sqrt(np.abs(np.linalg.det(placements[:, :2, :2])))
+
+def split_by_scale(cells):
+    """Split cells placed with different magnifications into one pair per magnification.
+
+    Every returned (layers, placements) pair has placements of one
+    magnification only (up to SCALE_TOLERANCE), so that work done in cell coordinates (e.g. the
+    inset before triangulating) can be scaled to come out the same size in
+    the layout for every placement. The layers dictionary of a split cell is
+    copied for each part.
+    """
+    split = []
+    for layers, placements in cells:
+        # group the sorted magnifications wherever the next one is more than
+        # SCALE_TOLERANCE larger
+        scales = placement_scales(placements)
+        order = np.argsort(scales, kind='stable')
+        ordered = scales[order]
+        starts = np.flatnonzero(np.r_[True, np.diff(ordered) > SCALE_TOLERANCE*ordered[1:]])
+        if len(starts) == 1:
+            split.append((layers, placements))
+            continue
+        for group in np.split(order, starts[1:]):
+            split.append((dict(layers), placements[np.sort(group)]))
+    return split
+
+def flatten_cells(cells, check=None):
+    """Flatten (layers, placements) pairs of packed polygons into a single pair.
+
+    Every cell's polygons are copied once per placement, transformed into
+    layout coordinates; the result is placed once, [(layers, IDENTITY[None])].
+    check, if given, is called before each cell and can raise to stop.
+    """
+    parts = {}
+    for layers, placements in cells:
+        if check is not None:
+            check()
+        for layer, (vertices, offsets) in layers.items():
+            linear = placements[:, :2, :2]
+            translation = placements[:, :2, 2]
+            copies = np.einsum('kij,vj->kvi', linear, vertices) + translation[:, None, :]
+            copy_offsets = offsets[:-1][None, :] + len(vertices)*np.arange(len(placements))[:, None]
+            parts.setdefault(layer, []).append((copies.reshape(-1, 2), copy_offsets.ravel()))
+    flat = {}
+    for layer, layer_parts in parts.items():
+        vertices = np.concatenate([v for v, _ in layer_parts])
+        starts = []
+        shift = 0
+        for v, o in layer_parts:
+            starts.append(o + shift)
+            shift += len(v)
+        flat[layer] = (vertices, np.append(np.concatenate(starts), len(vertices)))
+    return [(flat, IDENTITY[None])]
+
+def walk_placements(top_cells, references):
+    """Walk a reference tree from top_cells down.
+
+    references(cell) returns the (child, matrices) pairs of the references in
+    cell, with matrices as from placement_matrices(). Returns a list of
+    (cell, placements) for every cell that is used, parents before children;
+    placements holds one (3, 3) transform per instance of the cell in the
+    flattened layout (identity for the top cells).
+    """
+    # order the cells so that every cell comes after all cells referencing it
+    postorder = []
+    visited = set()
+    def visit(cell):
+        visited.add(cell)
+        for child, _ in references(cell):
+            if child not in visited:
+                visit(child)
+        postorder.append(cell)
+    for cell in top_cells:
+        if cell not in visited:
+            visit(cell)
+
+    placements = {cell: [] for cell in postorder}
+    for cell in top_cells:
+        placements[cell].append(IDENTITY[None])
+
+    ordered = []
+    for cell in reversed(postorder):
+        parent = np.concatenate(placements[cell], axis=0)
+        ordered.append((cell, parent))
+        for child, matrices in references(cell):
+            instances = np.matmul(parent[:, None], matrices[None, :]).reshape(-1, 3, 3)
+            placements[child].append(instances)
+    return ordered
+
+def cell_placements(top_cells):
+    """Walk the gdspy reference tree below top_cells (see walk_placements)."""
+    def references(cell):
+        # skip references to cells missing from the file
+        return [(ref.ref_cell, reference_matrices(ref)) for ref in cell.references
+                if isinstance(ref.ref_cell, gdspy.Cell)]
+    return walk_placements([cell for cell in top_cells if cell.name not in SKIPPED_CELLS], references)
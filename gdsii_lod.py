@@ -0,0 +1,88 @@
+'''Coarse level-of-detail (LOD) meshes of converted layers.
+
+A full-chip layout has far too many triangles to move around in Blender's
+viewport. coarse_mesh() builds a light preview of a layer instead: polygons
+that are large compared to a tile of a grid over the layer (pads, planes,
+long wires) are kept as they are, and all smaller polygons are merged into
+one box per tile that spans their bounding boxes. The preview then holds a
+few triangles per tile plus the large polygons, however many small features
+the layer has. bpy_import_stls.py loads it first and swaps in the full
+detail on request or before rendering.
+'''
+
+import numpy as np # fast math on lots of points
+
+from gdsii_geometry import pack_polygons, polygon_bounds, select_polygons, select_triangulation
+from gdsii_geometry import fan_triangulation, extrude_indexed, place_vertices
+from gdsii_hierarchy import placed_bounds
+
+LOD_TILES = 256 # tiles along the longer side of a layer
+
+def coarse_mesh(cells, layer, zmin, zmax, tiles=LOD_TILES, block_boxes=1<<20):
+    """Indexed preview mesh (points, triangles) of one layer.
+
+    cells are the triangulated (layers, placements) pairs of gdsiistl(), with
+    layers[layer] = (vertices, offsets, clockwise, triangulation).
+    """
+    entries = [(layers[layer], placements) for layers, placements in cells if layer in layers]
+
+    # bounding boxes of every cell's polygons, and the extent of the whole layer
+    boxes = []
+    lower, upper = np.full(2, np.inf), np.full(2, -np.inf)
+    for (vertices, offsets, clockwise, triangulation), placements in entries:
+        bounds = polygon_bounds(vertices, offsets)
+        filled = ~np.isnan(bounds[:, 0])
+        cell_bounds = np.concatenate((np.nanmin(bounds[:, :2], axis=0), np.nanmax(bounds[:, 2:], axis=0))) \
+            if filled.any() else None
+        boxes.append((bounds, filled))
+        if cell_bounds is not None:
+            placed = placed_bounds(cell_bounds[None], placements).reshape(-1, 4)
+            lower = np.minimum(lower, placed[:, :2].min(axis=0))
+            upper = np.maximum(upper, placed[:, 2:].max(axis=0))
+    if not np.all(np.isfinite(lower)):
+        return np.zeros((0, 3), dtype=np.float32), np.zeros((0, 3), dtype=np.uint32)
+
+    tile = max(float(np.max(upper - lower)) / tiles, 1e-9)
+    columns, rows = np.maximum(np.ceil((upper - lower) / tile).astype(np.int64), 1)
+    box_lower = np.full((columns*rows, 2), np.inf)
+    box_upper = np.full((columns*rows, 2), -np.inf)
+
+    parts = []
+    for ((vertices, offsets, clockwise, triangulation), placements), (bounds, filled) in zip(entries, boxes):
+        # polygons at least a tile in size (in the layout) stay as they are
+        scale = np.sqrt(np.abs(np.linalg.det(placements[:, :2, :2]))).max()
+        size = np.where(filled, np.maximum(bounds[:, 2]-bounds[:, 0], bounds[:, 3]-bounds[:, 1]), 0)*scale
+        large = filled & (size >= tile)
+        if large.any():
+            large_vertices, large_offsets = select_polygons(vertices, offsets, large)
+            parts.append(place_vertices(*extrude_indexed(large_vertices, large_offsets, clockwise[large],
+                select_triangulation(triangulation, large), zmin, zmax), placements))
+
+        # the others grow the box of the tile they are centered in
+        small = filled & ~large
+        if not small.any():
+            continue
+        small_bounds = bounds[small]
+        block = max(1, block_boxes // len(small_bounds))
+        for start in range(0, len(placements), block):
+            placed = placed_bounds(small_bounds, placements[start:start+block]).reshape(-1, 4)
+            centers = (placed[:, :2] + placed[:, 2:])/2
+            column, row = np.clip(((centers - lower) / tile).astype(np.int64).T, 0, [[columns-1], [rows-1]])
+            index = column*rows + row
+            np.minimum.at(box_lower, index, placed[:, :2])
+            np.maximum.at(box_upper, index, placed[:, 2:])
+
+    used = np.isfinite(box_lower[:, 0])
+    if used.any():
+        (x0, y0), (x1, y1) = box_lower[used].T, box_upper[used].T
+        squares = np.stack((np.stack((x0, y0), axis=1), np.stack((x1, y0), axis=1),
+                            np.stack((x1, y1), axis=1), np.stack((x0, y1), axis=1)), axis=1)
+        box_vertices, box_offsets = pack_polygons(list(squares))
+        counterclockwise = np.zeros(len(squares), dtype=bool)
+        parts.append(extrude_indexed(box_vertices, box_offsets, counterclockwise,
+            fan_triangulation(box_vertices, box_offsets, counterclockwise), zmin, zmax))
+
+    points = np.concatenate([p for p, _ in parts]).astype(np.float32)
+    shifts = np.cumsum([0] + [len(p) for p, _ in parts[:-1]])
+    triangles = np.concatenate([t + shift for (_, t), shift in zip(parts, shifts)]).astype(np.uint32)
+    return points, triangles
@@ -0,0 +1,113 @@
+'''Conversion manifest for incremental re-conversion in gdsiistl().
+
+The manifest is a JSON file next to the STL files. For every converted layer
+it records what the STL file was made from:
+
+    {
+    "version": 1,
+    "layers": {
+        "15": {
+            "source": {"path": ..., "size": ..., "mtime": ..., "hash": ...},
+            "geometry": "<hash of the layer's polygons and placements>",
+            "parameters": {"zmin": 0, "zmax": 100, "layername": "gdsii_15", ...},
+            "output": "<path of the STL file, or null for an empty layer>"
+        },
+        ...
+    }
+    }
+
+A layer only has to be converted again when its parameters changed, its
+output file is gone, or its geometry changed. The content hash of the GDSII
+file is only recomputed when its size or modification time changed.
+'''
+
+import os
+import json
+import hashlib
+
+import numpy as np # fast math on lots of points
+
+MANIFEST_VERSION = 1
+MANIFEST_NAME = 'gdsiistl_manifest.json'
+
+def load_manifest(path):
+    """Read a manifest, or return an empty one if there is none (or it is unusable)."""
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+        if manifest.get('version') == MANIFEST_VERSION:
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return dict(version=MANIFEST_VERSION, layers={})
+
+def save_manifest(path, manifest):
+    """Write a manifest, replacing the old one only once it is complete."""
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(temporary, path)
+
+def file_hash(path, block_size=1<<24):
+    """BLAKE2 hash of the contents of a file."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def file_fingerprint(path, manifest=None):
+    """Return {'path', 'size', 'mtime', 'hash'} of a file.
+
+    The hash is taken over from the manifest when it recorded the same file
+    with the same size and modification time, so an unchanged file is not
+    read again.
+    """
+    stat = os.stat(path)
+    fingerprint = dict(path=os.path.abspath(path), size=stat.st_size, mtime=stat.st_mtime_ns)
+    for entry in (manifest or {}).get('layers', {}).values():
+        known = entry.get('source', {})
+        if all(known.get(name) == value for name, value in fingerprint.items()):
+            fingerprint['hash'] = known['hash']
+            return fingerprint
+    fingerprint['hash'] = file_hash(path)
+    return fingerprint
+
+def layer_parameters(layerstack_entry, **settings):
+    """The parameters a layer's STL file depends on, in JSON form."""
+    zmin, zmax, layername = layerstack_entry
+    parameters = dict(zmin=zmin, zmax=zmax, layername=layername, **settings)
+    return json.loads(json.dumps(parameters))
+
+def geometry_hash(cells, layer):
+    """Hash the packed polygons and placements of one layer in all cells.
+
+    cells is the list of (layers, placements) pairs of gdsiistl(), with
+    layers[layer] = (vertices, offsets).
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    for layers, placements in cells:
+        if not layer in layers:
+            continue
+        vertices, offsets = layers[layer][:2]
+        digest.update(np.ascontiguousarray(placements, dtype=np.float64).tobytes())
+        digest.update(np.ascontiguousarray(offsets, dtype=np.int64).tobytes())
+        digest.update(np.ascontiguousarray(vertices, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+def layer_up_to_date(manifest, layer, parameters, source=None, geometry=None):
+    """Check a layer's manifest entry against the current conversion.
+
+    Give the source fingerprint to check whether the GDSII file is the same,
+    or the geometry hash to check whether the layer's polygons are the same.
+    """
+    entry = manifest['layers'].get(str(layer))
+    if entry is None or entry.get('parameters') != parameters:
+        return False
+    if entry.get('output') is not None and not os.path.exists(entry['output']):
+        return False
+    if source is not None and entry.get('source', {}).get('hash') != source['hash']:
+        return False
+    if geometry is not None and entry.get('geometry') != geometry:
+        return False
+    return True
@@ -0,0 +1,173 @@
+'''Instrumentation report of a gdsiistl() conversion.
+
+gdsiistl() marks its stages (read, merge, triangulate, extrude, write, ...)
+and the layer it works on, the same way it reports progress:
+
+    report.start('triangulate')
+    report.layer(1)
+    report.count(1, polygons=1000)
+    ...
+    report.stop()
+
+Each stage gets its wall time, the CPU time of this process and of the
+worker processes that finished during it, and the counts added to it
+(polygons, vertices, triangles, bytes, ...); each layer within a stage gets
+its counts, and its wall and CPU time where the stage marks it. Stages and layers that are started
+again add up. The peak memory (RSS) of the process is noted at the end of
+each stage. save() writes it all as JSON next to the outputs,
+<gds name>_report.json.
+
+With profile=True every stage runs under cProfile as well, and the profile of
+the slowest stage is saved as <gds name>_<stage>.prof, for
+python -m pstats <file> (or snakeviz).
+'''
+
+import os
+import sys
+import json
+import time
+import cProfile
+
+TIMES = ('wall', 'cpu') # what is measured for every stage and layer
+
+def peak_rss():
+    """Peak resident memory of this process in bytes (None where it cannot be read)."""
+    try:
+        import resource
+    except ImportError: # Windows
+        try:
+            import ctypes
+            from ctypes import wintypes
+            class Counters(ctypes.Structure): # PROCESS_MEMORY_COUNTERS
+                _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + \
+                           [(name, ctypes.c_size_t) for name in (
+                               'PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage',
+                               'QuotaPagedPoolUsage', 'QuotaPeakNonPagedPoolUsage',
+                               'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')]
+            counters = Counters()
+            counters.cb = ctypes.sizeof(counters)
+            process = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+                return int(counters.PeakWorkingSetSize)
+        except (OSError, AttributeError):
+            pass
+        return None
+    scale = 1 if sys.platform == 'darwin' else 1024 # ru_maxrss is in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*scale
+
+def report_path(gdsii_file_path, output_folder=None):
+    """The report of converting gdsii_file_path, next to its outputs.
+
+    The outputs are next to the GDSII file unless they go to output_folder.
+    """
+    name = os.path.splitext(os.path.basename(gdsii_file_path))[0]
+    folder = output_folder or os.path.dirname(os.path.abspath(gdsii_file_path))
+    return os.path.join(folder, f'{name}_report.json')
+
+def _clock():
+    # wall time, CPU time of this process and of its finished child processes
+    times = os.times()
+    return time.perf_counter(), times.user + times.system, times.children_user + times.children_system
+
+class ConversionReport:
+    """Times, counts and peak memory of the stages and layers of a conversion.
+
+    settings are stored with the report as they are.
+    """
+
+    def __init__(self, gdsii_file_path, settings=None, profile=False, output_folder=None):
+        self.gdsii_file_path = gdsii_file_path
+        self.output_folder = output_folder
+        self.settings = settings or {}
+        self.profile = profile
+        self.stages = {} # name: dict(wall, cpu, worker_cpu, peak_rss, layers, counts...)
+        self.profiles = {} # name: cProfile.Profile of the stage
+        self.stage = self.stage_name = None # running stage
+        self.current_layer = None
+        self.clock = self.layer_clock = self.begin = _clock()
+
+    def start(self, stage):
+        """End the running stage (if any) and start stage."""
+        self.stop()
+        self.stage = self.stages.setdefault(stage, dict(wall=0.0, cpu=0.0, worker_cpu=0.0, layers={}))
+        self.clock = _clock()
+        if self.profile:
+            self.profiles.setdefault(stage, cProfile.Profile()).enable()
+        self.stage_name = stage
+
+    def layer(self, layer):
+        """Count what follows in the stage towards layer (None for no layer)."""
+        now = _clock()
+        if self.current_layer is not None:
+            entry = self._layer_entry(self.current_layer)
+            entry['wall'] = entry.get('wall', 0.0) + now[0] - self.layer_clock[0]
+            entry['cpu'] = entry.get('cpu', 0.0) + now[1] - self.layer_clock[1]
+        self.current_layer, self.layer_clock = layer, now
+
+    def count(self, layer=None, **counts):
+        """Add counts to the running stage, and to one of its layers if given."""
+        entries = [self.stage] if layer is None else [self.stage, self._layer_entry(layer)]
+        for entry in entries:
+            for name, value in counts.items():
+                entry[name] = entry.get(name, 0) + (float(value) if isinstance(value, float) else int(value))
+
+    def stop(self):
+        """End the running stage."""
+        if self.stage is None:
+            return
+        self.layer(None)
+        now = _clock()
+        if self.profile:
+            self.profiles[self.stage_name].disable()
+        self.stage['wall'] += now[0] - self.clock[0]
+        self.stage['cpu'] += now[1] - self.clock[1]
+        self.stage['worker_cpu'] += now[2] - self.clock[2]
+        self.stage['peak_rss'] = peak_rss()
+        self.stage = None
+
+    def _layer_entry(self, layer):
+        return self.stage['layers'].setdefault(str(layer), {})
+
+    def save(self, status='done', outputs=None):
+        """Stop the running stage and write the report (and profile); returns the report path."""
+        self.stop()
+        end = _clock()
+        report = dict(gds=os.path.abspath(self.gdsii_file_path), date=time.strftime('%Y-%m-%d %H:%M:%S'),
+                      status=status, settings=self.settings,
+                      seconds=end[0] - self.begin[0], cpu=end[1] - self.begin[1],
+                      worker_cpu=end[2] - self.begin[2], peak_rss=peak_rss(),
+                      slowest_stage=max(self.stages, key=lambda stage: self.stages[stage]['wall'], default=None),
+                      stages=self.stages,
+                      outputs={str(layer): filename for layer, filename in (outputs or {}).items()})
+        path = report_path(self.gdsii_file_path, self.output_folder)
+        if self.profiles and report['slowest_stage'] is not None:
+            name = os.path.splitext(os.path.basename(self.gdsii_file_path))[0]
+            profile_path = os.path.join(os.path.dirname(path), '{}_{}.prof'.format(name, report['slowest_stage']))
+            self.profiles[report['slowest_stage']].dump_stats(profile_path)
+            report['profile'] = profile_path
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=1)
+        return path
+
+def load_report(path):
+    """Read a report written by ConversionReport.save()."""
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def summary(report):
+    """A few lines of text about a report (a dictionary as from load_report())."""
+    def counts(entry):
+        return ', '.join(f'{value} {name}' for name, value in entry.items()
+                         if name not in TIMES + ('worker_cpu', 'peak_rss', 'layers'))
+    peak = report['peak_rss']
+    lines = ['{} in {:.2f} s (CPU {:.2f} s, workers {:.2f} s){}'.format(
+        report['status'].capitalize(), report['seconds'], report['cpu'], report['worker_cpu'],
+        '' if peak is None else ', peak memory {:.0f} MB'.format(peak/1024**2))]
+    for name, stage in report['stages'].items():
+        lines.append('{:<12} {:7.2f} s  {}'.format(name, stage['wall'], counts(stage)).rstrip())
+        for layer, entry in stage['layers'].items():
+            wall = '{:7.2f} s'.format(entry['wall']) if 'wall' in entry else ' '*9
+            lines.append('    layer {:<5} {}  {}'.format(layer, wall, counts(entry)).rstrip())
+    if report.get('profile'):
+        lines.append('profile of the slowest stage: {}'.format(report['profile']))
+    return '\n'.join(lines)
@@ -0,0 +1,320 @@
+'''Streaming GDSII reader that only decodes the layers that are converted.
+
+gdspy builds Python objects for every polygon on every layer of a file. This
+reader memory-maps the file and walks its record stream instead. For
+BOUNDARY, BOX and PATH elements on the requested layers it only notes where
+their XY records are; elements on other layers are skipped without being
+decoded. The noted XY records of each cell and layer are then decoded in one
+go, straight from the mapped file into packed numpy arrays (see
+gdsii_geometry), so memory and time scale with the selected geometry.
+
+SREF and AREF records are kept as placement matrices (see gdsii_hierarchy),
+so the result can be used flattened or with its hierarchy. TEXT and NODE
+elements and properties are skipped.
+'''
+
+import mmap
+import struct
+from array import array
+
+import numpy as np # fast math on lots of points
+
+from gdsii_geometry import pack_polygons
+from gdsii_hierarchy import SKIPPED_CELLS, flatten_cells, linear_transform, placement_matrices, walk_placements
+
+# record types (see e.g. http://boolean.klaasholwerda.nl/interface/bnf/gdsformat.html)
+UNITS = 0x03
+ENDLIB = 0x04
+BGNSTR = 0x05
+STRNAME = 0x06
+ENDSTR = 0x07
+BOUNDARY = 0x08
+PATH = 0x09
+SREF = 0x0A
+AREF = 0x0B
+TEXT = 0x0C
+LAYER = 0x0D
+WIDTH = 0x0F
+XY = 0x10
+ENDEL = 0x11
+SNAME = 0x12
+COLROW = 0x13
+NODE = 0x15
+STRANS = 0x1A
+MAG = 0x1B
+ANGLE = 0x1C
+PATHTYPE = 0x21
+BOX = 0x2D
+BGNEXTN = 0x30
+ENDEXTN = 0x31
+
+ROUND_TOLERANCE = 0.01 # largest distance of a round path end from the half circle (gdspy's default)
+CHECK_RECORDS = 1<<16 # records read between two calls of the check callback
+
+def gdsii_real(data):
+    """Decode an 8-byte GDSII real (excess-64, base-16 exponent)."""
+    value = int.from_bytes(data, 'big')
+    sign = -1.0 if value & 0x8000000000000000 else 1.0
+    exponent = (value >> 56) & 0x7f
+    mantissa = value & 0x00ffffffffffffff
+    return sign * mantissa / 2.0**56 * 16.0**(exponent-64)
+
+class _Structure:
+    # what the scan collects about one GDSII structure (cell)
+    def __init__(self, name):
+        self.name = name
+        self.xy_ranges = {} # layer -> array of (byte offset, byte length) of XY records
+        self.polygons = {} # layer -> list of extra polygons (paths, split XY records)
+        self.references = [] # (name, matrices)
+
+def _decode_xy(mm, start, length):
+    return np.frombuffer(mm, dtype='>i4', count=length//4, offset=start).reshape(-1, 2)
+
+def _gather_polygons(mm, ranges, factor):
+    # decode many BOUNDARY/BOX XY records with a single gather from the file;
+    # the last point of each record repeats the first and is dropped
+    starts = np.frombuffer(ranges, dtype=np.int64)[0::2]
+    lengths = np.frombuffer(ranges, dtype=np.int64)[1::2] - 8
+    counts = lengths // 8
+    offsets = np.zeros(len(counts)+1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    data = np.frombuffer(mm, dtype=np.uint8)
+    byte_offsets = np.zeros(len(lengths)+1, dtype=np.int64)
+    np.cumsum(lengths, out=byte_offsets[1:])
+    index = np.repeat(starts - byte_offsets[:-1], lengths) + np.arange(byte_offsets[-1])
+    vertices = data[index].view('>i4').reshape(-1, 2).astype(np.float64) * factor
+    return vertices, offsets
+
+def _path_side(points, direction, offset):
+    # one side of a path: its segments shifted by offset (normal to them),
+    # joined like gdspy's FlexPath does for GDSII paths. Where the shifted
+    # segments meet within half a width (the path's half width is
+    # |offset|) past their ends, they are joined at that point (a miter on
+    # the outside of a bend, the crossing on the inside). Sharper bends are
+    # cut off after half a width, with two points instead of one.
+    start = points[:-1] + offset
+    end = points[1:] + offset
+    if len(points) == 2:
+        return np.stack((start[0], end[0]))
+    half = np.linalg.norm(offset[0])
+    p0, p1 = end[:-1], start[1:]
+    v0, v1 = half*direction[:-1], half*direction[1:]
+    den = v1[:, 1]*v0[:, 0] - v1[:, 0]*v0[:, 1]
+    parallel = den**2 < 1e-12*half**4
+    den = np.where(parallel, 1.0, den)
+    d = p1 - p0
+    u0 = np.where(parallel, 0.0, (v1[:, 1]*d[:, 0] - v1[:, 0]*d[:, 1])/den)[:, None]
+    u1 = np.where(parallel, 0.0, (v0[:, 1]*d[:, 0] - v0[:, 0]*d[:, 1])/den)[:, None]
+    single = ((u0 < 0) & (u1 > 0)) | ((u0 <= 1) & (u1 >= -1))
+    joined = 0.5*(p0 + u0*v0 + p1 + u1*v1)
+    first = np.where(single, joined, p0 + np.minimum(u0, 1)*v0)
+    second = p1 + np.maximum(u1, -1)*v1
+    corners = np.stack((first, second), axis=1).reshape(-1, 2)
+    keep = np.ones((len(first), 2), dtype=bool)
+    keep[:, 1] = ~single[:, 0]
+    return np.concatenate((start[:1], corners[keep.ravel()], end[-1:]))
+
+def _round_cap(center, half, angle, reverse=False):
+    # half circle of radius half around center, from angle - 90 to angle + 90
+    # degrees (or back), with as many points as gdspy puts on it, at least 5
+    step = np.arccos(np.clip(1 - ROUND_TOLERANCE/half, -1.0, 1.0))
+    count = max(5, 1 + int(np.pi/2/step + 0.5)) if step > 0 else 5
+    angles = np.linspace(-np.pi/2, np.pi/2, count)
+    angles = angle + (angles[::-1] if reverse else angles)
+    return center + half*np.stack((np.cos(angles), np.sin(angles)), axis=1)
+
+def path_polygon(points, width, pathtype=0, bgnextn=0.0, endextn=0.0):
+    """Outline of a GDSII PATH, with the same vertices as gdspy gives it.
+
+    pathtype 0 ends flush at the end points, 2 extends the ends by half the
+    width, 4 by bgnextn and endextn, and 1 ends in a half circle.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    two_points = len(points) == 2 # gdspy outlines these separately
+    keep = np.ones(len(points), dtype=bool)
+    keep[1:] = np.any(np.diff(points, axis=0) != 0, axis=1) # drop repeated points
+    points = points[keep]
+    half = abs(width)/2
+    if len(points) < 2 or half == 0:
+        return None
+
+    direction = np.diff(points, axis=0)
+    direction /= np.linalg.norm(direction, axis=1)[:, None]
+    if pathtype == 2:
+        bgnextn, endextn = half, half
+    extend = pathtype in (2, 4)
+    normal = np.stack((-direction[:, 1], direction[:, 0]), axis=1)
+    first, last = direction[0], direction[-1]
+    begin, end = points[0], points[-1]
+
+    if two_points:
+        # right and left side at the start, then left and right at the end
+        if pathtype == 1:
+            return np.concatenate((_round_cap(begin, half, np.arctan2(-first[1], -first[0]), reverse=True),
+                                   _round_cap(end, half, np.arctan2(last[1], last[0]), reverse=True)))
+        if extend:
+            begin, end = begin - bgnextn*first, end + endextn*last
+        side = half*normal[0]
+        return np.stack((begin - side, begin + side, end + side, end - side))
+
+    left = _path_side(points, direction, half*normal)
+    right = _path_side(points, direction, -half*normal)
+    # the ends run from the right to the left side; the extended ends keep
+    # the corners of the flush end as well
+    if pathtype == 1:
+        start_cap = _round_cap(begin, half, np.arctan2(-first[1], -first[0]), reverse=True)
+        end_cap = _round_cap(end, half, np.arctan2(last[1], last[0]))
+    elif extend:
+        start_cap = np.stack((right[0], right[0] - bgnextn*first, left[0] - bgnextn*first, left[0]))
+        end_cap = np.stack((right[-1], right[-1] + endextn*last, left[-1] + endextn*last, left[-1]))
+    else:
+        start_cap = np.stack((right[0], left[0]))
+        end_cap = np.stack((right[-1], left[-1]))
+    return np.concatenate((start_cap[::-1], right[1:-1], end_cap, left[-2:0:-1]))
+
+def scan_structures(gdsii_file_path, layers=None, check=None):
+    """Scan a GDSII file for the geometry on the given layers.
+
+    Returns a dictionary that maps each structure name to its polygons,
+    {layer: (vertices, offsets)}, and its references, [(name, matrices)].
+    layers=None reads all layers. check, if given, is called every
+    CHECK_RECORDS records and for every structure; it can raise to stop
+    reading (e.g. when the conversion is cancelled).
+    """
+    structures = {}
+    with open(gdsii_file_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            factor = _scan(mm, structures, layers, check)
+            result = {}
+            for structure in structures.values():
+                if check is not None:
+                    check()
+                packed = {}
+                for layer, ranges in structure.xy_ranges.items():
+                    vertices, offsets = _gather_polygons(mm, ranges, factor)
+                    extra = structure.polygons.pop(layer, [])
+                    if extra:
+                        extra_vertices, extra_offsets = pack_polygons(extra)
+                        vertices = np.concatenate((vertices, extra_vertices))
+                        offsets = np.concatenate((offsets, extra_offsets[1:] + offsets[-1]))
+                    packed[layer] = (vertices, offsets)
+                for layer, extra in structure.polygons.items():
+                    packed[layer] = pack_polygons(extra)
+                result[structure.name] = (packed, structure.references)
+    return result
+
+def _scan(mm, structures, layers, check=None):
+    # walk the record stream; returns the user units per database unit
+    factor = 1.0
+    structure = None
+    element = None # type of the current element
+    selected = False # whether the current element is on one of the layers
+    position = 0
+    end = len(mm)
+    unpack_header = struct.Struct('>HB').unpack_from
+    unpack_short = struct.Struct('>h').unpack_from
+    unpack_int = struct.Struct('>i').unpack_from
+    records = 0
+
+    while position + 4 <= end:
+        records += 1
+        if check is not None and records % CHECK_RECORDS == 0:
+            check()
+        size, record = unpack_header(mm, position)
+        if size < 4:
+            break # padding after the library
+        data = position + 4
+
+        if record == XY:
+            if element == 'polygon' and selected:
+                xy_ranges.append((data, size-4))
+            elif (element == 'path' and selected) or element in ('sref', 'aref'):
+                xy.append(_decode_xy(mm, data, size-4).astype(np.float64) * factor)
+        elif record == LAYER:
+            layer = unpack_short(mm, data)[0]
+            selected = layers is None or layer in layers
+        elif record == BOUNDARY or record == BOX:
+            element, selected, xy_ranges = 'polygon', False, []
+        elif record == PATH:
+            element, selected, xy = 'path', False, []
+            width, pathtype, bgnextn, endextn = 0.0, 0, 0.0, 0.0
+        elif record == SREF or record == AREF:
+            element, xy = ('sref' if record == SREF else 'aref'), []
+            sname, reflection, magnification, rotation, colrow = None, False, None, None, (1, 1)
+        elif record == ENDEL:
+            if element == 'polygon' and selected:
+                if len(xy_ranges) == 1:
+                    structure.xy_ranges.setdefault(layer, array('q')).extend(xy_ranges[0])
+                elif xy_ranges: # boundary continued over several XY records
+                    points = np.concatenate([_decode_xy(mm, *r) for r in xy_ranges])
+                    structure.polygons.setdefault(layer, []).append(points[:-1].astype(np.float64) * factor)
+            elif element == 'path' and selected and xy:
+                polygon = path_polygon(np.concatenate(xy), width, pathtype, bgnextn, endextn)
+                if polygon is not None:
+                    structure.polygons.setdefault(layer, []).append(polygon)
+            elif element in ('sref', 'aref') and xy:
+                points = np.concatenate(xy)
+                linear = linear_transform(rotation, magnification, reflection)
+                if element == 'sref':
+                    matrices = placement_matrices(points[0], linear)
+                else:
+                    columns, rows = colrow
+                    matrices = placement_matrices(points[0], linear, columns, rows,
+                                                  (points[1]-points[0])/columns, (points[2]-points[0])/rows)
+                structure.references.append((sname, matrices))
+            element = None
+        elif record == WIDTH:
+            width = unpack_int(mm, data)[0] * factor
+        elif record == PATHTYPE:
+            pathtype = unpack_short(mm, data)[0]
+        elif record == BGNEXTN:
+            bgnextn = unpack_int(mm, data)[0] * factor
+        elif record == ENDEXTN:
+            endextn = unpack_int(mm, data)[0] * factor
+        elif record == SNAME:
+            sname = mm[data:position+size].rstrip(b'\0').decode('ascii', 'replace')
+        elif record == STRANS:
+            reflection = bool(mm[data] & 0x80)
+        elif record == MAG:
+            magnification = gdsii_real(mm[data:data+8])
+        elif record == ANGLE:
+            rotation = gdsii_real(mm[data:data+8])
+        elif record == COLROW:
+            colrow = struct.unpack_from('>hh', mm, data)
+        elif record == TEXT or record == NODE:
+            element = None
+        elif record == STRNAME:
+            name = mm[data:position+size].rstrip(b'\0').decode('ascii', 'replace')
+            structure = structures[name] = _Structure(name)
+        elif record == ENDSTR:
+            structure = None
+        elif record == UNITS:
+            factor = gdsii_real(mm[data:data+8]) # user units per database unit
+        elif record == ENDLIB:
+            break
+
+        position += size
+    return factor
+
+def read_cells(gdsii_file_path, layerstack, hierarchy=False, check=None):
+    """Read the layers of layerstack from a GDSII file, the way gdsiistl() uses them.
+
+    Returns a list of (layers, placements) pairs, with layers mapping layer
+    numbers to packed (vertices, offsets). With hierarchy=True there is one
+    pair per cell with geometry, placed wherever the cell is used; otherwise
+    the layout is flattened into a single pair, placed once. check is called
+    now and then while reading (see scan_structures).
+    """
+    structures = scan_structures(gdsii_file_path, set(layerstack), check)
+
+    def references(name):
+        # skip references to cells missing from the file
+        return [(child, matrices) for child, matrices in structures[name][1] if child in structures]
+    referenced = {child for _, refs in structures.values() for child, _ in refs}
+    top_cells = [name for name in structures if name not in referenced and name not in SKIPPED_CELLS]
+    placed = [(structures[name][0], placements)
+              for name, placements in walk_placements(top_cells, references) if structures[name][0]]
+    if hierarchy:
+        return placed
+    return flatten_cells(placed, check)
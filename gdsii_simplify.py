@@ -0,0 +1,109 @@
+'''Tolerance-based simplification of packed layer polygons.
+
+Circles, arcs, rounded path ends and other curves come out of layout tools
+as polygons with hundreds or thousands of vertices, and every vertex costs
+two side-wall triangles plus its share of the caps. simplify_polygons()
+removes the vertices that lie within a tolerance (in layout units) of the
+line between their neighbours, the way Visvalingam-Whyatt does, but for all
+polygons of a layer at once: every round removes each vertex below the
+tolerance whose deviation is smaller than that of both its neighbours, so
+neighbouring vertices are never removed together, and the rounds repeat until
+nothing changes.
+
+Holes stay intact: points that occur more than once in a polygon (the ends
+of the cut lines of GDSII keyhole polygons) are never removed, and every
+polygon keeps at least three vertices. A polygon whose orientation flips or
+whose area changes by more than the tolerance times its perimeter is kept as
+it was. Keep the tolerance well below the smallest feature width; outlines
+of the same polygon that are closer together than the tolerance can end up
+crossing.
+'''
+
+import numpy as np # fast math on lots of points
+
+from gdsii_geometry import polygon_ids, next_indices, previous_indices, signed_areas
+
+MAX_ROUNDS = 64 # each round removes up to half of the remaining vertices of a polygon
+
+def _repeated_points(vertices, offsets):
+    # vertices whose position occurs more than once in their polygon
+    owner = polygon_ids(offsets)
+    order = np.lexsort((vertices[:, 1], vertices[:, 0], owner))
+    same = (owner[order][1:] == owner[order][:-1]) & np.all(vertices[order][1:] == vertices[order][:-1], axis=1)
+    repeated = np.zeros(len(vertices), dtype=bool)
+    repeated[order[1:][same]] = True
+    repeated[order[:-1][same]] = True
+    return repeated
+
+def _deviations(vertices, offsets):
+    # distance of every vertex to the line through its neighbours
+    previous = vertices[previous_indices(offsets)]
+    chord = vertices[next_indices(offsets)] - previous
+    offset = vertices - previous
+    length = np.hypot(chord[:, 0], chord[:, 1])
+    cross = np.abs(chord[:, 0]*offset[:, 1] - chord[:, 1]*offset[:, 0])
+    return np.where(length > 0, cross/np.where(length > 0, length, 1), np.hypot(offset[:, 0], offset[:, 1]))
+
+def simplify_polygons(vertices, offsets, tolerance, max_rounds=MAX_ROUNDS):
+    """Remove the vertices of packed polygons that deviate less than tolerance from their outline.
+
+    Returns the simplified (vertices, offsets); the polygons keep their
+    order and the remaining vertices their order and positions.
+    """
+    num_polygons = len(offsets)-1
+    if tolerance is None or tolerance <= 0 or len(vertices) == 0:
+        return vertices, offsets
+    index = np.arange(len(vertices)) # remaining vertices, as indices into vertices
+    current = offsets
+    fixed = _repeated_points(vertices, offsets)
+    for _ in range(max_rounds):
+        points = vertices[index]
+        counts = np.diff(current)
+        owner = polygon_ids(current)
+        deviation = _deviations(points, current)
+        candidate = (deviation < tolerance) & ~fixed[index] & (counts[owner] > 3)
+        if not candidate.any():
+            break
+
+        # only remove a vertex when it deviates less than both its neighbours
+        # (ties go to the lower index), so no two neighbours go at once
+        positions = np.arange(len(index))
+        remove = candidate.copy()
+        for neighbours in (previous_indices(current), next_indices(current)):
+            other = deviation[neighbours]
+            remove &= ~candidate[neighbours] | (deviation < other) | ((deviation == other) & (positions < neighbours))
+
+        # keep three vertices in every polygon
+        removed_before = np.cumsum(remove) - remove
+        first_removed = np.zeros(num_polygons, dtype=np.int64)
+        filled = counts > 0
+        first_removed[filled] = removed_before[current[:-1][filled]]
+        remove &= (removed_before - first_removed[owner]) < (counts[owner] - 3)
+        if not remove.any():
+            break
+
+        index = index[~remove]
+        kept_counts = counts - np.bincount(owner[remove], minlength=num_polygons)
+        current = np.zeros(num_polygons+1, dtype=np.int64)
+        np.cumsum(kept_counts, out=current[1:])
+
+    # keep the polygons that would flip or change too much as they were
+    kept = np.zeros(len(vertices), dtype=bool)
+    kept[index] = True
+    before = signed_areas(vertices, offsets)
+    after = signed_areas(vertices[index], current)
+    edges = vertices[next_indices(offsets)] - vertices
+    perimeters = np.zeros(num_polygons)
+    filled = np.diff(offsets) > 0
+    perimeters[filled] = np.add.reduceat(np.hypot(edges[:, 0], edges[:, 1]), offsets[:-1][filled])
+    # signed_areas() gives twice the area
+    changed = (np.sign(before) != np.sign(after)) | (np.abs(after - before) > 2*tolerance*perimeters)
+    if changed.any():
+        kept |= np.repeat(changed, np.diff(offsets))
+
+    counts = np.add.reduceat(kept, offsets[:-1][filled]) if filled.any() else np.zeros(0, dtype=np.int64)
+    new_counts = np.zeros(num_polygons, dtype=np.int64)
+    new_counts[filled] = counts
+    new_offsets = np.zeros(num_polygons+1, dtype=np.int64)
+    np.cumsum(new_counts, out=new_offsets[1:])
+    return vertices[kept], new_offsets
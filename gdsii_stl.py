@@ -0,0 +1,51 @@
+'''Binary STL files written through a memory map.
+
+gdsiistl() normally fills the triangles of a layer into an array in memory and
+saves that with numpy-stl. MappedStl creates the file at its final size
+instead (the number of triangles is known before extruding), and maps one
+chunk of it at a time, so the triangles are extruded straight into the file
+and the memory used does not grow with the layer:
+
+    stl_file = MappedStl(filename, num_triangles)
+    with stl_file.rows(start, stop) as vectors:
+        extrude_polygons(..., out=vectors)
+
+The normals of each chunk are computed (the way numpy-stl does) when it is
+unmapped, so the file is the same as the one numpy-stl writes, up to the date
+in the header.
+'''
+
+import os
+import struct
+import contextlib
+
+import numpy as np # fast math on lots of points
+from stl import mesh # STL record layout and header (python package name is "numpy-stl")
+
+HEADER_SIZE = 84 # 80 byte header and the number of triangles
+
+class MappedStl:
+    """A binary STL file of num_triangles triangles, filled in through memory maps."""
+
+    def __init__(self, filename, num_triangles):
+        self.filename = filename
+        self.num_triangles = num_triangles
+        header = mesh.Mesh(np.zeros(0, dtype=mesh.Mesh.dtype)).get_header(os.path.basename(filename))
+        with open(filename, 'wb') as f:
+            f.write(header.encode('ascii', 'replace'))
+            f.write(struct.pack('<I', num_triangles))
+            f.truncate(HEADER_SIZE + num_triangles*mesh.Mesh.dtype.itemsize)
+
+    @contextlib.contextmanager
+    def rows(self, start, stop):
+        """Map triangles start to stop-1 and give their (stop-start, 3, 3) float32 corners to fill in."""
+        if stop <= start:
+            yield np.zeros((0, 3, 3), dtype=np.float32)
+            return
+        data = np.memmap(self.filename, dtype=mesh.Mesh.dtype, mode='r+',
+                         offset=HEADER_SIZE + start*mesh.Mesh.dtype.itemsize, shape=(stop-start,))
+        vectors = data['vectors']
+        yield vectors
+        data['normals'] = np.cross(vectors[:, 1] - vectors[:, 0], vectors[:, 2] - vectors[:, 0])
+        data.flush()
+        del data, vectors # unmap
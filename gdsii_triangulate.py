@@ -0,0 +1,341 @@
+'''Triangulation stage of gdsiistl().
+
+Polygons come in packed form (see gdsii_geometry): one flat vertex array per
+layer plus offsets. The result of triangulating a packed set of polygons is a
+"triangulation" dictionary with ragged arrays:
+
+    triangulation = {
+        'vertices': [[x, y], ...],              # all triangulation vertices
+        'vertex_offsets': [0, ...],             # polygon p owns vertices[vo[p]:vo[p+1]]
+        'triangles': [[0, 1, 2], ...],          # indices local to each polygon
+        'triangle_offsets': [0, ...],           # polygon p owns triangles[to[p]:to[p+1]]
+    }
+
+The polygons are triangulated by one of the ENGINES:
+
+    'triangle'  the triangle C library, one polygon per call
+    'earcut'    ear clipping in numpy, all polygons of a chunk at once (see
+                gdsii_earcut); much faster for small polygons, slower for
+                polygons with many vertices
+    'auto'      earcut for polygons of up to EARCUT_MAX_VERTICES vertices,
+                triangle for larger ones and for those earcut cannot clip
+
+The triangle C library can segfault on some inputs, so TriangulationPool runs
+the engines in separate worker processes. Each worker gets one chunk of
+polygons at a time; when a worker dies, only the chunk it was working on is
+retried, one polygon per task, and polygons that still crash are left
+without triangles.
+TriangulationPool.stats holds the polygons, triangles and seconds of every
+engine, for their throughput.
+'''
+
+import os
+import time
+import multiprocessing
+from multiprocessing.connection import wait
+from collections import deque
+
+import numpy as np # fast math on lots of points
+import triangle # triangulate polygons
+
+from gdsii_geometry import select_polygons, select_triangulation, merge_triangulations
+from gdsii_earcut import earcut_polygons # triangulate small polygons in bulk
+
+DEFAULT_CHUNK_SIZE = 1024 # polygons per task sent to a worker
+DEFAULT_ENGINE = 'triangle'
+# above this many vertices triangle is faster than ear clipping
+EARCUT_MAX_VERTICES = 24
+
+def triangulate_polygon(polygon, holes=None):
+    """Triangulate one (inset) polygon outline with triangle.triangulate.
+
+    Returns (vertices, triangles); triangles is empty if the library could
+    not generate any (degenerate edge case).
+    """
+    num_polygon_points = len(polygon)
+    point_array = np.arange(num_polygon_points)
+    edges = np.transpose(np.stack((point_array, np.roll(point_array, 1))))
+    if holes is not None:
+        triangles = triangle.triangulate(dict(vertices=polygon,
+                                            segments=edges,
+                                            holes=holes), opts='p')
+    else:
+        triangles = triangle.triangulate(dict(vertices=polygon,
+                                            segments=edges), opts='p')
+
+    if not 'triangles' in triangles.keys():
+        return np.asarray(triangles.get('vertices', polygon)), np.zeros((0, 3), dtype=np.int32)
+    return triangles['vertices'], triangles['triangles']
+
+def empty_triangulation(num_polygons=0):
+    """Triangulation of num_polygons polygons without any triangles."""
+    return dict(vertices=np.zeros((0, 2)),
+                vertex_offsets=np.zeros(num_polygons+1, dtype=np.int64),
+                triangles=np.zeros((0, 3), dtype=np.int32),
+                triangle_offsets=np.zeros(num_polygons+1, dtype=np.int64))
+
+def triangulate_chunk(vertices, offsets, holes=None):
+    """Triangulate every polygon of a packed chunk, in this process."""
+    vertex_parts = []
+    triangle_parts = []
+    for index in range(len(offsets)-1):
+        start, stop = offsets[index], offsets[index+1]
+        polygon_holes = None if holes is None else holes[start:stop]
+        vs, ts = triangulate_polygon(vertices[start:stop], polygon_holes)
+        vertex_parts.append(vs)
+        triangle_parts.append(ts)
+    return _pack_triangulation(vertex_parts, triangle_parts)
+
+def triangle_engine(vertices, offsets, holes=None):
+    """The 'triangle' engine: returns the triangulation and which polygons failed (none)."""
+    return triangulate_chunk(vertices, offsets, holes), np.zeros(len(offsets)-1, dtype=bool)
+
+def earcut_engine(vertices, offsets, holes=None):
+    """The 'earcut' engine (hole markers are not needed): returns the triangulation and which polygons failed."""
+    return earcut_polygons(vertices, offsets)
+
+# name: function(vertices, offsets, holes) -> (triangulation, failed polygons)
+ENGINES = {'triangle': triangle_engine, 'earcut': earcut_engine}
+
+def auto_engines(offsets):
+    """Whether 'auto' gives each polygon to earcut (True) or to triangle (False)."""
+    return np.diff(offsets) <= EARCUT_MAX_VERTICES
+
+def _pack_triangulation(vertex_parts, triangle_parts):
+    triangulation = empty_triangulation(len(vertex_parts))
+    if len(vertex_parts) == 0:
+        return triangulation
+    np.cumsum([len(vs) for vs in vertex_parts], out=triangulation['vertex_offsets'][1:])
+    np.cumsum([len(ts) for ts in triangle_parts], out=triangulation['triangle_offsets'][1:])
+    triangulation['vertices'] = np.concatenate(vertex_parts, axis=0).reshape(-1, 2)
+    triangulation['triangles'] = np.concatenate(triangle_parts, axis=0).reshape(-1, 3).astype(np.int32, copy=False)
+    return triangulation
+
+def concatenate_triangulations(parts):
+    """Join triangulations of consecutive polygon ranges into one."""
+    if len(parts) == 0:
+        return empty_triangulation()
+    vertex_offsets = [parts[0]['vertex_offsets'][:1]]
+    triangle_offsets = [parts[0]['triangle_offsets'][:1]]
+    num_vertices = 0
+    num_triangles = 0
+    for part in parts:
+        vertex_offsets.append(part['vertex_offsets'][1:] + num_vertices)
+        triangle_offsets.append(part['triangle_offsets'][1:] + num_triangles)
+        num_vertices += len(part['vertices'])
+        num_triangles += len(part['triangles'])
+    return dict(vertices=np.concatenate([part['vertices'] for part in parts], axis=0),
+                vertex_offsets=np.concatenate(vertex_offsets),
+                triangles=np.concatenate([part['triangles'] for part in parts], axis=0),
+                triangle_offsets=np.concatenate(triangle_offsets))
+
+def polygon_triangulation(triangulation, index):
+    """Return {'vertices', 'triangles'} of one polygon, like triangle.triangulate."""
+    vertex_offsets = triangulation['vertex_offsets']
+    triangle_offsets = triangulation['triangle_offsets']
+    return dict(vertices=triangulation['vertices'][vertex_offsets[index]:vertex_offsets[index+1]],
+                triangles=triangulation['triangles'][triangle_offsets[index]:triangle_offsets[index+1]])
+
+def _select(vertices, offsets, holes, selected):
+    # the polygons with selected[p] == True, with their hole markers
+    return (*select_polygons(vertices, offsets, selected),
+            None if holes is None else select_polygons(holes, offsets, selected)[0])
+
+def _worker_main(connection):
+    # runs in the worker process: triangulate chunks until told to stop
+    while True:
+        task = connection.recv()
+        if task is None:
+            break
+        task_id, engine, vertices, offsets, holes = task
+        start = time.perf_counter()
+        triangulation, failed = ENGINES[engine](vertices, offsets, holes)
+        connection.send((task_id, triangulation, failed, time.perf_counter() - start))
+
+class TriangulationPool:
+    """Process pool for the triangulation stage.
+
+    workers is the number of worker processes (None uses all cores); with 0
+    the polygons are triangulated in the calling process, as gdsiistl() did
+    originally, without protection against crashes in the triangle library.
+    engine is the default of triangulate() (see ENGINES, or 'auto').
+    Use as a context manager so the workers are stopped afterwards.
+    """
+
+    def __init__(self, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, engine=DEFAULT_ENGINE):
+        if engine != 'auto' and engine not in ENGINES:
+            raise ValueError(f'unknown triangulation engine {engine!r}, use one of {sorted(ENGINES)} or auto')
+        self.workers = (os.cpu_count() or 1) if workers is None else max(0, int(workers))
+        self.chunk_size = max(1, int(chunk_size))
+        self.engine = engine
+        self.crashed_polygons = 0 # polygons skipped because they crashed a worker
+        # engine: dict(polygons, triangles, failed, seconds); seconds are summed over the workers
+        self.stats = {name: dict(polygons=0, triangles=0, failed=0, seconds=0.0) for name in ENGINES}
+        self._context = multiprocessing.get_context('spawn')
+        self._idle = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Stop all worker processes."""
+        for process, connection in self._idle:
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+        for process, connection in self._idle:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+            connection.close()
+        self._idle = []
+
+    def _start_worker(self):
+        parent, child = self._context.Pipe()
+        process = self._context.Process(target=_worker_main, args=(child,), daemon=True)
+        process.start()
+        child.close()
+        return process, parent
+
+    def throughput(self):
+        """Polygons per second (per worker) of every engine that ran."""
+        return {name: stats['polygons']/stats['seconds'] for name, stats in self.stats.items()
+                if stats['polygons'] and stats['seconds'] > 0}
+
+    def triangulate(self, vertices, offsets, holes=None, progress=None, engine=None):
+        """Triangulate packed polygons; returns a triangulation dictionary.
+
+        holes, if given, holds one hole marker point per packed vertex (only
+        the triangle engine uses them). engine overrides the engine of the
+        pool for this call. progress, if given, is called with the number
+        of polygons of every finished chunk; an exception raised by it (e.g.
+        to cancel) stops the triangulation.
+        """
+        engine = engine or self.engine
+        num_polygons = len(offsets)-1
+        if num_polygons == 0:
+            return empty_triangulation()
+        if engine == 'auto':
+            small = auto_engines(offsets)
+            if small.all() or not small.any():
+                return self._triangulate(vertices, offsets, holes, progress, 'earcut' if small.all() else 'triangle')
+            return merge_triangulations(small,
+                self._triangulate(*_select(vertices, offsets, holes, small), progress, 'earcut'),
+                self._triangulate(*_select(vertices, offsets, holes, ~small), progress, 'triangle'))
+        return self._triangulate(vertices, offsets, holes, progress, engine)
+
+    def _triangulate(self, vertices, offsets, holes, progress, engine):
+        # one engine for all polygons; those it fails on go to triangle
+        triangulation, failed = self._triangulate_with(vertices, offsets, holes, progress, engine)
+        if engine != 'triangle' and failed.any():
+            print(f'    {engine} could not triangulate {failed.sum()} polygon(s), using triangle for them')
+            retried = self._triangulate_with(*_select(vertices, offsets, holes, failed), None, 'triangle')[0]
+            triangulation = merge_triangulations(failed, retried, select_triangulation(triangulation, ~failed))
+        return triangulation
+
+    def _count(self, engine, result, seconds):
+        # add a finished chunk to the throughput of its engine
+        triangulation, failed = result
+        stats = self.stats[engine]
+        stats['polygons'] += len(failed)
+        stats['triangles'] += len(triangulation['triangles'])
+        stats['failed'] += int(failed.sum())
+        stats['seconds'] += seconds
+
+    def _triangulate_with(self, vertices, offsets, holes, progress, engine):
+        # returns the triangulation and the polygons that failed
+        num_polygons = len(offsets)-1
+        if num_polygons == 0:
+            return empty_triangulation(), np.zeros(0, dtype=bool)
+        if self.workers == 0:
+            # in this process, chunk by chunk so that progress can be reported
+            results = []
+            for start in range(0, num_polygons, self.chunk_size):
+                stop = min(start+self.chunk_size, num_polygons)
+                vstart, vstop = offsets[start], offsets[stop]
+                begin = time.perf_counter()
+                results.append(ENGINES[engine](vertices[vstart:vstop], offsets[start:stop+1]-vstart,
+                                               None if holes is None else holes[vstart:vstop]))
+                self._count(engine, results[-1], time.perf_counter() - begin)
+                if progress is not None:
+                    progress(stop-start)
+            return (concatenate_triangulations([result[0] for result in results]),
+                    np.concatenate([result[1] for result in results]))
+
+        # keep a few chunks per worker around so that the load stays balanced
+        chunk_size = min(self.chunk_size, -(-num_polygons // (4*self.workers)))
+        bounds = [(p, min(p+chunk_size, num_polygons)) for p in range(0, num_polygons, chunk_size)]
+        results, crashed = self._run(vertices, offsets, holes, bounds, progress, engine)
+
+        # a worker died on these chunks: retry them one polygon per task
+        if crashed:
+            print(f'    worker crashed on {len(crashed)} chunk(s), retrying polygon by polygon...')
+            single = [(p, p+1) for index in crashed for p in range(*bounds[index])]
+            single_results, single_crashed = self._run(vertices, offsets, holes, single, progress, engine)
+            for index in single_crashed:
+                p = single[index][0]
+                print(f'    polygon {p} crashed the {engine} engine and is left unfilled')
+                single_results[index] = (empty_triangulation(1), np.zeros(1, dtype=bool))
+            self.crashed_polygons += len(single_crashed)
+            for index in crashed:
+                start, stop = bounds[index]
+                parts = [single_results[i] for i, (p, _) in enumerate(single) if start <= p < stop]
+                results[index] = (concatenate_triangulations([part[0] for part in parts]),
+                                  np.concatenate([part[1] for part in parts]))
+
+        return (concatenate_triangulations([result[0] for result in results]),
+                np.concatenate([result[1] for result in results]))
+
+    def _run(self, vertices, offsets, holes, bounds, progress=None, engine=DEFAULT_ENGINE):
+        # hand out the polygon ranges in bounds to the workers; returns the
+        # results (None where a worker crashed) and the crashed range indices
+        results = [None]*len(bounds)
+        crashed = []
+        queue = deque(range(len(bounds)))
+        busy = {} # connection -> (process, task index)
+
+        try:
+            while queue or busy:
+                while queue and len(busy) < self.workers:
+                    process, connection = self._idle.pop() if self._idle else self._start_worker()
+                    index = queue.popleft()
+                    start, stop = bounds[index]
+                    vstart, vstop = offsets[start], offsets[stop]
+                    task = (index, engine, vertices[vstart:vstop], offsets[start:stop+1]-vstart,
+                            None if holes is None else holes[vstart:vstop])
+                    try:
+                        connection.send(task)
+                    except OSError: # worker already gone; count it as a crash
+                        connection.close()
+                        process.join()
+                        crashed.append(index)
+                        continue
+                    busy[connection] = (process, index)
+
+                for connection in wait(list(busy)):
+                    process, index = busy.pop(connection)
+                    try:
+                        task_id, triangulation, failed, seconds = connection.recv()
+                        results[task_id] = (triangulation, failed)
+                        self._count(engine, results[task_id], seconds)
+                        self._idle.append((process, connection))
+                    except (EOFError, OSError): # the worker died on this task
+                        process.join()
+                        connection.close()
+                        crashed.append(index)
+                        continue
+                    if progress is not None:
+                        start, stop = bounds[task_id]
+                        progress(stop-start)
+        finally:
+            # stopped early (e.g. cancelled): the busy workers are not waited for
+            for connection, (process, index) in busy.items():
+                process.terminate()
+                process.join()
+                connection.close()
+
+        return results, crashed
@@ -0,0 +1,1009 @@
+'''GDSII to STL conversion, usable without the GUI.
+
+gdsiistl() converts the layers of one GDSII file; BlendGDSII.py calls it from
+its GUI. From the command line, many files can be converted in one go with
+the layer stack of a saved session (saved/*.txt), e.g. on a build server:
+
+    python gdsiistl.py saved/example.txt tapeout/ extra.gds --jobs 4
+
+Files (and all .gds files in given folders) go through a job queue that runs
+up to --jobs conversions in parallel processes. Progress messages go to
+stderr; a JSON summary of all jobs is printed to stdout when they are done.
+Without GDSII files the file named in the session is converted.
+'''
+
+import os
+import sys # read command-line arguments
+import glob
+import json
+import time
+import argparse
+import collections
+import multiprocessing
+from multiprocessing.connection import wait
+
+import gdspy # open gds file
+import numpy as np # fast math on lots of points
+from stl import mesh # write stl file (python package name is "numpy-stl")
+from gdsii_geometry import pack_polygons, signed_areas, inset_polygons # batch polygon kernels
+from gdsii_geometry import classify_polygons, select_polygons, fan_triangulation, merge_triangulations # fill simple polygons
+from gdsii_geometry import extrusion_size, extrude_polygons, place_triangles # extrude polygons
+from gdsii_geometry import extrude_indexed, place_vertices, triangle_tiles
+from gdsii_geometry import extrusion_chunks, polygon_range, triangulation_range # extrude in chunks
+from gdsii_triangulate import TriangulationPool, ENGINES, DEFAULT_ENGINE, concatenate_triangulations # triangulate polygons
+from gdsii_cache import TriangulationCache, TRIANGULATION_VERSION # reuse earlier triangulations
+from gdsii_cache import GeometryCache # reuse the polygons read from a file
+from gdsii_manifest import MANIFEST_NAME, load_manifest, save_manifest, file_fingerprint # incremental conversion
+from gdsii_manifest import layer_parameters, geometry_hash, layer_up_to_date
+from gdsii_hierarchy import IDENTITY, SKIPPED_CELLS, cell_placements, extract_polygons, flatten_cells, \
+    placement_scales, split_by_scale # cell references
+from gdsii_reader import read_cells # read selected layers only
+from gdsii_boolean import merge_polygons, crop_cells # union of overlapping polygons, region of interest
+from gdsii_simplify import simplify_polygons # fewer vertices on curves
+from gdsii_lod import coarse_mesh # coarse previews of huge layouts
+from gdsii_profile import ConversionReport, report_path # time, counts and memory of each stage
+from gdsii_stl import MappedStl # write STL files through a memory map
+
+def read_session(path):
+    """Read a saved session (saved/*.txt) into the GDSII file path and its layer rows.
+
+    The first line is the GDSII file, every further line one layer row:
+    check,layer,material,lbound,ubound (e.g. 1,83,SU8,100,500).
+    """
+    with open(path, 'r') as f:
+        lines = f.read().split('\n')
+    rows = [line.split(',') for line in lines[1:] if line.strip() != '']
+    return lines[0], rows
+
+def session_layerstack(rows):
+    """The gdsiistl() layer stack of the checked layer rows of a session."""
+    layerstack = {}
+    for check, entry, material, lbound, ubound in rows:
+        if int(check) and str(entry).strip() != '':
+            layer = int(entry)
+            # thickness and height are applied in Blender (see bpy_import_stls.py)
+            layerstack[layer] = (0,100,f'gdsii_{layer}')
+    return layerstack
+
+class ConversionCancelled(Exception):
+    """Raised by gdsiistl() when its cancel event is set."""
+
+class Progress:
+    """Progress events of gdsiistl().
+
+    callback is called with one dictionary per event: the stage ('read',
+    'triangulate' or 'write'), done and total (polygons, or triangles while
+    writing), eta (estimated seconds left in the stage, None at its start)
+    and, within a stage, the layer. cancel is a threading.Event (or anything
+    with is_set()); once it is set, the next event raises ConversionCancelled.
+    """
+
+    def __init__(self, callback=None, cancel=None):
+        self.callback = callback
+        self.cancel = cancel
+        self.stage, self.done, self.total = None, 0, 0
+        self.start_time = time.perf_counter()
+
+    def check(self):
+        """Raise ConversionCancelled if the conversion was cancelled."""
+        if self.cancel is not None and self.cancel.is_set():
+            raise ConversionCancelled()
+
+    def start(self, stage, total):
+        """Begin a stage with total units of work."""
+        self.stage, self.done, self.total = stage, 0, int(total)
+        self.start_time = time.perf_counter()
+        self.report()
+
+    def advance(self, amount, **info):
+        """Count amount units of the stage as done."""
+        self.done += int(amount)
+        self.report(**info)
+
+    def report(self, **info):
+        self.check()
+        if self.callback is None:
+            return
+        elapsed = time.perf_counter() - self.start_time
+        eta = float(elapsed*(self.total-self.done)/self.done) if self.done > 0 else None
+        self.callback(dict(stage=self.stage, done=self.done, total=self.total, eta=eta, **info))
+
+MAPPED_CHUNK_TRIANGLES = 1<<20 # triangles extruded at a time with mapped_output=True
+
+def output_path(output_folder, filename):
+    # output files are written to output_folder (next to the GDSII file unless
+    # gdsiistl() is given another one)
+    return os.path.join(output_folder, filename)
+
+########## INPUT ##############################################################
+
+# First, the input file is read using the gdspy library, which interprets the
+# GDSII file and formats the data Python-style.
+# See https://gdspy.readthedocs.io/en/stable/index.html for documentation.
+# Second, the boundaries of each shape (polygon or path) are extracted for
+# further processing.
+
+def read_layers(gdsii_file_path, selection, hierarchy=False, streaming=False, check=None):
+    """Read the layers in selection from a GDSII file as (layers, placements) pairs.
+
+    Without hierarchy the layout is flattened into a single cell, placed
+    once. check, if given, is called every now and then; an exception it
+    raises (e.g. to cancel) stops the reading.
+    """
+    # The streaming reader (see gdsii_reader) memory-maps the file and only
+    # decodes the polygons on the layers in selection, straight into packed
+    # arrays. gdspy builds Python objects for everything in the file.
+    if streaming:
+        print('Reading layers {} of GDSII file {}...'.format(list(selection), gdsii_file_path))
+        return read_cells(gdsii_file_path, selection, hierarchy, check=check)
+
+    print('Reading GDSII file {}...'.format(gdsii_file_path))
+    gdsii = gdspy.GdsLibrary()
+    gdsii.read_gds(gdsii_file_path, units='import')
+
+    # Flattening copies every referenced cell (SREF/AREF instance) into the
+    # top-level cells, so a cell placed 10,000 times is triangulated 10,000
+    # times. With hierarchy=True the reference tree is walked instead and each
+    # unique cell is triangulated and extruded once; its finished triangles
+    # are then copied to every place the cell is used (see gdsii_hierarchy).
+    if hierarchy:
+        print('Extracting cell hierarchy...')
+        cells = [] # (layers, placements) of every cell with geometry
+        for cell, placements in cell_placements(gdsii.top_level()):
+            if check is not None:
+                check()
+            layers = extract_polygons(cell, {}, selection)
+            if layers:
+                cells.append((layers, placements))
+    else:
+        print('Extracting polygons...')
+        layers = {} # array to hold all geometry, sorted into layers
+
+        cells = gdsii.top_level() # get all cells that aren't referenced by another
+        for cell in cells: # loop through cells to read paths and polygons
+            if check is not None:
+                check()
+
+            # skip $$$CONTEXT_INFO$$$ (see gdsii_hierarchy.SKIPPED_CELLS)
+            if cell.name in SKIPPED_CELLS:
+                continue # skip this cell
+
+            # combine will all referenced cells (instances, SREFs, AREFs, etc.)
+            cell = cell.flatten()
+
+            # loop through paths and polygons (and boxes) in cell
+            extract_polygons(cell, layers, selection)
+
+        # the flattened layout is one big cell, placed once as it is
+        cells = [(layers, IDENTITY[None])]
+
+    # pack all polygons of each layer into one flat vertex array (with offsets
+    # marking where each polygon starts) so that the steps below can work on
+    # whole layers at once instead of on one polygon at a time
+    for layers, placements in cells:
+        for layer_number, polygons in layers.items():
+            layers[layer_number] = pack_polygons(polygons)
+    return cells
+
+def count_polygons(cells, report):
+    # count the polygons of each layer, once and as placed in the layout
+    for layers, placements in cells:
+        for layer_number, (vertices, offsets) in layers.items():
+            report.count(layer_number, polygons=len(offsets)-1, vertices=len(vertices),
+                         placed_polygons=(len(offsets)-1)*len(placements))
+
+def read_layout(gdsii_file_path, layerstack, hierarchy, streaming, geometry_cache, events, report):
+    """Stage 'read' of gdsiistl(): the (layers, placements) cells of the layers in layerstack."""
+    # With geometry_cache the polygons read from the file are kept per layer
+    # under the file's content hash (see gdsii_cache.GeometryCache), and
+    # memory-mapped by later conversions of the same file. Only the layers
+    # that are not in the cache yet are read from the file.
+    if geometry_cache is True:
+        geometry_cache = GeometryCache() # default cache folder next to this script
+    report.start('read')
+    if geometry_cache:
+        geometry_key = geometry_cache.key(gdsii_file_path, streaming=streaming, hierarchy=hierarchy)
+        cells, missing = geometry_cache.get(geometry_key, list(layerstack), flat=not hierarchy)
+        if missing:
+            geometry_cache.put(geometry_key, read_layers(gdsii_file_path, {layer: layerstack[layer] for layer in missing},
+                                                         hierarchy, streaming, events.check), missing)
+            geometry_cache.trim()
+            cells, _ = geometry_cache.get(geometry_key, list(layerstack), flat=not hierarchy)
+        print('    {} of {} layers taken from the geometry cache'.format(len(layerstack)-len(missing), len(layerstack)))
+        report.count(cached_layers=len(layerstack)-len(missing), read_layers=len(missing))
+    else:
+        cells = read_layers(gdsii_file_path, layerstack, hierarchy, streaming, events.check)
+    count_polygons(cells, report)
+
+    """
+    At this point, "cells" is a list of (layers, placements) pairs, where
+    "layers" is a Python dictionary structured as follows:
+
+    layers = {
+    0 : ([[x1, y1], [x2, y2], ...], [0, n0, n0+n1, ...])
+    1 : ( ... )
+    2 : ( ... )
+    ...
+    }
+
+    Each dictionary key is a GDSII layer number (0-255), and the value of the
+    dictionary at that key (if it exists; keys were only created for layers with
+    geometry) holds the polygons in that GDSII layer: the points (2-element
+    lists with x and y coordinates) of all polygons after each other, and the
+    offsets at which each polygon starts. "placements" is a stack of 3x3 affine
+    transforms, one for each time the cell appears in the layout; without
+    hierarchy there is only the flattened layout, placed once.
+    """
+    return cells
+
+def crop_layout(cells, region, hierarchy, events, report):
+    """Stage 'crop' of gdsiistl(): the part of the layout in region, flattened unless hierarchy is kept."""
+    # With region = (xmin, ymin, xmax, ymax) only that part of the layout is
+    # converted: placements and polygons outside it are sorted out by their
+    # bounding boxes, and the polygons crossing its border are clipped (see
+    # gdsii_boolean), so the work after reading scales with the region.
+    # Cropping comes before flattening, so that cells placed outside the
+    # region are never copied.
+    print('Cropping to region {}...'.format(tuple(region)))
+    report.start('crop')
+    cells = crop_cells(cells, region)
+    if not hierarchy:
+        cells = flatten_cells(cells, events.check)
+    count_polygons(cells, report)
+    return cells
+
+def incremental_parameters(layerstack, tolerance, hierarchy, merge, output_format, lod, region, tile_size,
+                           instances, streaming, engine):
+    """The manifest parameters (see gdsii_manifest) of every layer in layerstack."""
+    return {layer: layer_parameters(layerstack[layer], hierarchy=hierarchy, merge=merge,
+                                    output_format=output_format, lod=lod,
+                                    region=region, tile_size=tile_size, version=TRIANGULATION_VERSION,
+                                    **({} if tolerance(layer) is None else dict(simplify=tolerance(layer))),
+                                    **(dict(instances=True) if instances else {}),
+                                    **(dict(streaming=True) if streaming else {}),
+                                    **({} if engine == DEFAULT_ENGINE else dict(engine=engine)))
+            for layer in layerstack}
+
+def changed_layers(cells, layerstack, manifest, parameters, source, outputs, report):
+    """The part of layerstack whose polygons or settings changed since the manifest was saved.
+
+    The outputs of the other layers are taken from the manifest; the
+    changed layers get a new manifest entry, without output until it is
+    written.
+    """
+    report.start('check')
+    geometry = {layer: geometry_hash(cells, layer) for layer in layerstack}
+    changed_layerstack = {}
+    for layer in layerstack:
+        if layer_up_to_date(manifest, layer, parameters[layer], geometry=geometry[layer]):
+            output = manifest['layers'][str(layer)]['output']
+            print('    layer {} is unchanged, keeping {}'.format(layer, output or '(no geometry)'))
+            outputs[layer] = output
+            manifest['layers'][str(layer)]['source'] = source
+        else:
+            changed_layerstack[layer] = layerstack[layer]
+            # layers without any geometry get no file, but are remembered as well
+            manifest['layers'][str(layer)] = dict(source=source, geometry=geometry[layer],
+                                                  parameters=parameters[layer], output=None)
+    return changed_layerstack
+
+def merge_layers(cells, layerstack, events, report):
+    """Stage 'merge' of gdsiistl(): replace the polygons of each layer by their union."""
+    # Overlapping polygons (fill patterns, paths drawn over boxes, ...) give
+    # intersecting solids with hidden walls inside them. With merge=True the
+    # polygons of each layer are replaced by the outline of their union first
+    # (see gdsii_boolean); in hierarchy mode this is done within each cell.
+    print('Merging overlapping polygons...')
+    report.start('merge')
+    for layers, placements in cells:
+        for layer_number, (vertices, offsets) in layers.items():
+            if layer_number in layerstack.keys():
+                events.check()
+                report.layer(layer_number)
+                layers[layer_number] = merge_polygons(vertices, offsets)
+                report.count(layer_number, polygons=len(offsets)-1, merged_polygons=len(layers[layer_number][1])-1)
+                print('    layer {}: {} polygons merged into {}'.format(
+                    layer_number, len(offsets)-1, len(layers[layer_number][1])-1))
+
+def simplify_layers(cells, layerstack, tolerance, events, report):
+    """Stage 'simplify' of gdsiistl(): remove the vertices within tolerance(layer) of the outlines."""
+    # With simplify set, vertices that lie within the tolerance of the line
+    # between their neighbours are removed before triangulating (see
+    # gdsii_simplify), which makes curves much cheaper; holes are kept. In
+    # hierarchy mode this is done within each cell.
+    print('Simplifying polygons...')
+    report.start('simplify')
+    for layers, placements in cells:
+        for layer_number, (vertices, offsets) in layers.items():
+            if layer_number in layerstack.keys() and tolerance(layer_number):
+                events.check()
+                report.layer(layer_number)
+                layers[layer_number] = simplify_polygons(vertices, offsets, tolerance(layer_number))
+                report.count(layer_number, vertices=len(vertices), simplified_vertices=len(layers[layer_number][0]))
+    for layer in layerstack:
+        entry = report.stages['simplify']['layers'].get(str(layer))
+        if entry:
+            print('    layer {}: {} vertices simplified to {}'.format(layer, entry['vertices'], entry['simplified_vertices']))
+
+########## TRIANGULATION ######################################################
+
+# An STL file is a list of triangles, so the polygons need to be filled with
+# triangles. This is a surprisingly hard algorithmic problem, especially since
+# there are few limits on what shapes GDSII file polygons can be. So we use the
+# Python triangle library (documentation is at https://rufat.be/triangle/),
+# which is a Python interface to a fast and well-written C library also called
+# triangle (with documentation at https://www.cs.cmu.edu/~quake/triangle.html).
+# engine='earcut' clips ears off all polygons of a chunk at once instead,
+# which is much faster for small polygons, and engine='auto' uses it for
+# the small ones and triangle for the rest (see gdsii_triangulate).
+
+def triangulate_layers(cells, layerstack, workers, cache, engine, events, report):
+    """Stage 'triangulate' of gdsiistl(): inset and triangulate the polygons of the layers in layerstack.
+
+    Returns the cells, with layers[layer] = (inset vertices, offsets,
+    clockwise, triangulation), and the number of STL triangles of each layer.
+    """
+    print('Triangulating polygons...')
+
+    # The inset below is done in cell coordinates, so in hierarchy mode a
+    # magnified placement would magnify it as well. Cells placed with
+    # several magnifications are split per magnification, and each part is
+    # inset by delta/magnification to match the flattened layout.
+    cells = split_by_scale(cells)
+
+    num_triangles = {} # will store the number of triangles for each layer
+    if cache is True:
+        cache = TriangulationCache() # default cache folder next to this script
+    triangulation_paths = {} # will store how many polygons were filled in which way
+    # worker processes for the triangulation (workers=None uses all cores)
+    report.start('triangulate')
+    events.start('triangulate', sum(len(layers[layer][1])-1 for layers, _ in cells
+                                    for layer in layers if layer in layerstack))
+    with TriangulationPool(workers, engine=engine) as triangulator:
+
+        # loop through all cells and their layers
+        for layers, placements in cells:
+            for layer_number, (vertices, offsets) in layers.items():
+
+                # but skip layer if it won't be exported
+                if not layer_number in layerstack.keys():
+                    continue
+
+                def triangulated(count, layer=int(layer_number)):
+                    events.advance(count, layer=layer)
+                report.layer(layer_number)
+
+                # determine whether polygon points are CW or CCW
+                clockwise = signed_areas(vertices, offsets) > 0
+
+                # GDSII implements holes in polygons by making the polygon edge
+                # wrap into the hole and back out along the same line. However,
+                # this confuses the triangulation library, which fills the holes
+                # with extra triangles. Avoid this by moving each edge back a
+                # very small amount so that no two edges of the same polygon overlap.
+                delta = 0.01 # inset each vertex by this much (smaller has broken one file)
+                delta /= placement_scales(placements[:1])[0] # in layout units, see split_by_scale
+
+                # In an extreme case of the above, the polygon edge doubles back on
+                # itself on the same line, resulting in a zero-width segment. I've
+                # seen this happen, e.g., with a capital "N"-shaped hole, where
+                # the hole split line cuts out the "N" shape but splits apart to
+                # form the triangle cutout in one side of the shape. In any case,
+                # simply moving the polygon edges isn't enough to deal with this;
+                # we'll additionally mark points just outside of each edge, between
+                # the original edge and the delta-shifted edge, as outside the polygon.
+                # These parts will be removed from the triangulation, and this solves
+                # just this case with no adverse affects elsewhere.
+                hole_delta = 0.001 # small fraction of delta
+                inset, hole_points = inset_polygons(vertices, offsets, clockwise, delta, hole_delta)
+                # HOWEVER: sometimes this causes a segmentation fault in the triangle
+                # library. I've observed this as a result of certain various polygons.
+                # Frustratingly, the fault can be bypassed by *rotating the polygons*
+                # by like 30 degrees (exact angle seems to depend on delta values) or
+                # moving one specific edge outward a bit. I have absolutely no idea
+                # what is wrong. In the interest of stability over full functionality,
+                # this is disabled. TODO: figure out why this happens and fix it.
+                use_holes = False
+
+                # A triangulation only depends on the polygons and the inset
+                # parameters, so it can be taken from the cache when these
+                # polygons were triangulated before (e.g. when only heights
+                # changed). The cache keeps chunks of consecutive polygons, so
+                # after an edit only the chunks with changed polygons are missing.
+                chunks = cache.chunks(vertices, offsets, delta=delta, hole_delta=hole_delta,
+                                      use_holes=use_holes, engine=engine) if cache else [(0, len(offsets)-1, None)]
+                entries = [cache.get(key) if cache else None for _, _, key in chunks]
+                missing = np.zeros(len(offsets)-1, dtype=bool)
+                for (start, stop, _), entry in zip(chunks, entries):
+                    missing[start:stop] = entry is None
+                triangulated(len(missing) - missing.sum())
+                report.count(layer_number, cached_polygons=len(missing) - missing.sum())
+                if any(entry is None for entry in entries):
+                    # Most polygons are rectangles (boxes, paths) or otherwise convex.
+                    # Those are filled directly with a fan of triangles from their first
+                    # vertex; only the remaining ones need the triangle library.
+                    missing_inset, missing_offsets = select_polygons(inset, offsets, missing)
+                    convex, rectangles = classify_polygons(missing_inset, missing_offsets, clockwise[missing])
+                    fans = fan_triangulation(*select_polygons(missing_inset, missing_offsets, convex),
+                                             clockwise[missing][convex])
+                    triangulated(convex.sum())
+
+                    # triangulate: compute triangles to fill the other polygons. They
+                    # are sent in chunks to worker processes, so a segmentation fault in
+                    # the triangle library only takes down the worker (see gdsii_triangulate)
+                    others, other_offsets = select_polygons(missing_inset, missing_offsets, ~convex)
+                    other_holes = select_polygons(select_polygons(hole_points, offsets, missing)[0],
+                                                  missing_offsets, ~convex)[0] if use_holes else None
+                    before = {name: dict(stats) for name, stats in triangulator.stats.items()}
+                    triangulation = merge_triangulations(convex, fans,
+                        triangulator.triangulate(others, other_offsets, other_holes, triangulated))
+                    # polygons and seconds of each engine, for its throughput
+                    for name, stats in triangulator.stats.items():
+                        if stats['polygons'] > before[name]['polygons']:
+                            report.count(layer_number, **{f'{name}_{count}': stats[count] - before[name][count]
+                                                          for count in ('polygons', 'failed', 'seconds')})
+
+                    # split the new triangulations into the missing chunks
+                    first = 0
+                    for index, (start, stop, key) in enumerate(chunks):
+                        if entries[index] is not None:
+                            continue
+                        last = first + stop - start
+                        entries[index] = dict(triangulation_range(triangulation, first, last), paths=np.array([
+                            rectangles[first:last].sum(), (convex & ~rectangles)[first:last].sum(),
+                            (~convex)[first:last].sum()]))
+                        if cache:
+                            cache.put(key, entries[index])
+                        first = last
+                paths = sum(entry.pop('paths') for entry in entries)
+                triangulation = concatenate_triangulations(entries) if len(entries) > 1 else entries[0]
+
+                # count how many polygons took each path (rectangle, convex, triangle)
+                counts = triangulation_paths.setdefault(layer_number, np.zeros(3, dtype=np.int64))
+                counts += len(placements)*paths
+                report.count(layer_number, polygons=len(offsets)-1, rectangles=paths[0],
+                             convex_polygons=paths[1], triangulated_polygons=paths[2])
+
+                # every placement of the cell gets its own copy of the extrusion
+                num_triangles[layer_number] = num_triangles.get(layer_number, 0) + \
+                                            extrusion_size(offsets, triangulation)*len(placements)
+                layers[layer_number] = (inset, offsets, clockwise, triangulation)
+        report.layer(None) # the workers stop when leaving the pool
+        throughput = triangulator.throughput()
+        for name, stats in triangulator.stats.items():
+            if name in throughput:
+                print(f'    {name}: {stats["polygons"]} polygons in {stats["seconds"]:.2f} s '
+                      f'({throughput[name]:.0f} polygons/s per worker), {stats["failed"]} failed')
+
+    for layer_number, (rectangle_count, convex_count, other_count) in triangulation_paths.items():
+        print(f'    layer {layer_number}: {rectangle_count} rectangles and {convex_count} other convex '
+              f'polygons filled directly, {other_count} polygons triangulated')
+    if cache:
+        print(f'    {cache.hits} polygon chunks taken from the cache, {cache.misses} triangulated')
+        cache.trim()
+
+    """
+    At this point, each "layers" dictionary is as follows:
+
+    layers = {
+    0 : (vertices, offsets, clockwise,
+         {'vertices': [[x1, y1], ...], 'vertex_offsets': [...],
+          'triangles': [[0, 1, 2], ...], 'triangle_offsets': [...]}),
+    1 : ( ... )
+    2 : ( ... )
+    ...
+    }
+
+    Each dictionary key is a GDSII layer number (0-255), and the value holds
+    the polygons of that GDSII layer, packed: first, all (inset) vertices of
+    all polygons in one array, with "offsets" marking where each polygon
+    starts (see gdsii_geometry). Third, a boolean array that indicates whether
+    each polygon was defined clockwise (so that the STL triangles are oriented
+    correctly). Fourth and finally, the triangulation of the polygons: the
+    'vertices' element contains vertex information stored the same way as the
+    main polygon vertices, and the 'triangles' element is a list of which
+    vertices correspond to which triangle (in counterclockwise order), counted
+    from the first vertex of the polygon they belong to.
+    """
+    return cells, num_triangles
+
+########## EXTRUSION ##########################################################
+
+# Finally, now that we have polygon boundaries and triangulations, we can
+# write it to an STL file. To make this fast (given there could be tens of
+# thousands of triangles), we use the numpy-stl library, which uses numpy
+# for somewhat accelerated vector math. See the documentation at
+# (https://numpy-stl.readthedocs.io/en/latest/)
+
+def extrude_layer(cells, layer, num_triangles, zmin, zmax, events):
+    """The num_triangles STL records of one layer, as numpy-stl mesh data."""
+    # Make a list of triangles.
+    # This data contains vertex xyz position data as follows:
+    # layer_mesh_data['vectors'] = [ [[x1,y1,z1], [x2,y2,z1], [x3,y3,z3]], ...]
+    layer_mesh_data = np.zeros(num_triangles, dtype=mesh.Mesh.dtype)
+
+    layer_pointer = 0
+    for layers, placements in cells:
+        if not layer in layers:
+            continue
+
+        vertices, offsets, clockwise, triangulation = layers[layer]
+        size = extrusion_size(offsets, triangulation)*len(placements)
+        out = layer_mesh_data['vectors'][layer_pointer:(layer_pointer+size)]
+        if len(placements) == 1 and np.array_equal(placements[0], IDENTITY):
+            # extrude the polygons (side walls, top and bottom) straight into the layer mesh
+            extrude_polygons(*layers[layer], zmin, zmax, out=out)
+        else:
+            # extrude the polygons of the cell once, and add a copy of the
+            # triangles to the layer mesh for every placement
+            place_triangles(extrude_polygons(*layers[layer], zmin, zmax), placements, out)
+        layer_pointer += size
+        events.advance(size, layer=int(layer))
+    return layer_mesh_data
+
+def extrude_indexed_layer(cells, layer, zmin, zmax, events):
+    """The indexed mesh of one layer: (V, 3) float32 vertices and (T, 3) uint32 triangles."""
+    layer_points = []
+    layer_triangles = []
+    num_points = 0
+    for layers, placements in cells:
+        if not layer in layers:
+            continue
+        points, triangles = place_vertices(*extrude_indexed(*layers[layer], zmin, zmax), placements)
+        layer_points.append(points.astype(np.float32))
+        layer_triangles.append((triangles + num_points).astype(np.uint32))
+        num_points += len(points)
+        events.advance(len(triangles), layer=int(layer))
+    return np.concatenate(layer_points), np.concatenate(layer_triangles)
+
+def extrude_instances(cells, layer, zmin, zmax, events):
+    """The indexed mesh of every cell with the layer, once: lists of points, triangles and placements."""
+    cell_points = []
+    cell_triangles = []
+    cell_places = []
+    for layers, placements in cells:
+        if not layer in layers:
+            continue
+        points, triangles = extrude_indexed(*layers[layer], zmin, zmax)
+        cell_points.append(points.astype(np.float32))
+        cell_triangles.append(triangles.astype(np.uint32))
+        cell_places.append(placements)
+        events.advance(len(triangles)*len(placements), layer=int(layer))
+    return cell_points, cell_triangles, cell_places
+
+class LayerWriter:
+    """Stage 'write' of gdsiistl(): the files of each layer, with their report counts and manifest entries.
+
+    Every layer is written by one write_* method and then finished with
+    finish_layer(). The files written so far are listed in written, so that
+    a cancelled conversion can remove them again (remove_written), leaving
+    no mix of old and new layers behind; the manifest is not saved then, so
+    these layers are converted again next time.
+    """
+
+    def __init__(self, cells, output_folder, outputs, events, report, manifest=None, lod=False, tile_size=None):
+        self.cells = cells
+        self.output_folder = output_folder
+        self.outputs = outputs # layer: output file, filled in by finish_layer()
+        self.events = events
+        self.report = report
+        self.manifest = manifest # updated for incremental conversion (see gdsii_manifest)
+        self.lod = lod
+        self.tile_size = tile_size
+        self.written = []
+        self.first = 0 # index in written of the first file of the current layer
+
+    def _new_file(self, filename):
+        filename = output_path(self.output_folder, filename)
+        self.written.append(filename)
+        return filename
+
+    # the triangles of a layer are extruded (stage 'extrude') and then saved
+    # ('write'); the files of the layer are counted when it is finished
+    def extruding(self, layer):
+        self.report.start('extrude')
+        self.report.layer(layer)
+
+    def writing(self, layer, triangles):
+        self.report.count(layer, triangles=triangles)
+        self.report.start('write')
+        self.report.layer(layer)
+        self.first = len(self.written)
+
+    def finish_layer(self, layer, filename, zmin, zmax, layername):
+        """Record filename as the output of layer (report, outputs and manifest), and write its preview."""
+        self.report.count(layer, files=len(self.written)-self.first,
+                          bytes=sum(os.path.getsize(f) for f in self.written[self.first:]))
+        self.outputs[layer] = filename
+        if self.manifest is not None:
+            self.manifest['layers'][str(layer)]['output'] = filename
+        if self.lod:
+            self.write_lod(layer, zmin, zmax, layername)
+
+    def remove_written(self):
+        """Remove all files written so far."""
+        for filename in self.written:
+            if os.path.exists(filename):
+                os.remove(filename)
+        print('Cancelled, removed {} file(s) written by this conversion.'.format(len(self.written)))
+
+    # With lod=True each layer also gets a coarse preview, <layername>_lod.npz,
+    # in which all small polygons are merged into one box per tile (see
+    # gdsii_lod); bpy_import_stls.py opens it first and loads the full layer later.
+    def write_lod(self, layer, zmin, zmax, layername):
+        self.events.check()
+        self.report.start('lod')
+        self.report.layer(layer)
+        points, triangles = coarse_mesh(self.cells, layer, zmin, zmax)
+        filename = self._new_file(f'{layername}_lod.npz')
+        print('    ({}, {}) preview with {} triangles to {}'.format(layer, layername, len(triangles), filename))
+        np.savez(filename, vertices=points, triangles=triangles)
+        self.report.count(layer, triangles=len(triangles), bytes=os.path.getsize(filename))
+
+    # With tile_size set, each layer is written as a grid of tile files of
+    # tile_size x tile_size layout units (<layername>_tile_<column>_<row>.stl
+    # or .npz), listed with their bounds in <layername>_tiles.json, so that
+    # Blender can load just the tiles in view. Each triangle goes to the tile
+    # that holds its centroid.
+    def write_tiles(self, layer, layername, corners, save, extension):
+        index = dict(layer=int(layer), tile_size=self.tile_size, tiles=[])
+        for column, row, selection in triangle_tiles(corners, self.tile_size):
+            self.events.check()
+            filename = self._new_file(f'{layername}_tile_{column}_{row}.{extension}')
+            save(filename, selection)
+            tile_corners = corners[selection].reshape(-1, 3)
+            index['tiles'].append(dict(file=os.path.basename(filename), column=column, row=row,
+                                       triangles=len(selection),
+                                       bounds=tile_corners.min(axis=0).tolist() + tile_corners.max(axis=0).tolist()))
+        filename = self._new_file(f'{layername}_tiles.json')
+        print('    ({}, {}) as {} tiles to {}'.format(layer, layername, len(index['tiles']), filename))
+        with open(filename, 'w') as f:
+            json.dump(index, f, indent=1)
+        return filename
+
+    def write_stl(self, layer, layername, layer_mesh_data):
+        """Save the mesh data of a layer to an STL file (or files, one per tile)."""
+        self.writing(layer, len(layer_mesh_data))
+        if self.tile_size:
+            def save_tile(filename, selection):
+                mesh.Mesh(layer_mesh_data[selection], remove_empty_areas=False).save(filename)
+            return self.write_tiles(layer, layername, layer_mesh_data['vectors'], save_tile, 'stl')
+        filename = self._new_file(f'{layername}.stl')
+        print('    ({}, {}) to {}'.format(layer, layername, filename))
+        layer_mesh_object = mesh.Mesh(layer_mesh_data, remove_empty_areas=False)
+        layer_mesh_object.save(filename)
+        return filename
+
+    # With output_format='npz' every vertex is stored once and the triangles
+    # refer to it by index, instead of repeating three vertices and a normal
+    # in every STL triangle. The file holds two arrays, 'vertices' (V, 3)
+    # float32 and 'triangles' (T, 3) uint32, which bpy_import_stls.py loads
+    # straight into a Blender mesh.
+    def write_npz(self, layer, layername, layer_points, layer_triangles):
+        """Save the indexed mesh of a layer to an .npz file (or files, one per tile)."""
+        self.writing(layer, len(layer_triangles))
+        if self.tile_size:
+            def save_tile(filename, selection):
+                used, tile_triangles = np.unique(layer_triangles[selection], return_inverse=True)
+                np.savez(filename, vertices=layer_points[used],
+                         triangles=tile_triangles.reshape(-1, 3).astype(np.uint32))
+            return self.write_tiles(layer, layername, layer_points[layer_triangles], save_tile, 'npz')
+        filename = self._new_file(f'{layername}.npz')
+        print('    ({}, {}) to {}'.format(layer, layername, filename))
+        np.savez(filename, vertices=layer_points, triangles=layer_triangles)
+        return filename
+
+    # With instances=True each cell of the layer is extruded once, as an
+    # indexed mesh, and saved with the transforms of all places it is used,
+    # in <layername>_instances.npz, so that bpy_import_stls.py can build
+    # repeated cells and arrays from one mesh each (linked duplicates or
+    # geometry-node instances). The file holds, for all cells after each
+    # other: 'vertices' (V, 3) float32 and 'triangles' (T, 3) uint32
+    # (counted from the first vertex of their cell) with 'vertex_offsets'
+    # and 'triangle_offsets', and 'placements' (K, 3, 3) with
+    # 'placement_offsets' (see gdsii_hierarchy).
+    def write_instances(self, layer, layername, cell_points, cell_triangles, cell_places):
+        """Save the cell meshes of a layer with their placements to <layername>_instances.npz."""
+        self.writing(layer, sum(len(t) for t in cell_triangles))
+        self.report.count(layer, cells=len(cell_places), instances=sum(len(p) for p in cell_places))
+        filename = self._new_file(f'{layername}_instances.npz')
+        print('    ({}, {}) {} cells placed {} times to {}'.format(
+            layer, layername, len(cell_places), sum(len(p) for p in cell_places), filename))
+        def offsets_of(parts):
+            return np.cumsum([0] + [len(part) for part in parts]).astype(np.int64)
+        np.savez(filename, vertices=np.concatenate(cell_points), vertex_offsets=offsets_of(cell_points),
+                 triangles=np.concatenate(cell_triangles), triangle_offsets=offsets_of(cell_triangles),
+                 placements=np.concatenate(cell_places).astype(np.float64),
+                 placement_offsets=offsets_of(cell_places))
+        return filename
+
+    # With mapped_output=True the STL file is created at its final size
+    # and memory-mapped (see gdsii_stl), and the triangles are extruded
+    # straight into it, at most MAPPED_CHUNK_TRIANGLES at a time, so the
+    # memory used does not grow with the layer. The file is the same.
+    # Tiles need all triangles of the layer, so they are made by write_stl.
+    # Extruding and writing are one step here, counted as 'write'.
+    def write_mapped(self, layer, layername, num_triangles, zmin, zmax):
+        """Extrude a layer of num_triangles triangles straight into its memory-mapped STL file."""
+        self.writing(layer, num_triangles)
+        filename = self._new_file(f'{layername}.stl')
+        print('    ({}, {}) to {} (memory-mapped)'.format(layer, layername, filename))
+        stl_file = MappedStl(filename, num_triangles)
+        layer_pointer = 0
+        for layers, placements in self.cells:
+            if not layer in layers:
+                continue
+
+            vertices, offsets, clockwise, triangulation = layers[layer]
+            if len(placements) == 1 and np.array_equal(placements[0], IDENTITY):
+                for start, stop in extrusion_chunks(offsets, triangulation, MAPPED_CHUNK_TRIANGLES):
+                    self.events.check()
+                    chunk = (*polygon_range(vertices, offsets, start, stop), clockwise[start:stop],
+                             triangulation_range(triangulation, start, stop))
+                    size = extrusion_size(chunk[1], chunk[3])
+                    with stl_file.rows(layer_pointer, layer_pointer+size) as out:
+                        extrude_polygons(*chunk, zmin, zmax, out=out)
+                    layer_pointer += size
+                    self.events.advance(size, layer=int(layer))
+            else:
+                # extrude the cell once and write its copies in blocks of placements
+                faces = extrude_polygons(*layers[layer], zmin, zmax)
+                block = max(1, MAPPED_CHUNK_TRIANGLES // max(1, len(faces)))
+                for start in range(0, len(placements), block):
+                    self.events.check()
+                    size = len(faces)*len(placements[start:start+block])
+                    with stl_file.rows(layer_pointer, layer_pointer+size) as out:
+                        place_triangles(faces, placements[start:start+block], out)
+                    layer_pointer += size
+                    self.events.advance(size, layer=int(layer))
+        return filename
+
+def gdsiistl(gdsii_file_path, layerstack, workers=None, hierarchy=False, cache=False, incremental=False,
+             streaming=False, merge=False, output_format='stl', lod=False,
+             region=None, tile_size=None, progress=None, cancel=None, profile=False, geometry_cache=False,
+             mapped_output=False, simplify=None, instances=False, engine=DEFAULT_ENGINE, output_folder=None):
+    """Convert the layers in layerstack ({layer: (zmin, zmax, layername)}) of a GDSII file.
+
+    Returns the output file of each layer (None for a layer without
+    geometry). The stages are read_layout, crop_layout (with region),
+    merge_layers, simplify_layers, triangulate_layers and the extrude_*
+    functions with LayerWriter; the settings are explained where they are used.
+    """
+    outputs = {layer: None for layer in layerstack} # output file of each layer (None without geometry)
+
+    # the output files, manifest and report are written next to the GDSII
+    # file, or to output_folder (see gdsii_output_folders)
+    if output_folder is None:
+        output_folder = os.path.dirname(os.path.abspath(gdsii_file_path))
+    os.makedirs(output_folder, exist_ok=True)
+
+    # instances=True writes every cell once with the places it is used (see
+    # LayerWriter.write_instances), so the cell hierarchy is kept
+    if instances and not tile_size:
+        hierarchy = True
+
+    # progress (a callback) and cancel (a threading.Event) let a GUI follow
+    # and stop the conversion from another thread (see Progress)
+    events = Progress(progress, cancel)
+
+    # The wall and CPU time, counts and peak memory of every stage and layer
+    # are saved as a report next to the outputs (see gdsii_profile); with
+    # profile=True the slowest stage is also profiled with cProfile.
+    report = ConversionReport(gdsii_file_path, dict(
+        workers=workers, hierarchy=hierarchy, cache=bool(cache), geometry_cache=bool(geometry_cache),
+        incremental=incremental,
+        streaming=streaming, merge=merge, output_format=output_format, mapped_output=mapped_output, lod=lod,
+        region=None if region is None else list(region), tile_size=tile_size,
+        simplify=simplify if not isinstance(simplify, dict) else {str(l): t for l, t in simplify.items()},
+        instances=instances, engine=engine), profile, output_folder)
+
+    # simplify is a tolerance in layout units for all layers, or a dictionary
+    # of tolerances per layer (layers that are not in it are not simplified)
+    def tolerance(layer):
+        return simplify.get(layer) if isinstance(simplify, dict) else simplify
+
+    # With incremental=True a manifest next to the STL files records what each
+    # layer was made from (see gdsii_manifest). Layers whose GDSII file or
+    # polygons and settings did not change since then are not converted again.
+    manifest = None
+    if incremental:
+        report.start('check')
+        manifest_path = output_path(output_folder, MANIFEST_NAME)
+        manifest = load_manifest(manifest_path)
+        source = file_fingerprint(gdsii_file_path, manifest)
+        parameters = incremental_parameters(layerstack, tolerance, hierarchy, merge, output_format, lod,
+                                            region, tile_size, instances, streaming, engine)
+        if all(layer_up_to_date(manifest, layer, parameters[layer], source=source) for layer in layerstack):
+            print('All layers are up to date with {}.'.format(gdsii_file_path))
+            outputs = {layer: manifest['layers'][str(layer)]['output'] for layer in layerstack}
+            report.save('up to date', outputs)
+            print('Done.')
+            return outputs
+
+    # A region is cropped before the layout is flattened, so the cells are
+    # read with their hierarchy then.
+    cells = read_layout(gdsii_file_path, layerstack, hierarchy or region is not None, streaming,
+                        geometry_cache, events, report)
+    if region is not None:
+        cells = crop_layout(cells, region, hierarchy, events, report)
+
+    num_polygons = sum(len(offsets)-1 for layers, _ in cells for offsets in (l[1] for l in layers.values()))
+    events.start('read', num_polygons)
+    events.advance(num_polygons)
+
+    if incremental:
+        # skip the layers whose polygons and settings are the same as last time
+        layerstack = changed_layers(cells, layerstack, manifest, parameters, source, outputs, report)
+    if merge:
+        merge_layers(cells, layerstack, events, report)
+    if any(tolerance(layer) for layer in layerstack):
+        simplify_layers(cells, layerstack, tolerance, events, report)
+    cells, num_triangles = triangulate_layers(cells, layerstack, workers, cache, engine, events, report)
+
+    print('Extruding polygons and writing to files...')
+    events.start('write', sum(num_triangles.values()))
+    writer = LayerWriter(cells, output_folder, outputs, events, report, manifest, lod, tile_size)
+    try:
+        # loop through all layers that will be exported
+        for layer in num_triangles:
+            zmin, zmax, layername = layerstack[layer]
+            writer.extruding(layer)
+            if instances and not tile_size:
+                filename = writer.write_instances(layer, layername, *extrude_instances(cells, layer, zmin, zmax, events))
+            elif output_format == 'npz':
+                filename = writer.write_npz(layer, layername, *extrude_indexed_layer(cells, layer, zmin, zmax, events))
+            elif mapped_output and not tile_size:
+                filename = writer.write_mapped(layer, layername, num_triangles[layer], zmin, zmax)
+            else:
+                filename = writer.write_stl(layer, layername,
+                                            extrude_layer(cells, layer, num_triangles[layer], zmin, zmax, events))
+            writer.finish_layer(layer, filename, zmin, zmax, layername)
+    except ConversionCancelled:
+        writer.remove_written()
+        raise
+
+    if incremental:
+        save_manifest(manifest_path, manifest)
+
+    print('Report saved to {}'.format(report.save('done', outputs)))
+    print('Done.')
+    return outputs
+
+def _job_main(connection, gdsii_file_path, layerstack, settings):
+    # one conversion of the job queue, in its own process; stdout is kept
+    # free for the summary
+    sys.stdout = sys.stderr
+    start = time.perf_counter()
+    try:
+        outputs = gdsiistl(gdsii_file_path, layerstack, **settings)
+        result = dict(status='ok', outputs={str(layer): filename for layer, filename in outputs.items()},
+                      report=report_path(gdsii_file_path, settings.get('output_folder')))
+    except Exception as error:
+        result = dict(status='failed', error='{}: {}'.format(type(error).__name__, error))
+    result['seconds'] = time.perf_counter() - start
+    connection.send(result)
+    connection.close()
+
+def run_jobs(jobs, processes=1):
+    """Run gdsiistl() for every (gdsii_file_path, layerstack, settings) job.
+
+    Up to processes conversions run at the same time, each in its own
+    process, so a crash only fails its own job. Returns one result dictionary
+    per job, in order: gds, status ('ok' or 'failed'), seconds and outputs
+    (layer: file) and report (see gdsii_profile), or error.
+    """
+    context = multiprocessing.get_context('spawn')
+    pending = list(enumerate(jobs))
+    running = {} # connection: (job index, process, start time)
+    results = [None]*len(jobs)
+    while pending or running:
+        while pending and len(running) < processes:
+            index, (gdsii_file_path, layerstack, settings) = pending.pop(0)
+            print('Starting job {} of {}: {}'.format(index+1, len(jobs), gdsii_file_path), file=sys.stderr)
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=_job_main, args=(sender, gdsii_file_path, layerstack, settings))
+            process.start()
+            sender.close()
+            running[receiver] = (index, process, time.perf_counter())
+
+        for receiver in wait(list(running)):
+            index, process, start = running.pop(receiver)
+            try:
+                result = receiver.recv()
+            except EOFError: # the process died without an answer
+                result = dict(status='failed', error='conversion process crashed',
+                              seconds=time.perf_counter() - start)
+            receiver.close()
+            process.join()
+            results[index] = dict(gds=jobs[index][0], **result)
+            print('Finished job {} of {} ({})'.format(index+1, len(jobs), result['status']), file=sys.stderr)
+    return results
+
+def gdsii_files(paths):
+    """Expand folders in paths to the .gds files in them (and their subfolders)."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '**', '*.gds'), recursive=True)))
+        else:
+            files.append(path)
+    return files
+
+def gdsii_output_folders(files):
+    """The output folder of each GDSII file of a batch (None: next to the file).
+
+    The layer files and the manifest are named after the layers only, so
+    files that share their folder with another file of the batch are each
+    written to a subfolder named after them (chip.gds to chip/) instead.
+    """
+    folders = [os.path.dirname(os.path.abspath(f)) for f in files]
+    counts = collections.Counter(folders)
+    return [os.path.join(folder, os.path.splitext(os.path.basename(f))[0]) if counts[folder] > 1 else None
+            for f, folder in zip(files, folders)]
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    parser = argparse.ArgumentParser(description='Convert GDSII files to STL files without the GUI.')
+    parser.add_argument('session', help='saved session (saved/*.txt) with the layer stack')
+    parser.add_argument('gds', nargs='*', help='GDSII files or folders (default: the file of the session); '
+                        'files that share a folder are written to a subfolder named after each file')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of files converted at the same time')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='triangulation processes per file (default: all cores shared by the jobs)')
+    parser.add_argument('--hierarchy', action='store_true', help='triangulate each referenced cell once')
+    parser.add_argument('--merge', action='store_true', help='merge overlapping polygons of each layer')
+    parser.add_argument('--engine', choices=sorted(ENGINES) + ['auto'], default=DEFAULT_ENGINE,
+                        help=f'triangulation engine (default: {DEFAULT_ENGINE}; auto: earcut for small polygons, '
+                             'triangle for the rest)')
+    parser.add_argument('--simplify', type=float, metavar='TOLERANCE',
+                        help='remove vertices within this distance of the outline (layout units)')
+    parser.add_argument('--simplify-layer', type=float, nargs=2, action='append', metavar=('LAYER', 'TOLERANCE'),
+                        help='simplification tolerance of one layer (repeatable; overrides --simplify)')
+    parser.add_argument('--format', choices=('stl', 'npz'), default='stl', help='output mesh format')
+    parser.add_argument('--mapped-output', action='store_true',
+                        help='write STL files chunk by chunk through a memory map (bounded memory)')
+    parser.add_argument('--instances', action='store_true',
+                        help='write each cell once with its placements, for instancing in Blender')
+    parser.add_argument('--lod', action='store_true', help='also write coarse preview meshes')
+    parser.add_argument('--region', type=float, nargs=4, metavar=('XMIN', 'YMIN', 'XMAX', 'YMAX'),
+                        help='only convert this part of the layout (layout units)')
+    parser.add_argument('--tile-size', type=float, help='write each layer as tiles of this size (layout units)')
+    parser.add_argument('--no-cache', action='store_true', help='do not reuse cached triangulations')
+    parser.add_argument('--no-geometry-cache', action='store_true', help='always read the layers from the GDSII file')
+    parser.add_argument('--no-incremental', action='store_true', help='convert all layers, also unchanged ones')
+    parser.add_argument('--streaming', action='store_true',
+                        help='read files with the fast reader (only the selected layers) instead of gdspy')
+    parser.add_argument('--profile', action='store_true', help='save a cProfile dump of the slowest stage')
+    parser.add_argument('--summary', help='also write the JSON summary to this file')
+    args = parser.parse_args()
+
+    session_gds, rows = read_session(args.session)
+    layerstack = session_layerstack(rows)
+    files = gdsii_files(args.gds) if args.gds else [session_gds]
+    processes = max(1, min(args.jobs, len(files)))
+    simplify = args.simplify
+    if args.simplify_layer:
+        simplify = {layer: args.simplify for layer in layerstack}
+        simplify.update({int(layer): value for layer, value in args.simplify_layer})
+    workers = args.workers
+    if workers is None and processes > 1:
+        workers = max(1, (os.cpu_count() or 1) // processes)
+    settings = dict(workers=workers, hierarchy=args.hierarchy, cache=not args.no_cache,
+                    geometry_cache=not args.no_geometry_cache,
+                    incremental=not args.no_incremental, streaming=args.streaming,
+                    merge=args.merge, engine=args.engine, simplify=simplify, output_format=args.format, mapped_output=args.mapped_output,
+                    instances=args.instances, lod=args.lod,
+                    region=args.region, tile_size=args.tile_size, profile=args.profile)
+
+    start = time.perf_counter()
+    results = run_jobs([(f, layerstack, dict(settings, output_folder=folder))
+                        for f, folder in zip(files, gdsii_output_folders(files))], processes)
+    summary = dict(session=args.session, layers=sorted(layerstack), settings=settings, jobs=results,
+                   ok=sum(r['status'] == 'ok' for r in results),
+                   failed=sum(r['status'] != 'ok' for r in results),
+                   seconds=time.perf_counter() - start)
+    print(json.dumps(summary, indent=1))
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump(summary, f, indent=1)
+    sys.exit(1 if summary['failed'] else 0)
@@ -0,0 +1,51 @@
+'''Several GDSII files in one folder are converted without overwriting each other.'''
+
+import os
+
+import pytest
+
+gdspy = pytest.importorskip('gdspy')
+
+from gdsiistl import gdsiistl, gdsii_output_folders
+from gdsii_manifest import MANIFEST_NAME
+from gdsii_profile import report_path
+
+LAYERSTACK = {1: (0, 1, 'metal')}
+
+def write_gds(path, size):
+    library = gdspy.GdsLibrary()
+    cell = gdspy.Cell('TOP', exclude_from_current=True)
+    library.add(cell.add(gdspy.Rectangle((0, 0), (size, size), layer=1)))
+    library.write_gds(path)
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()[80:] # after the header, which holds the date
+
+def test_files_in_one_folder(tmp_path):
+    files = [str(tmp_path / 'a.gds'), str(tmp_path / 'b.gds')]
+    for size, path in zip((1, 2), files):
+        write_gds(path, size)
+    folders = gdsii_output_folders(files)
+    assert folders == [str(tmp_path / 'a'), str(tmp_path / 'b')]
+
+    def convert(index):
+        return gdsiistl(files[index], LAYERSTACK, workers=1, incremental=True, output_folder=folders[index])[1]
+    first = convert(0)
+    converted = read(first)
+    second = convert(1)
+    assert first != second
+    assert read(first) == converted # b did not overwrite a
+    assert read(second) != converted
+    for path, folder in zip(files, folders):
+        assert os.path.exists(os.path.join(folder, MANIFEST_NAME))
+        assert os.path.exists(report_path(path, folder))
+
+    # a changed file is converted again, even though the other one is up to date
+    write_gds(files[0], 3)
+    assert convert(0) == first
+    assert read(first) not in (converted, read(second))
+
+def test_files_in_their_own_folders(tmp_path):
+    files = [str(tmp_path / 'a.gds'), str(tmp_path / 'sub' / 'b.gds')]
+    assert gdsii_output_folders(files) == [None, None]
@@ -0,0 +1,79 @@
+'''Ear clipping (gdsii_earcut) against the triangle library.'''
+
+import numpy as np
+import pytest
+
+gdspy = pytest.importorskip('gdspy')
+pytest.importorskip('triangle')
+
+from gdsiistl import gdsiistl
+from gdsii_earcut import earcut_polygons
+from gdsii_geometry import pack_polygons, signed_areas, inset_polygons
+from gdsii_triangulate import TriangulationPool
+
+STL_RECORD = np.dtype([('normal', '<f4', (3,)), ('corners', '<f4', (3, 3)), ('attribute', '<u2')])
+
+def triangle_areas(triangulation):
+    # area covered by the triangles of each polygon
+    areas = []
+    for p in range(len(triangulation['vertex_offsets'])-1):
+        vertices = triangulation['vertices'][triangulation['vertex_offsets'][p]:triangulation['vertex_offsets'][p+1]]
+        (ax, ay), (bx, by), (cx, cy) = np.moveaxis(vertices[triangulation['triangles'][
+            triangulation['triangle_offsets'][p]:triangulation['triangle_offsets'][p+1]]], 1, 0).transpose(0, 2, 1)
+        areas.append(np.abs((bx-ax)*(cy-ay) - (by-ay)*(cx-ax)).sum()/2)
+    return np.array(areas)
+
+def random_polygons(count, seed=0):
+    # star shapes (not convex), with an L shape and a square with a hole
+    # (cut line to the hole and back, as in GDSII) among them
+    rng = np.random.default_rng(seed)
+    polygons = [np.array([(0, 0), (3, 0), (3, 1), (1, 1), (1, 3), (0, 3)], dtype=np.float64),
+                np.array([(0, 0), (4, 0), (4, 4), (0, 4), (0, 2), (1, 2), (1, 3), (3, 3), (3, 1),
+                          (1, 1), (1, 2), (0, 2)], dtype=np.float64)]
+    for _ in range(count):
+        corners = rng.integers(5, 40)
+        angles = (np.arange(corners) + rng.uniform(0, 0.9, corners))*2*np.pi/corners # simple outlines
+        radii = rng.uniform(0.3, 1, corners)
+        polygons.append(np.stack((radii*np.cos(angles), radii*np.sin(angles)), axis=1))
+    return polygons
+
+def test_areas_match_triangle():
+    vertices, offsets = pack_polygons(random_polygons(300))
+    clockwise = signed_areas(vertices, offsets) > 0
+    inset, _ = inset_polygons(vertices, offsets, clockwise, 0.001)
+    areas = np.abs(signed_areas(inset, offsets))/2
+    earcut, failed = earcut_polygons(inset, offsets)
+    assert not failed.any()
+    with TriangulationPool(0, engine='triangle') as pool:
+        reference = pool.triangulate(inset, offsets)
+    np.testing.assert_allclose(triangle_areas(earcut), areas, rtol=1e-9)
+    np.testing.assert_allclose(triangle_areas(reference), areas, rtol=1e-9)
+
+def test_failed_polygons_go_to_triangle():
+    # a bow tie crosses itself: its ears do not add up to its area
+    bow_tie = np.array([(0, 0), (2, 2), (2, 0), (0, 2)], dtype=np.float64)
+    vertices, offsets = pack_polygons([bow_tie, np.array([(3, 0), (4, 0), (4, 1), (3, 1)], dtype=np.float64)])
+    triangulation, failed = earcut_polygons(vertices, offsets)
+    assert failed.tolist() == [True, False]
+    assert triangulation['triangle_offsets'][1] == 0 # no triangles for the failed polygon
+    with TriangulationPool(0, engine='earcut') as pool:
+        retried = pool.triangulate(vertices, offsets)
+        assert (pool.stats['earcut']['failed'], pool.stats['triangle']['polygons']) == (1, 1)
+    np.testing.assert_allclose(triangle_areas(retried), [2, 1])
+
+def stl_volume(filename):
+    corners = np.fromfile(filename, dtype=STL_RECORD, offset=84)['corners'].astype(np.float64)
+    return np.einsum('ij,ij->i', corners[:, 0], np.cross(corners[:, 1], corners[:, 2])).sum()/6
+
+def test_engines_give_the_same_volume(tmp_path):
+    cell = gdspy.Cell('TOP', exclude_from_current=True)
+    for index, polygon in enumerate(random_polygons(100, seed=1)):
+        cell.add(gdspy.Polygon(polygon + (3*(index % 10), 3*(index // 10)), layer=1))
+    library = gdspy.GdsLibrary()
+    library.add(cell)
+    path = str(tmp_path / 'stars.gds')
+    library.write_gds(path)
+    volumes = [stl_volume(gdsiistl(path, {1: (0, 1, 'metal')}, workers=0, engine=engine)[1])
+               for engine in ('triangle', 'earcut', 'auto')]
+    assert volumes[1] == pytest.approx(volumes[0], rel=1e-9)
+    assert volumes[2] == pytest.approx(volumes[0], rel=1e-9)
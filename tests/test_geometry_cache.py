@@ -0,0 +1,79 @@
+'''The geometry cache (gdsii_cache.GeometryCache) and its use by gdsiistl().'''
+
+import os
+
+import numpy as np
+import pytest
+
+gdspy = pytest.importorskip('gdspy')
+
+from gdsiistl import gdsiistl
+from gdsii_cache import GeometryCache
+from gdsii_geometry import pack_polygons
+
+def write_gds(path, width=1):
+    cell = gdspy.Cell('TOP', exclude_from_current=True)
+    cell.add(gdspy.Rectangle((0, 0), (width, 1), layer=1))
+    cell.add(gdspy.Polygon([(0, 2), (3, 2), (3, 3), (1, 3), (1, 5), (0, 5)], layer=2))
+    library = gdspy.GdsLibrary()
+    library.add(cell)
+    library.write_gds(path)
+
+def test_hit_miss_and_trim(tmp_path):
+    cache = GeometryCache(str(tmp_path / 'cache'))
+    path = str(tmp_path / 'a.gds')
+    write_gds(path)
+    key = cache.key(path, streaming=True, hierarchy=False)
+    assert cache.key(path, streaming=False, hierarchy=False) != key
+    assert cache.get(key, [1, 2]) == ([], [1, 2])
+
+    square = pack_polygons([np.array([(0, 0), (1, 0), (1, 1), (0, 1)], dtype=np.float64)])
+    placements = np.repeat(np.eye(3)[None], 2, axis=0)
+    cache.put(key, [({1: square}, placements)], [1, 3]) # layer 3 has no geometry
+    cells, missing = cache.get(key, [1, 2, 3])
+    assert missing == [2]
+    (layers, stored_placements), = cells
+    np.testing.assert_array_equal(layers[1][0], square[0])
+    np.testing.assert_array_equal(layers[1][1], square[1])
+    np.testing.assert_array_equal(stored_placements, placements)
+
+    # another file is another entry; trim removes the least recently used one
+    other = str(tmp_path / 'b.gds')
+    write_gds(other, width=2)
+    other_key = cache.key(other, streaming=True, hierarchy=False)
+    cache.put(other_key, [({1: square}, placements)], [1])
+    os.utime(os.path.join(cache.path, key, 'layers.json'), (1000, 1000))
+    cache.max_bytes = cache.size() - 1
+    cache.trim()
+    assert cache.get(key, [1])[1] == [1]
+    assert cache.get(other_key, [1])[1] == []
+
+def test_edited_file_gets_a_new_key(tmp_path):
+    cache = GeometryCache(str(tmp_path / 'cache'))
+    path = str(tmp_path / 'a.gds')
+    write_gds(path)
+    key = cache.key(path, streaming=True, hierarchy=False)
+    assert cache.key(path, streaming=True, hierarchy=False) == key
+    write_gds(path, width=2)
+    os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 10**9))
+    assert cache.key(path, streaming=True, hierarchy=False) != key
+
+@pytest.mark.parametrize('streaming', [False, True])
+@pytest.mark.parametrize('hierarchy', [False, True])
+def test_conversion_reads_only_new_layers(tmp_path, streaming, hierarchy):
+    path = str(tmp_path / 'a.gds')
+    write_gds(path)
+    cache = GeometryCache(str(tmp_path / 'cache'))
+    settings = dict(workers=0, streaming=streaming, hierarchy=hierarchy)
+    expected = {}
+    for layer in (1, 2):
+        with open(gdsiistl(path, {layer: (0, 1, f'l{layer}')}, **settings)[layer], 'rb') as f:
+            expected[layer] = f.read()[80:]
+    gdsiistl(path, {1: (0, 1, 'l1')}, geometry_cache=cache, **settings)
+    key = cache.key(path, streaming=streaming, hierarchy=hierarchy)
+    assert cache.get(key, [1, 2])[1] == [2]
+    outputs = gdsiistl(path, {1: (0, 1, 'l1'), 2: (0, 1, 'l2')}, geometry_cache=cache, **settings)
+    assert cache.get(key, [1, 2])[1] == []
+    for layer in (1, 2):
+        with open(outputs[layer], 'rb') as f:
+            assert f.read()[80:] == expected[layer]
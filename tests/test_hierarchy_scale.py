@@ -0,0 +1,44 @@
+'''Hierarchy mode gives the same solids as flattening, also for magnified placements.'''
+
+import numpy as np
+import pytest
+
+gdspy = pytest.importorskip('gdspy')
+
+from gdsiistl import gdsiistl
+from gdsii_hierarchy import linear_transform, placement_matrices, split_by_scale
+
+STL_RECORD = np.dtype([('normal', '<f4', (3,)), ('corners', '<f4', (3, 3)), ('attribute', '<u2')])
+
+def stl_volume(filename):
+    corners = np.fromfile(filename, dtype=STL_RECORD, offset=84)['corners'].astype(np.float64)
+    return np.einsum('ij,ij->i', corners[:, 0], np.cross(corners[:, 1], corners[:, 2])).sum()/6
+
+def write_gds(path):
+    child = gdspy.Cell('CHILD', exclude_from_current=True)
+    child.add(gdspy.Polygon([(0, 0), (3, 0), (3, 1), (1, 1), (1, 3), (0, 3)], layer=1))
+    child.add(gdspy.Rectangle((4, 0), (5, 2), layer=1))
+    top = gdspy.Cell('TOP', exclude_from_current=True)
+    top.add(gdspy.CellReference(child, (0, 0)))
+    top.add(gdspy.CellReference(child, (10, 0), magnification=2.5, rotation=30))
+    top.add(gdspy.CellReference(child, (30, 0), magnification=0.5, x_reflection=True))
+    top.add(gdspy.CellArray(child, 3, 2, (8, 8), (0, 20), magnification=1.5))
+    library = gdspy.GdsLibrary()
+    library.add([child, top])
+    library.write_gds(path)
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_magnified_placements(tmp_path, streaming):
+    path = str(tmp_path / 'cells.gds')
+    write_gds(path)
+    volumes = [stl_volume(gdsiistl(path, {1: (0, 1, 'metal')}, workers=1, hierarchy=hierarchy,
+                                   streaming=streaming)[1])
+               for hierarchy in (False, True)]
+    assert volumes[1] == pytest.approx(volumes[0], rel=1e-9)
+
+def test_rotations_round_to_one_scale():
+    # rotated placements have magnifications that differ only by rounding
+    placements = np.concatenate([placement_matrices((column, 0), linear_transform(rotation, magnification))
+                                 for column, (rotation, magnification) in
+                                 enumerate([(0, 1), (30, 1), (45, 1), (0, 2), (60, 2)])])
+    assert [len(part) for _, part in split_by_scale([({}, placements)])] == [3, 2]
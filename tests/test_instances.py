@@ -0,0 +1,58 @@
+'''Cells written once with their placements (gdsiistl(..., instances=True)).'''
+
+import numpy as np
+import pytest
+
+gdspy = pytest.importorskip('gdspy')
+
+from gdsiistl import gdsiistl
+
+STL_RECORD = np.dtype([('normal', '<f4', (3,)), ('corners', '<f4', (3, 3)), ('attribute', '<u2')])
+
+def write_gds(path):
+    child = gdspy.Cell('CHILD', exclude_from_current=True)
+    child.add(gdspy.Polygon([(0, 0), (3, 0), (3, 1), (1, 1), (1, 3), (0, 3)], layer=1))
+    top = gdspy.Cell('TOP', exclude_from_current=True)
+    top.add(gdspy.Rectangle((-5, -5), (-4, -4), layer=1))
+    top.add(gdspy.CellReference(child, (10, 0), rotation=90))
+    top.add(gdspy.CellReference(child, (20, 0), magnification=2, x_reflection=True))
+    top.add(gdspy.CellArray(child, 5, 4, (4, 4), (0, 20)))
+    library = gdspy.GdsLibrary()
+    library.add([child, top])
+    library.write_gds(path)
+
+def volume(corners):
+    return np.einsum('ij,ij->i', corners[:, 0], np.cross(corners[:, 1], corners[:, 2])).sum()/6
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'cells.gds')
+    write_gds(path)
+    flat = np.fromfile(gdsiistl(path, {1: (0, 1, 'metal')}, workers=0)[1],
+                       dtype=STL_RECORD, offset=84)['corners'].astype(np.float64)
+
+    with np.load(gdsiistl(path, {1: (0, 1, 'metal')}, workers=0, instances=True)[1]) as data:
+        cells = {name: data[name] for name in data.files}
+    num_cells = len(cells['vertex_offsets'])-1
+    assert num_cells == 3 # TOP, and CHILD once per magnification
+    assert sorted(np.diff(cells['placement_offsets'])) == [1, 1, 21]
+
+    placed = []
+    total_volume = 0.0
+    for cell in range(num_cells):
+        vertices = cells['vertices'][cells['vertex_offsets'][cell]:cells['vertex_offsets'][cell+1]].astype(np.float64)
+        triangles = cells['triangles'][cells['triangle_offsets'][cell]:cells['triangle_offsets'][cell+1]]
+        placements = cells['placements'][cells['placement_offsets'][cell]:cells['placement_offsets'][cell+1]]
+        assert triangles.max() < len(vertices) # counted from the first vertex of the cell
+        corners = vertices[triangles]
+        for placement in placements:
+            moved = corners.copy()
+            moved[..., :2] = corners[..., :2] @ placement[:2, :2].T + placement[:2, 2]
+            placed.append(moved)
+            total_volume += volume(corners)*abs(np.linalg.det(placement[:2, :2]))
+    placed = np.concatenate(placed)
+
+    assert len(placed) == len(flat)
+    assert total_volume == pytest.approx(volume(flat), rel=1e-6)
+    # the same corners, up to the float32 precision of the files
+    key = lambda corners: np.unique(np.round(corners.reshape(-1, 3), 3), axis=0)
+    np.testing.assert_array_equal(key(placed), key(flat))
@@ -0,0 +1,39 @@
+'''Coarse previews of layers (gdsii_lod.coarse_mesh, gdsiistl(..., lod=True)).'''
+
+import numpy as np
+import pytest
+
+gdspy = pytest.importorskip('gdspy')
+
+from gdsiistl import gdsiistl
+
+STL_RECORD = np.dtype([('normal', '<f4', (3,)), ('corners', '<f4', (3, 3)), ('attribute', '<u2')])
+
+def write_gds(path):
+    # a large pad and, in an array of cells, many small squares
+    dots = gdspy.Cell('DOTS', exclude_from_current=True)
+    for index in range(100):
+        dots.add(gdspy.Round((index % 10, index // 10), 0.2, layer=1, tolerance=0.01))
+    top = gdspy.Cell('TOP', exclude_from_current=True)
+    top.add(gdspy.Rectangle((-50, -50), (-10, 2000), layer=1))
+    top.add(gdspy.CellArray(dots, 10, 10, (20, 20), rotation=90, origin=(150, 0)))
+    library = gdspy.GdsLibrary()
+    library.add([dots, top])
+    library.write_gds(path)
+
+@pytest.mark.parametrize('hierarchy', [False, True])
+def test_preview_bounds(tmp_path, hierarchy):
+    path = str(tmp_path / 'a.gds')
+    write_gds(path)
+    full = gdsiistl(path, {1: (2, 5, 'metal')}, workers=0, hierarchy=hierarchy, lod=True)[1]
+    corners = np.fromfile(full, dtype=STL_RECORD, offset=84)['corners'].reshape(-1, 3)
+    with np.load(str(tmp_path / 'metal_lod.npz')) as data:
+        points, triangles = data['vertices'], data['triangles']
+
+    # the preview spans the layer, from zmin to zmax, with far fewer triangles
+    np.testing.assert_allclose(points.min(axis=0), corners.min(axis=0), atol=1e-4)
+    np.testing.assert_allclose(points.max(axis=0), corners.max(axis=0), atol=1e-4)
+    assert triangles.max() < len(points)
+    assert len(triangles) < len(corners)//3 // 10
+    # the pad is kept as it is (inset like all polygons)
+    assert np.any(np.hypot(points[:, 0] + 10, points[:, 1] - 2000) < 0.05)
@@ -0,0 +1,70 @@
+'''Incremental conversion: the manifest (gdsii_manifest) and which layers gdsiistl() converts again.'''
+
+import os
+
+import numpy as np
+import pytest
+
+gdspy = pytest.importorskip('gdspy')
+
+from gdsiistl import gdsiistl, output_path
+from gdsii_manifest import MANIFEST_NAME, load_manifest, file_fingerprint, layer_parameters, layer_up_to_date
+
+OLD = 10**18 # ns; an mtime that a rewritten file no longer has
+
+def write_gds(path, width=1):
+    cell = gdspy.Cell('TOP', exclude_from_current=True)
+    cell.add(gdspy.Rectangle((0, 0), (1, 1), layer=1))
+    cell.add(gdspy.Rectangle((0, 2), (width, 3), layer=2))
+    library = gdspy.GdsLibrary()
+    library.add(cell)
+    library.write_gds(path)
+
+def edit(path, width):
+    # rewrite the file with a modification time that surely differs
+    stat = os.stat(path)
+    write_gds(path, width)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+def test_layer_up_to_date(tmp_path):
+    path = str(tmp_path / 'a.gds')
+    write_gds(path)
+    output = str(tmp_path / 'a_1.stl')
+    open(output, 'wb').close()
+    source = file_fingerprint(path)
+    parameters = layer_parameters((0, 100, 'metal'), hierarchy=False)
+    manifest = dict(version=1, layers={'1': dict(source=source, geometry='g', parameters=parameters, output=output)})
+    assert layer_up_to_date(manifest, 1, parameters, source=source, geometry='g')
+    assert file_fingerprint(path, manifest)['hash'] == source['hash']
+
+    assert not layer_up_to_date(manifest, 2, parameters) # never converted
+    assert not layer_up_to_date(manifest, 1, layer_parameters((0, 120, 'metal'), hierarchy=False)) # other height
+    assert not layer_up_to_date(manifest, 1, parameters, geometry='other') # other polygons
+    edit(path, 2)
+    assert not layer_up_to_date(manifest, 1, parameters, source=file_fingerprint(path, manifest))
+    os.remove(output)
+    assert not layer_up_to_date(manifest, 1, parameters)
+
+def test_only_changed_layers_are_converted(tmp_path):
+    path = str(tmp_path / 'a.gds')
+    write_gds(path)
+    layerstack = {1: (0, 1, 'one'), 2: (0, 1, 'two')}
+
+    def convert():
+        # the layers whose files were written
+        outputs = gdsiistl(path, layerstack, workers=0, incremental=True)
+        written = sorted(layer for layer, output in outputs.items() if os.stat(output).st_mtime_ns != OLD)
+        for output in outputs.values():
+            os.utime(output, ns=(OLD, OLD))
+        return written
+
+    assert convert() == [1, 2]
+    assert convert() == [] # unchanged file: not even read
+    layerstack[1] = (0, 2, 'one')
+    assert convert() == [1] # other height
+    edit(path, 2)
+    assert convert() == [2] # other polygons on layer 2 only
+    edit(path, 2)
+    assert convert() == [] # same polygons in a new file
+    manifest = load_manifest(output_path(str(tmp_path), MANIFEST_NAME))
+    assert manifest['layers']['1']['parameters']['zmax'] == 2
@@ -0,0 +1,48 @@
+'''STL files written through a memory map (gdsii_stl.MappedStl) against numpy-stl.'''
+
+import numpy as np
+import pytest
+
+gdspy = pytest.importorskip('gdspy')
+mesh = pytest.importorskip('stl.mesh')
+
+import gdsiistl
+from gdsii_stl import MappedStl
+
+def stl_body(filename):
+    # everything after the 80 byte header, which holds the date
+    with open(filename, 'rb') as f:
+        return f.read()[80:]
+
+def test_rows_match_numpy_stl(tmp_path):
+    vectors = np.random.default_rng(0).uniform(-5, 5, (1000, 3, 3)).astype(np.float32)
+    reference = mesh.Mesh(np.zeros(len(vectors), dtype=mesh.Mesh.dtype))
+    reference.vectors[:] = vectors
+    reference.save(str(tmp_path / 'reference.stl'))
+
+    stl_file = MappedStl(str(tmp_path / 'mapped.stl'), len(vectors))
+    for start, stop in ((0, 300), (300, 300), (300, 999), (999, 1000)):
+        with stl_file.rows(start, stop) as out:
+            out[:] = vectors[start:stop]
+    assert stl_body(tmp_path / 'mapped.stl') == stl_body(tmp_path / 'reference.stl')
+
+def write_gds(path):
+    child = gdspy.Cell('CHILD', exclude_from_current=True)
+    child.add(gdspy.Round((0, 0), 1, inner_radius=0.4, layer=1))
+    top = gdspy.Cell('TOP', exclude_from_current=True)
+    top.add(gdspy.CellArray(child, 4, 3, (3, 3)))
+    for index in range(20):
+        top.add(gdspy.Polygon([(0, 0), (3, 0), (3, 1), (1, 1), (1, 3), (0, 3)], layer=1).translate(4*index, -10))
+    library = gdspy.GdsLibrary()
+    library.add([child, top])
+    library.write_gds(path)
+
+@pytest.mark.parametrize('hierarchy', [False, True])
+def test_conversion_matches_numpy_stl(tmp_path, monkeypatch, hierarchy):
+    path = str(tmp_path / 'a.gds')
+    write_gds(path)
+    layerstack = {1: (0, 1, 'metal')}
+    expected = stl_body(gdsiistl.gdsiistl(path, layerstack, workers=0, hierarchy=hierarchy)[1])
+    monkeypatch.setattr(gdsiistl, 'MAPPED_CHUNK_TRIANGLES', 500) # several chunks and placement blocks
+    mapped = gdsiistl.gdsiistl(path, layerstack, workers=0, hierarchy=hierarchy, mapped_output=True)[1]
+    assert stl_body(mapped) == expected
@@ -0,0 +1,35 @@
+'''Merging the overlapping polygons of a layer (gdsii_boolean.merge_polygons).'''
+
+import numpy as np
+import pytest
+
+pytest.importorskip('gdspy')
+
+from gdsii_boolean import merge_polygons
+from gdsii_geometry import pack_polygons, signed_areas
+
+def area(vertices, offsets):
+    return np.abs(signed_areas(vertices, offsets)).sum()/2 # signed_areas gives twice the area
+
+def rectangle(x, y, width, height):
+    return np.array([(x, y), (x+width, y), (x+width, y+height), (x, y+height)], dtype=np.float64)
+
+def test_overlap_is_removed():
+    # two overlapping squares, a square inside another one, and a separate one
+    vertices, offsets = pack_polygons([rectangle(0, 0, 2, 2), rectangle(1, 1, 2, 2),
+                                       rectangle(10, 0, 4, 4), rectangle(11, 1, 1, 1),
+                                       rectangle(20, 0, 1, 1)])
+    merged, merged_offsets = merge_polygons(vertices, offsets)
+    assert len(merged_offsets)-1 == 3
+    assert area(merged, merged_offsets) == pytest.approx(7 + 16 + 1)
+
+def test_untiled_merge_has_no_seams():
+    # a long row of overlapping squares is one solid, also when it is large
+    # enough to be tiled
+    vertices, offsets = pack_polygons([rectangle(i, 0, 1.5, 1) for i in range(200)])
+    merged, merged_offsets = merge_polygons(vertices, offsets)
+    assert len(merged_offsets)-1 == 1
+    assert area(merged, merged_offsets) == pytest.approx(200.5)
+    tiled, tiled_offsets = merge_polygons(vertices, offsets, polygons_per_tile=20)
+    assert len(tiled_offsets)-1 > 1 # cut along the tile borders
+    assert area(tiled, tiled_offsets) == pytest.approx(200.5)
@@ -0,0 +1,75 @@
+'''The path outlines of the streaming reader against those of gdspy.
+
+Both readers give every path the same vertices, in the same order, with one
+exception: gdspy splits outlines of more than 199 vertices (its max_points)
+into several polygons, while the streaming reader keeps one polygon.
+'''
+
+import warnings
+
+import numpy as np
+import pytest
+
+gdspy = pytest.importorskip('gdspy')
+
+from gdsii_reader import path_polygon
+from gdsiistl import gdsiistl
+
+ENDS = {0: 'flush', 1: 'round', 2: 'extended', 4: (0.3, 0.7)} # GDSII pathtype: gdspy ends
+STL_RECORD = np.dtype([('normal', '<f4', (3,)), ('corners', '<f4', (3, 3)), ('attribute', '<u2')])
+
+def area(polygon):
+    x, y = polygon[:, 0], polygon[:, 1]
+    return 0.5*abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+def gdspy_polygons(points, width, pathtype):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore') # gdspy warns about sharp corners
+        path = gdspy.FlexPath(np.array(points, dtype=np.float64), width, ends=ENDS[pathtype],
+                              gdsii_path=True, max_points=0)
+        return path.get_polygons()
+
+@pytest.mark.parametrize('pathtype', sorted(ENDS))
+@pytest.mark.parametrize('points', [
+    [(0, 0), (5, 0), (0, 1)], # acute bends, cut off half a width past the path
+    [(0, 0), (5, 0), (1, 3)],
+    [(0, 0), (5, 0), (0, 0.001), (6, 1)],
+    [(0, 0), (5, 0), (5, 5), (0, 5)], # right angles, mitered
+    [(0, 0), (5, 0), (10, 0)], # straight
+    [(0, 0), (5, 0)],
+    [(0, 0), (5, 0), (5, 0)], # repeated point
+])
+def test_bends_match_gdspy(points, pathtype):
+    polygon = path_polygon(points, 0.5, pathtype, 0.3, 0.7)
+    expected, = gdspy_polygons(points, 0.5, pathtype)
+    assert area(polygon) == pytest.approx(area(expected), rel=1e-9)
+    np.testing.assert_allclose(polygon, expected, atol=1e-12)
+
+def test_random_paths_match_gdspy():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        points = rng.uniform(0, 10, (rng.integers(2, 8), 2))
+        width, pathtype = rng.uniform(0.05, 2), int(rng.choice(sorted(ENDS)))
+        expected, = gdspy_polygons(points, width, pathtype)
+        np.testing.assert_allclose(path_polygon(points, width, pathtype, 0.3, 0.7), expected, atol=1e-12)
+
+def read_stl(filename):
+    return np.fromfile(filename, dtype=STL_RECORD, offset=84)['corners'].astype(np.float64)
+
+def test_readers_convert_paths_alike(tmp_path):
+    rng = np.random.default_rng(1)
+    cell = gdspy.Cell('TOP', exclude_from_current=True)
+    for index in range(40):
+        points = np.cumsum(rng.uniform(-1, 1, (rng.integers(2, 30), 2)), axis=0) + (3*index, 0)
+        ends = ENDS[(0, 1, 2, 4)[index % 4]]
+        cell.add(gdspy.FlexPath(points, rng.uniform(0.1, 0.5), ends=ends, gdsii_path=True, layer=1))
+    library = gdspy.GdsLibrary()
+    library.add(cell)
+    path = str(tmp_path / 'paths.gds')
+    library.write_gds(path)
+
+    corners = [read_stl(gdsiistl(path, {1: (0, 1, 'metal')}, workers=1, streaming=streaming)[1])
+               for streaming in (False, True)]
+    assert len(corners[0]) == len(corners[1])
+    volumes = [np.einsum('ij,ij->i', c[:, 0], np.cross(c[:, 1], c[:, 2])).sum()/6 for c in corners]
+    assert volumes[1] == pytest.approx(volumes[0], rel=1e-6)
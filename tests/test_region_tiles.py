@@ -0,0 +1,72 @@
+'''Converting a region of a layout, and writing layers as tiles.'''
+
+import os
+import json
+
+import numpy as np
+import pytest
+
+gdspy = pytest.importorskip('gdspy')
+
+from gdsiistl import gdsiistl
+
+STL_RECORD = np.dtype([('normal', '<f4', (3,)), ('corners', '<f4', (3, 3)), ('attribute', '<u2')])
+DELTA = 0.01 # inset of every polygon edge (see gdsiistl)
+
+def read_stl(filename):
+    return np.fromfile(filename, dtype=STL_RECORD, offset=84)['corners'].astype(np.float64)
+
+def volume(corners):
+    return np.einsum('ij,ij->i', corners[:, 0], np.cross(corners[:, 1], corners[:, 2])).sum()/6
+
+def write_gds(path):
+    # unit squares every 2 units, 10 x 10 of them
+    square = gdspy.Cell('SQUARE', exclude_from_current=True)
+    square.add(gdspy.Rectangle((0, 0), (1, 1), layer=1))
+    top = gdspy.Cell('TOP', exclude_from_current=True)
+    top.add(gdspy.CellArray(square, 10, 10, (2, 2)))
+    library = gdspy.GdsLibrary()
+    library.add([square, top])
+    library.write_gds(path)
+
+@pytest.mark.parametrize('streaming', [False, True])
+@pytest.mark.parametrize('hierarchy', [False, True])
+def test_region(tmp_path, hierarchy, streaming):
+    path = str(tmp_path / 'squares.gds')
+    write_gds(path)
+    region = (0.5, 0.5, 9.5, 9.5)
+    corners = read_stl(gdsiistl(path, {1: (0, 1, 'metal')}, workers=0, hierarchy=hierarchy,
+                                streaming=streaming, region=region)[1])
+    points = corners.reshape(-1, 3)
+    assert np.all(points[:, :2] >= np.array(region[:2]) - 1e-6)
+    assert np.all(points[:, :2] <= np.array(region[2:]) + 1e-6)
+    # per axis a half square and four whole ones are left, each inset on both sides
+    assert volume(corners) == pytest.approx((0.5 + 4 - 5*2*DELTA)**2, rel=1e-6)
+
+def test_tiles_hold_all_triangles(tmp_path):
+    path = str(tmp_path / 'squares.gds')
+    write_gds(path)
+    layerstack = {1: (0, 1, 'metal')}
+    full = read_stl(gdsiistl(path, layerstack, workers=0)[1])
+    index_file = gdsiistl(path, layerstack, workers=0, tile_size=5)[1]
+    with open(index_file) as f:
+        index = json.load(f)
+    assert index['tile_size'] == 5
+    assert sorted((tile['column'], tile['row']) for tile in index['tiles']) == \
+           [(column, row) for column in range(4) for row in range(4)]
+
+    tiles = []
+    for tile in index['tiles']:
+        corners = read_stl(os.path.join(os.path.dirname(index_file), tile['file']))
+        assert len(corners) == tile['triangles']
+        # every triangle is in the tile that holds its centroid
+        centroids = corners[:, :, :2].mean(axis=1)
+        assert np.all(np.floor(centroids/5) == (tile['column'], tile['row']))
+        points = corners.reshape(-1, 3)
+        np.testing.assert_allclose(tile['bounds'], np.concatenate((points.min(axis=0), points.max(axis=0))),
+                                   atol=1e-6)
+        tiles.append(corners)
+    tiles = np.concatenate(tiles)
+    # the same triangles as the single file, in another order
+    rows = lambda corners: np.sort(corners.reshape(len(corners), -1).view(f'V{9*8}').ravel())
+    assert np.array_equal(rows(tiles), rows(full))
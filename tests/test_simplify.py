@@ -0,0 +1,48 @@
+'''Simplifying curved outlines (gdsii_simplify.simplify_polygons).'''
+
+import numpy as np
+import pytest
+
+from gdsii_geometry import pack_polygons, signed_areas
+from gdsii_simplify import simplify_polygons
+
+def circle(center, radius, corners, clockwise=False):
+    angles = np.linspace(0, 2*np.pi, corners, endpoint=False)
+    points = np.stack((radius*np.cos(angles), radius*np.sin(angles)), axis=1) + center
+    return points[::-1] if clockwise else points
+
+def perimeters(vertices, offsets):
+    return np.array([np.hypot(*np.diff(np.vstack((polygon, polygon[:1])), axis=0).T).sum()
+                     for polygon in np.split(vertices, offsets[1:-1])])
+
+def ring(center, outer, inner, corners):
+    # a disc with a hole, the way GDSII stores it: along the outline, in to
+    # the hole along a cut line, around the hole the other way and back out
+    outline = circle(center, outer, corners)
+    hole = np.roll(circle(center, inner, corners, clockwise=True), 1, axis=0) # from angle 0, clockwise
+    return np.concatenate((outline, outline[:1], hole, hole[:1]))
+
+@pytest.mark.parametrize('tolerance', [1e-3, 1e-2, 0.1])
+def test_orientation_and_area_are_kept(tolerance):
+    vertices, offsets = pack_polygons([circle((0, 0), 1, 400), circle((5, 0), 2, 1000, clockwise=True),
+                                       np.array([(10, 0), (11, 0), (11, 1), (10, 1)], dtype=np.float64),
+                                       ring((20, 0), 3, 1, 500)])
+    simple, simple_offsets = simplify_polygons(vertices, offsets, tolerance)
+    before, after = signed_areas(vertices, offsets)/2, signed_areas(simple, simple_offsets)/2
+    assert np.all(np.sign(after) == np.sign(before))
+    assert np.all(np.abs(after - before) <= tolerance*perimeters(vertices, offsets))
+    counts = np.diff(simple_offsets)
+    assert counts[0] < 400 and counts[1] < 1000 and counts[2] == 4
+    # the remaining vertices are vertices of the original outlines
+    assert set(map(tuple, simple)) <= set(map(tuple, vertices))
+
+def test_cut_line_is_kept():
+    vertices, offsets = pack_polygons([ring((0, 0), 3, 1, 500)])
+    simple, _ = simplify_polygons(vertices, offsets, 0.05)
+    points, counts = np.unique(simple, axis=0, return_counts=True)
+    assert {tuple(point) for point in points[counts > 1]} == {(3.0, 0.0), (1.0, 0.0)}
+
+def test_no_tolerance_changes_nothing():
+    vertices, offsets = pack_polygons([circle((0, 0), 1, 100)])
+    assert simplify_polygons(vertices, offsets, None)[0] is vertices
+    assert simplify_polygons(vertices, offsets, 0)[0] is vertices
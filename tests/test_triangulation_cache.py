@@ -0,0 +1,76 @@
+'''The triangulation cache (gdsii_cache.TriangulationCache) and its use by gdsiistl().'''
+
+import os
+
+import numpy as np
+import pytest
+
+gdspy = pytest.importorskip('gdspy')
+
+from gdsiistl import gdsiistl
+from gdsii_cache import TriangulationCache
+from gdsii_geometry import pack_polygons
+
+def polygons(count, shift=0.0):
+    # L shapes, which are not convex and so go to the triangulation engine
+    return [np.array([(0, 0), (3, 0), (3, 1), (1, 1), (1, 3), (0, 3)], dtype=np.float64) + (4*p + shift, 0)
+            for p in range(count)]
+
+def test_hit_miss_and_trim(tmp_path):
+    cache = TriangulationCache(str(tmp_path), chunk_polygons=4)
+    vertices, offsets = pack_polygons(polygons(10))
+    chunks = cache.chunks(vertices, offsets, delta=0.01)
+    assert [(start, stop) for start, stop, _ in chunks] == [(0, 4), (4, 8), (8, 10)]
+    assert cache.chunks(vertices, offsets, delta=0.02)[0][2] != chunks[0][2] # parameters are part of the key
+
+    entry = dict(vertices=np.arange(6.0).reshape(3, 2))
+    assert cache.get(chunks[0][2]) is None
+    cache.put(chunks[0][2], entry)
+    np.testing.assert_array_equal(cache.get(chunks[0][2])['vertices'], entry['vertices'])
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # moving a polygon of the last chunk only changes the key of that chunk
+    moved = polygons(10)
+    moved[9] = moved[9] + 0.5
+    assert [key for _, _, key in cache.chunks(*pack_polygons(moved), delta=0.01)][:2] == \
+           [key for _, _, key in chunks[:2]]
+
+    # trim removes the least recently used entries first
+    for start, stop, key in chunks[1:]:
+        cache.put(key, entry)
+    for age, (_, _, key) in enumerate(chunks):
+        os.utime(cache._file(key), (1000+age, 1000+age))
+    size = os.path.getsize(cache._file(chunks[0][2]))
+    cache.max_bytes = 2*size
+    assert cache.trim() <= 2*size
+    assert [cache.get(key) is None for _, _, key in chunks] == [True, False, False]
+    assert cache.clear() == 2*size and cache.size() == 0
+
+def test_no_polygons_is_one_empty_chunk(tmp_path):
+    cache = TriangulationCache(str(tmp_path))
+    assert [(start, stop) for start, stop, _ in cache.chunks(np.zeros((0, 2)), np.zeros(1, dtype=np.int64))] == [(0, 0)]
+
+def write_gds(path, shift):
+    cell = gdspy.Cell('TOP', exclude_from_current=True)
+    for polygon in polygons(30):
+        cell.add(gdspy.Polygon(polygon, layer=1))
+    cell.add(gdspy.Polygon(polygons(1, shift)[0] + (200, 0), layer=1)) # in the last chunk
+    library = gdspy.GdsLibrary()
+    library.add(cell)
+    library.write_gds(path)
+
+def test_edit_triangulates_only_its_chunk(tmp_path):
+    path = str(tmp_path / 'shapes.gds')
+    layerstack = {1: (0, 1, 'metal')}
+    cache = TriangulationCache(str(tmp_path / 'cache'), chunk_polygons=8)
+    write_gds(path, 0)
+    with open(gdsiistl(path, layerstack, workers=0, cache=False)[1], 'rb') as f:
+        uncached = f.read()[80:]
+    for shift, misses in ((0, 4), (0, 0), (0.5, 1)):
+        cache.hits = cache.misses = 0
+        write_gds(path, shift)
+        with open(gdsiistl(path, layerstack, workers=0, cache=cache)[1], 'rb') as f:
+            stl = f.read()[80:]
+        assert (cache.hits, cache.misses) == (4-misses, misses)
+        if shift == 0:
+            assert stl == uncached